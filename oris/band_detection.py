@@ -2,14 +2,18 @@ from typing import List
 
 import numpy as np
 
-from object_detector import ObjectDetectorOptions, ObjectDetector
+from object_detector import ObjectDetectorOptions, ObjectDetector, Detection
 from detected_object import DetectedBand
+from frame_ring import FrameRing, FrameRegion
 
 import multiprocessing
 import multiprocessing.connection
 
 import ctypes
 import statistics
+import time
+
+import metrics
 
 import logging
 logger = logging.getLogger(__name__)
@@ -80,23 +84,59 @@ class BandDetectionResult:
             band.draw_bounding_box(image)
             band.draw_statistics(image)
 
+def create_detector(num_threads: int = 3) -> ObjectDetector:
+    """
+    Creates the ObjectDetector detecting resistor color bands.
+    Args:
+        num_threads: The number of CPU threads used by the interpreter.
+    """
+    options = ObjectDetectorOptions(num_threads=num_threads, score_threshold=0.3, max_results=5, enable_edgetpu=False)
+    return ObjectDetector(model_path=TFLITE_MODEL_PATH, options=options)
+
+def detections_to_result(detections: List[Detection]) -> BandDetectionResult:
+    """
+    Converts the raw output of the ObjectDetector into a BandDetectionResult object.
+    """
+    detected_bands = []
+    for detection in detections:
+        category = detection.categories[0]
+        bounding_box = [
+            detection.bounding_box.left, detection.bounding_box.top,
+            detection.bounding_box.right, detection.bounding_box.bottom
+        ]
+        detected_bands.append(DetectedBand(category.index, category.label, category.score, bounding_box))
+    return BandDetectionResult(detected_bands)
+
+def detect_bands(detector: ObjectDetector, image: np.ndarray) -> BandDetectionResult:
+    """
+    Detects the resistor color bands on an image.
+    Args:
+        detector: The ObjectDetector created by create_detector().
+        image: The RGB image to perform the detection upon.
+    """
+    return detections_to_result(detector.detect(image))
+
 class BandDetectionProcess(multiprocessing.Process):
-    def __init__(self, conn: multiprocessing.connection.Connection):
+    def __init__(self, conn: multiprocessing.connection.Connection, ring: FrameRing = None):
         """
         Initializes the BandDetectionProcess object.
         Args:
             conn: The Connection object for receiving inputs and sending outputs.
+            ring: The ring of the CameraStreamProcess, to read FrameRegion inputs from.
         Notes:
             conn must be duplex. For conn, its input is the image to perform the detection upon,
-            and its output is the BandDetectionResult object containing the detection results.
+            or a FrameRegion of a frame in ring, which is copied out of the shared memory here
+            instead of being pickled through conn. Its output is the BandDetectionResult object
+            containing the detection results, which has no bands if the frame of a FrameRegion
+            was overwritten before it was read.
         """
         super().__init__()
         self.conn = conn
+        self.ring = ring
         self.e_stop = multiprocessing.Event()
         self.s_recv_ready = multiprocessing.Value(ctypes.c_bool, True, lock=False)
 
-        self.options = ObjectDetectorOptions(num_threads=3, score_threshold=0.3, max_results=5, enable_edgetpu=False)
-        self.detector = ObjectDetector(model_path=TFLITE_MODEL_PATH, options=self.options)
+        self.detector = create_detector()
     
     def run(self):
         """
@@ -111,18 +151,14 @@ class BandDetectionProcess(multiprocessing.Process):
             self.s_recv_ready.value = False
 
             image = self.conn.recv()
-            detections = self.detector.detect(image)
-
-            detected_bands = []
-            for detection in detections:
-                category = detection.categories[0]
-                bounding_box = [
-                    detection.bounding_box.left, detection.bounding_box.top,
-                    detection.bounding_box.right, detection.bounding_box.bottom
-                ]
-                detected_bands.append(DetectedBand(category.index, category.label, category.score, bounding_box))
-            
-            result = BandDetectionResult(detected_bands)
+            if isinstance(image, FrameRegion):
+                image = self.ring.read_region(image)
+            if image is None:
+                result = BandDetectionResult([])
+            else:
+                t_start = time.perf_counter()
+                result = detect_bands(self.detector, image)
+                metrics.inference_seconds.observe(time.perf_counter() - t_start)
             self.conn.send(result)
             self.s_recv_ready.value = True
 
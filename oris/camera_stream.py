@@ -1,38 +1,73 @@
-from typing import Tuple
+from typing import NamedTuple, Optional, Tuple
 
-import picamera
 import numpy as np
+import multiprocessing
+import math
 import threading
+import time
+
+from frame_source import CaptureGeometry, FrameSource, create_frame_source
+from frame_ring import FrameRing
+from yuv_frame import get_yuv_shape
+from utils import FPSCounter
+import metrics
 
 import logging
 logger = logging.getLogger(__name__)
 
 CAMERA_USE_VIDEO_PORT = True
 CAMERA_ROTATION = 0
+CAMERA_SOURCE = 'picamera'      # the frame source, see create_frame_source(), e.g. "images:../dataset/resistor_band_dataset/dataset_raw"
+
+class CameraFrame(NamedTuple):
+    image: np.ndarray       # the read-only RGB frame, the YUV420 frame in 'yuv' format, or the preview with a CaptureGeometry
+    seq: int                # the number of the frame, counting from 1
+    timestamp: float        # the time.monotonic() at which the frame was captured
+    roi: Optional[np.ndarray] = None    # the read-only region of interest with a CaptureGeometry
 
 class CameraStreamThread(threading.Thread):
-    def __init__(self, resolution: Tuple[int], fps: int):
+    def __init__(self, resolution: Tuple[int], fps: int, source: FrameSource = None,
+                       geometry: CaptureGeometry = None, pixel_format: str = 'rgb'):
         """
         Initializes the CameraStreamThread object.
         Args:
             resolution: The resolution for camera capturing given by a tuple of (width, height).
             fps: The frames per second for camera capturing.
+            source: The source to capture from, defaults to the one given by CAMERA_SOURCE.
+            geometry: Captures a preview and a region of interest instead of full frames, if given.
+            pixel_format: 'rgb', or 'yuv' to capture full frames in YUV420, see yuv_frame.
+        Raises:
+            ValueError: If the pixel format is unknown, or 'yuv' is combined with a geometry.
         """
         super().__init__()
+        shapes = _get_frame_shapes(resolution, geometry, pixel_format)
         self.resolution = resolution
         self.fps = fps
+        self.geometry = geometry
+        self.pixel_format = pixel_format
 
         self.e_stop    = threading.Event()
         self.e_suspend = threading.Event()
         self.e_resume  = threading.Event()
 
-        self.camera = picamera.PiCamera()
-        self.camera.resolution = self.resolution
-        self.camera.framerate = self.fps
-        self.camera.rotation = CAMERA_ROTATION
+        if source is None:
+            source = _create_camera_source(CAMERA_SOURCE, self.resolution, self.fps)
+        self.source = source
+
+        # triple buffering: the capture thread fills the back buffer and swaps it with the ready one,
+        # and the reader swaps the ready one with the front one it reads from
+        self._buffers = [_zeros(shapes[0]) for _ in range(3)]
+        self._roi_buffers = [_zeros(shapes[1]) for _ in range(3)]
+        self._views = [_readonly_view(x) for x in self._buffers]
+        self._roi_views = [_readonly_view(x) for x in self._roi_buffers]
+        self._swap_lock = threading.Lock()
+        self._back, self._ready, self._front = 0, 1, 2
+        self._ready_seq = 0
+        self._ready_timestamp = 0.0
+        self._ready_fresh = False       # whether the ready buffer holds a frame the reader has not taken
+        self._front_frame = CameraFrame(self._views[self._front], 0, 0.0, self._roi_views[self._front])
 
-        self.buffer = np.empty((self.resolution[1], self.resolution[0], 3), dtype=np.uint8)
-        self.frame  = self.buffer.copy()
+        self.fps_counter = FPSCounter()
     
     def run(self):
         """
@@ -41,15 +76,28 @@ class CameraStreamThread(threading.Thread):
         """
         logger.info('CameraStreamThread started.')
 
-        for frame in self.camera.capture_continuous(self.buffer, format='rgb', use_video_port=CAMERA_USE_VIDEO_PORT):
+        frames = _capture_frames(self.source, self.geometry, self.pixel_format, self._get_back_buffers)
+        t_last = None
+        for _ in frames:
             if self.e_stop.is_set():
                 break
             elif self.e_suspend.is_set():
+                metrics.camera_suspended_frames.inc()
                 self.e_resume.wait()
+                t_last = None
             else:
-                self.frame = self.buffer.copy()
+                timestamp = time.monotonic()
+                self._publish(timestamp)
 
-        self.camera.close()
+                metrics.camera_frames.inc()
+                if t_last is not None:
+                    metrics.camera_frame_interval_seconds.observe(timestamp - t_last)
+                t_last = timestamp
+                self.fps_counter.update()
+                metrics.camera_fps.set(self.fps_counter.fps)
+
+        frames.close()
+        self.source.close()
         logger.info('CameraStreamThread ended.')
 
     def signal_stop(self):
@@ -71,10 +119,252 @@ class CameraStreamThread(threading.Thread):
         self.e_suspend.clear()
         self.e_resume.set()
 
+    def _get_back_buffers(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._buffers[self._back], self._roi_buffers[self._back]
+
+    def _publish(self, timestamp: float):
+        with self._swap_lock:
+            if self._ready_fresh:
+                metrics.camera_dropped_frames.inc()
+            self._back, self._ready = self._ready, self._back
+            self._ready_seq += 1
+            self._ready_timestamp = timestamp
+            self._ready_fresh = True
+
+    def has_new_frame(self, since_seq: int) -> bool:
+        """
+        Returns whether a frame newer than the one numbered since_seq has been captured.
+        """
+        return self._ready_seq > since_seq
+
+    def get_latest(self, since_seq: int = -1) -> Optional[CameraFrame]:
+        """
+        Gets the most recently captured frame, if it is newer than the one numbered since_seq.
+        Args:
+            since_seq: The seq of the last frame the caller has seen.
+        Returns:
+            The frame, or None if no newer frame has been captured. Its image is read-only and stays
+            valid until the next call, so it must be copied to be drawn upon or kept.
+        Notes:
+            Capturing writes into a back buffer and publishing a frame swaps two buffer indices,
+            so frames are neither copied nor allocated, and a frame never changes while it is read.
+            There must be a single reader.
+        """
+        with self._swap_lock:
+            if self._ready_fresh:
+                self._front, self._ready = self._ready, self._front
+                self._front_frame = CameraFrame(self._views[self._front], self._ready_seq, self._ready_timestamp,
+                                                self._roi_views[self._front])
+                self._ready_fresh = False
+                _observe_delivery(self._front_frame)
+            frame = self._front_frame
+        return frame if frame.seq > since_seq else None
+
+    def get_frame(self) -> np.ndarray:
+        """
+        Gets the most recently captured frame from the camera.
+        Returns:
+            The most recently captured frame, which is read-only and valid until the next call.
+        """
+        return self.get_latest().image
+
+class CameraStreamProcess(multiprocessing.Process):
+    def __init__(self, resolution: Tuple[int], fps: int, source_spec: str = None,
+                       geometry: CaptureGeometry = None, pixel_format: str = 'rgb'):
+        """
+        Initializes the CameraStreamProcess object, which captures like the CameraStreamThread
+        but in its own process, so capturing never competes with the GUI for the GIL.
+        Args:
+            resolution: The resolution for camera capturing given by a tuple of (width, height).
+            fps: The frames per second for camera capturing.
+            source_spec: The source to capture from, see create_frame_source(), defaults to CAMERA_SOURCE.
+            geometry: Captures a preview and a region of interest instead of full frames, if given.
+            pixel_format: 'rgb', or 'yuv' to capture full frames in YUV420, see yuv_frame.
+        Raises:
+            ValueError: If the pixel format is unknown, or 'yuv' is combined with a geometry.
+        Notes:
+            Frames are written into a FrameRing in shared memory. The source is opened in the
+            capture process, which owns the camera. Any process forked after this object was
+            created may read the ring.
+        """
+        super().__init__()
+        shapes = _get_frame_shapes(resolution, geometry, pixel_format)
+        self.resolution = resolution
+        self.fps = fps
+        self.source_spec = source_spec or CAMERA_SOURCE
+        self.geometry = geometry
+        self.pixel_format = pixel_format
+
+        self.e_stop    = multiprocessing.Event()
+        self.e_suspend = multiprocessing.Event()
+        self.e_resume  = multiprocessing.Event()
+
+        self.ring = FrameRing(shapes)
+
+        # the reader copies frames out of the ring into its own buffers
+        self._front = [_zeros(shape) for shape in shapes]
+        self._front_frame = CameraFrame(_readonly_view(self._front[0]), 0, 0.0, _readonly_view(self._front[1]))
+
+    def run(self):
+        """
+        Overrides the run() method in the multiprocessing.Process superclass.
+        Runs the mainloop of this object.
+        """
+        logger.info('CameraStreamProcess started.')
+
+        source = _create_camera_source(self.source_spec, self.resolution, self.fps)
+        fps_counter = FPSCounter()
+        frames = _capture_frames(source, self.geometry, self.pixel_format, lambda: tuple(self.ring.begin_write()))
+        t_last = None
+        for _ in frames:
+            if self.e_stop.is_set():
+                self.ring.end_write(publish=False)
+                break
+            elif self.e_suspend.is_set():
+                self.ring.end_write(publish=False)
+                metrics.camera_suspended_frames.inc()
+                self.e_resume.wait()
+                t_last = None
+            else:
+                timestamp = time.monotonic()
+                if self.ring.end_write(timestamp):
+                    metrics.camera_dropped_frames.inc()
+
+                metrics.camera_frames.inc()
+                if t_last is not None:
+                    metrics.camera_frame_interval_seconds.observe(timestamp - t_last)
+                t_last = timestamp
+                fps_counter.update()
+                metrics.camera_fps.set(fps_counter.fps)
+
+        frames.close()
+        source.close()
+        logger.info('CameraStreamProcess ended.')
+
+    def signal_stop(self):
+        """
+        Sends stop signal to this process to terminate it.
+        """
+        self.signal_resume()
+        self.e_stop.set()
+    def signal_suspend(self):
+        """
+        Sends suspend signal to this process to suspend it.
+        """
+        self.e_suspend.set()
+        self.e_resume.clear()
+    def signal_resume(self):
+        """
+        Sends resume signal to this process to resume it.
+        """
+        self.e_suspend.clear()
+        self.e_resume.set()
+
+    def has_new_frame(self, since_seq: int) -> bool:
+        """
+        Returns whether a frame newer than the one numbered since_seq has been captured.
+        """
+        return self.ring.latest_seq > since_seq
+
+    def get_latest(self, since_seq: int = -1) -> Optional[CameraFrame]:
+        """
+        Gets the most recently captured frame, if it is newer than the one numbered since_seq.
+        Args:
+            since_seq: The seq of the last frame the caller has seen.
+        Returns:
+            The frame, or None if no newer frame has been captured. Its image is read-only and stays
+            valid until the next call, so it must be copied to be drawn upon or kept.
+        Notes:
+            The frame is copied out of the ring once, which is the only work capturing costs the
+            calling process. There must be a single reader per process.
+        """
+        read = self.ring.read(self._front, max(since_seq, self._front_frame.seq))
+        if read is not None:
+            self._front_frame = self._front_frame._replace(seq=read[0], timestamp=read[1])
+            _observe_delivery(self._front_frame)
+        frame = self._front_frame
+        return frame if frame.seq > since_seq else None
+
     def get_frame(self) -> np.ndarray:
         """
         Gets the most recently captured frame from the camera.
         Returns:
-            The most recently captured frame.
+            The most recently captured frame, which is read-only and valid until the next call.
         """
-        return self.frame
+        return self.get_latest().image
+
+def get_capture_stats() -> dict:
+    """
+    Gets the capture statistics of the camera thread or process.
+    Returns:
+        A JSON object with the counts of captured frames, of frames taken by the reader, of
+        frames discarded while suspended and of frames overwritten before they were read, plus
+        histograms of the intervals between captured frames and of the age of frames when they
+        were taken, in seconds.
+    Notes:
+        The statistics are read from the shared metrics, so they are available in every process.
+    """
+    def quantile(histogram: metrics.Histogram, q: float) -> Optional[float]:
+        # None without observations or above the last bucket, which JSON cannot represent
+        value = histogram.quantile(q)
+        return value if math.isfinite(value) else None
+
+    def histogram_to_json(histogram: metrics.Histogram) -> dict:
+        _, total, count = histogram.get()
+        return {
+            'buckets': list(histogram.buckets),
+            'counts': histogram.get_counts(),
+            'mean': total / count if count else None,
+            'p50': quantile(histogram, 0.5),
+            'p99': quantile(histogram, 0.99),
+        }
+
+    return {
+        'captured': metrics.camera_frames.get(),
+        'delivered': metrics.camera_delivered_frames.get(),
+        'suspended': metrics.camera_suspended_frames.get(),
+        'overwritten': metrics.camera_dropped_frames.get(),
+        'fps': metrics.camera_fps.get(),
+        'interval': histogram_to_json(metrics.camera_frame_interval_seconds),
+        'age': histogram_to_json(metrics.camera_frame_age_seconds),
+    }
+
+def _observe_delivery(frame: CameraFrame):
+    metrics.camera_delivered_frames.inc()
+    metrics.camera_frame_age_seconds.observe(time.monotonic() - frame.timestamp)
+
+def _get_frame_shapes(resolution: Tuple[int], geometry: Optional[CaptureGeometry],
+                      pixel_format: str) -> Tuple[Tuple[int, ...], Optional[Tuple[int, ...]]]:
+    # the shapes of the image and the region of interest of a frame
+    if pixel_format not in ('rgb', 'yuv'):
+        raise ValueError(f'"{pixel_format}" is not a valid pixel format')
+    if pixel_format == 'yuv':
+        if geometry is not None:
+            raise ValueError('YUV420 capture is only supported for full frames')
+        return get_yuv_shape(resolution), None
+    if geometry is None:
+        return (resolution[1], resolution[0], 3), None
+    width, height = geometry.preview_resolution
+    return (height, width, 3), (geometry.roi[3], geometry.roi[2], 3)
+
+def _create_camera_source(spec: str, resolution: Tuple[int], fps: int) -> FrameSource:
+    options = {'rotation': CAMERA_ROTATION, 'use_video_port': CAMERA_USE_VIDEO_PORT} if spec == 'picamera' else {}
+    return create_frame_source(spec, resolution, fps, **options)
+
+def _capture_frames(source: FrameSource, geometry: Optional[CaptureGeometry], pixel_format: str, next_buffers):
+    # next_buffers returns the (image, region of interest) buffers to capture the next frame into
+    if pixel_format == 'yuv':
+        return source.yuv_frames(lambda: next_buffers()[0])
+    if geometry is None:
+        return source.frames(lambda: next_buffers()[0])
+    return source.roi_frames(next_buffers, geometry)
+
+def _zeros(shape: Optional[Tuple[int, ...]]) -> Optional[np.ndarray]:
+    return None if shape is None else np.zeros(shape, dtype=np.uint8)
+
+def _readonly_view(buffer: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if buffer is None:
+        return None
+    view = buffer.view()
+    view.flags.writeable = False
+    return view
@@ -0,0 +1,157 @@
+from typing import List, Optional
+
+import collections
+import threading
+import socket
+import json
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+EVENT_HISTORY_SIZE      = 100           # the number of past events replayed to reconnecting clients
+EVENT_HEARTBEAT         = 15            # seconds of silence after which a comment is sent to keep connections alive
+EVENT_MAX_CLIENTS       = 64
+EVENT_MAX_PENDING_BYTES = 64 * 1024     # clients with more unsent data than this are disconnected
+
+class _EventClient:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.pending = bytearray()
+
+class EventStream(threading.Thread):
+    def __init__(self, history_size: int = EVENT_HISTORY_SIZE, heartbeat: float = EVENT_HEARTBEAT,
+                       max_clients: int = EVENT_MAX_CLIENTS, max_pending_bytes: int = EVENT_MAX_PENDING_BYTES):
+        """
+        Initializes the EventStream object, which is a thread pushing server-sent events to all
+        attached clients.
+        Args:
+            history_size: The number of past events replayed to clients reconnecting with a Last-Event-ID.
+            heartbeat: Seconds of silence after which a comment is sent to every client.
+            max_clients: The maximum number of attached clients.
+            max_pending_bytes: The maximum amount of unsent data of a client before it is disconnected.
+        Notes:
+            A single thread serves all clients with non-blocking sends, and every event is serialized
+            once, so the cost of an event does not depend on the number of watching browsers beyond
+            one send() per client. Slow clients are disconnected instead of slowing down the others.
+        """
+        super().__init__(daemon=True)
+        self.heartbeat = heartbeat
+        self.max_clients = max_clients
+        self.max_pending_bytes = max_pending_bytes
+
+        self._cond = threading.Condition()
+        self._history = collections.deque(maxlen=history_size)  # (event_id, message), oldest first
+        self._last_id = 0
+        self._sent_id = 0
+        self._new_clients: List[_EventClient] = []
+        self._clients: List[_EventClient] = []
+
+        self.e_stop = threading.Event()
+
+    def publish(self, event: str, data: dict):
+        """
+        Publishes an event to all attached clients. This never blocks on the clients.
+        Args:
+            event: The event type.
+            data: The JSON-serializable event data.
+        """
+        with self._cond:
+            self._last_id += 1
+            message = f'id: {self._last_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+            self._history.append((self._last_id, message))
+            self._cond.notify()
+
+    def attach(self, sock: socket.socket, last_event_id: Optional[int] = None) -> bool:
+        """
+        Hands a client connection over to this thread. The response headers must have been sent.
+        Args:
+            sock: The client socket. This thread owns and closes it from now on.
+            last_event_id: The id of the last event the client received before reconnecting, if any.
+        Returns:
+            Whether the client was attached. If not, the caller still owns the socket.
+        """
+        with self._cond:
+            if self.e_stop.is_set() or len(self._clients) + len(self._new_clients) >= self.max_clients:
+                return False
+            client = _EventClient(sock)
+            if last_event_id is not None:
+                for event_id, message in self._history:
+                    if last_event_id < event_id <= self._sent_id:
+                        client.pending += message
+            self._new_clients.append(client)
+            self._cond.notify()
+        return True
+
+    def get_client_count(self) -> int:
+        """
+        Returns the number of attached clients.
+        """
+        return len(self._clients) + len(self._new_clients)
+
+    def run(self):
+        """
+        Overrides the run() method in the threading.Thread superclass.
+        Runs the mainloop of this object.
+        """
+        logger.info('EventStream started.')
+
+        t_last_send = time.monotonic()
+        while not self.e_stop.is_set():
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self.e_stop.is_set() or self._new_clients or self._last_id > self._sent_id,
+                    timeout=1
+                )
+                for client in self._new_clients:
+                    client.sock.setblocking(False)
+                self._clients += self._new_clients
+                self._new_clients = []
+                messages = b''.join(m for i, m in self._history if i > self._sent_id)
+                self._sent_id = self._last_id
+
+            if not messages and time.monotonic() - t_last_send >= self.heartbeat:
+                messages = b': heartbeat\n\n'
+            if messages:
+                t_last_send = time.monotonic()
+
+            for client in list(self._clients):
+                client.pending += messages
+                if not self._flush(client):
+                    self._drop(client)
+
+        for client in self._clients + self._new_clients:
+            self._close(client)
+        self._clients = self._new_clients = []
+        logger.info('EventStream ended.')
+
+    def _flush(self, client: _EventClient) -> bool:
+        try:
+            while client.pending:
+                sent = client.sock.send(client.pending)
+                del client.pending[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            return False
+        return len(client.pending) <= self.max_pending_bytes
+
+    def _drop(self, client: _EventClient):
+        self._clients.remove(client)
+        self._close(client)
+
+    @staticmethod
+    def _close(client: _EventClient):
+        try:
+            client.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        client.sock.close()
+
+    def signal_stop(self):
+        """
+        Sends stop signal to this thread to terminate it. All attached connections are closed.
+        """
+        with self._cond:
+            self.e_stop.set()
+            self._cond.notify()
@@ -0,0 +1,164 @@
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import multiprocessing
+import numpy as np
+
+FRAME_RING_SLOTS      = 4     # frames kept in the ring, a reader has slots - 1 frame intervals to copy one out
+FRAME_RING_READ_TRIES = 4     # attempts of a read overtaken by the writer before it gives up
+FRAME_REGION_BORDER   = 128   # the value of the border padded around a FrameRegion
+
+class FrameRegion(NamedTuple):
+    seq: int                            # the frame to read from the ring
+    index: int                          # the array of the frame to read from, e.g. 1 for a region of interest
+    rect: Tuple[int, int, int, int]     # the [x, y, w, h] of the region within the array
+    border: Tuple[int, int] = (0, 0)    # the (x, y) width of the FRAME_REGION_BORDER padded around the region
+
+class FrameRing:
+    def __init__(self, shapes: Sequence[Optional[Tuple[int, ...]]], slots: int = FRAME_RING_SLOTS):
+        """
+        Initializes the FrameRing object, a ring of frame slots in shared memory which one process
+        writes and other processes read.
+        Args:
+            shapes: The shapes of the uint8 arrays making up one frame, e.g. an image and a region
+                    of interest. A None shape stands for an absent array.
+            slots: The number of slots in the ring.
+        Notes:
+            Every slot is guarded by a sequence lock. The writer makes the version of a slot odd
+            before it writes into the slot and even again afterwards, and a reader accepts a copy
+            of a slot only if its version was even and unchanged across the copy. The pixels are
+            copied without holding any lock, so the writer never waits for a slow reader.
+            The versions and the other slot metadata are only accessed under a process-shared
+            lock, held for a few stores at a time. Its acquire and release order the pixel stores
+            and loads against the metadata, which the plain stores into the RawArrays would not
+            guarantee on the weakly ordered ARM cores of the Pi.
+            The ring must be created before the processes using it are forked.
+        """
+        self.shapes = [None if shape is None else tuple(shape) for shape in shapes]
+        self.slots = slots
+        sizes = [0 if shape is None else int(np.prod(shape)) for shape in self.shapes]
+        self.frame_size = sum(sizes)
+
+        self._lock = multiprocessing.Lock()
+        self._data = multiprocessing.RawArray('B', self.frame_size * slots)
+        self._versions = multiprocessing.RawArray('q', slots)      # slot -> seqlock version, odd while written
+        self._seqs = multiprocessing.RawArray('q', slots)          # slot -> seq of the frame it holds, 0 if none
+        self._timestamps = multiprocessing.RawArray('d', slots)    # slot -> timestamp of the frame it holds
+        self._latest_seq = multiprocessing.RawValue('q', 0)        # the seq of the newest complete frame
+        self._read_seq = multiprocessing.RawValue('q', 0)          # the seq of the newest frame a reader took
+
+        data = np.frombuffer(self._data, dtype=np.uint8)
+        self._arrays: List[List[Optional[np.ndarray]]] = []       # slot -> the arrays of the frame
+        for slot in range(slots):
+            offset = slot * self.frame_size
+            arrays = []
+            for shape, size in zip(self.shapes, sizes):
+                arrays.append(None if shape is None else data[offset:offset + size].reshape(shape))
+                offset += size
+            self._arrays.append(arrays)
+        self._write_slot: int = None
+
+    @property
+    def latest_seq(self) -> int:
+        """
+        The seq of the newest complete frame, counting from 1, or 0 if there is none yet.
+        """
+        with self._lock:
+            return self._latest_seq.value
+
+    def begin_write(self) -> List[Optional[np.ndarray]]:
+        """
+        Starts writing the next frame.
+        Returns:
+            The arrays of the slot to write the frame into, which are valid until end_write().
+        """
+        if self._write_slot is None:
+            with self._lock:
+                self._write_slot = (self._latest_seq.value + 1) % self.slots
+                self._versions[self._write_slot] += 1
+                self._seqs[self._write_slot] = 0
+        return self._arrays[self._write_slot]
+
+    def end_write(self, timestamp: float = 0.0, publish: bool = True) -> bool:
+        """
+        Finishes writing the frame begun by begin_write().
+        Args:
+            timestamp: The time the frame was captured at.
+            publish: Whether to publish the frame to the readers, otherwise it is discarded.
+        Returns:
+            Whether a published frame replaced one no reader had taken.
+        """
+        slot, self._write_slot = self._write_slot, None
+        if slot is None:
+            return False
+        with self._lock:
+            self._versions[slot] += 1
+            if not publish:
+                return False
+            seq = self._latest_seq.value + 1
+            self._seqs[slot] = seq
+            self._timestamps[slot] = timestamp
+            self._latest_seq.value = seq
+            return self._read_seq.value < seq - 1
+
+    def _begin_read(self, seq: Optional[int]) -> Optional[Tuple[int, int, int, float]]:
+        # returns the seq, slot, version and timestamp of frame seq, or of the latest frame if None
+        with self._lock:
+            if seq is None:
+                seq = self._latest_seq.value
+            slot = seq % self.slots
+            version = self._versions[slot]
+            if seq == 0 or version % 2 or self._seqs[slot] != seq:
+                return None
+            return seq, slot, version, self._timestamps[slot]
+
+    def _end_read(self, seq: int, slot: int, version: int) -> bool:
+        # returns whether the slot still holds frame seq unchanged since _begin_read()
+        with self._lock:
+            if self._versions[slot] != version or self._seqs[slot] != seq:
+                return False
+            if seq > self._read_seq.value:
+                self._read_seq.value = seq
+            return True
+
+    def read(self, outs: Sequence[Optional[np.ndarray]], since_seq: int = -1) -> Optional[Tuple[int, float]]:
+        """
+        Copies the newest frame out of the ring, if it is newer than the one numbered since_seq.
+        Args:
+            outs: The arrays to copy the frame into, of the shapes of the ring.
+            since_seq: The seq of the last frame the caller has seen.
+        Returns:
+            The seq and the timestamp of the copied frame, or None if there is no newer frame or
+            the writer kept overwriting it while it was copied.
+        """
+        for _ in range(FRAME_RING_READ_TRIES):
+            if self.latest_seq <= since_seq:
+                return None
+            begin = self._begin_read(None)
+            if begin is None:
+                continue
+            seq, slot, version, timestamp = begin
+            for out, array in zip(outs, self._arrays[slot]):
+                if array is not None:
+                    np.copyto(out, array)
+            if self._end_read(seq, slot, version):
+                return seq, timestamp
+        return None
+
+    def read_region(self, region: FrameRegion) -> Optional[np.ndarray]:
+        """
+        Copies a region of a frame out of the ring, padded with its border.
+        Returns:
+            The region, or None if the frame is no longer, or not yet, in the ring.
+        """
+        begin = self._begin_read(region.seq)
+        if begin is None:
+            return None
+        seq, slot, version, _ = begin
+        x, y, w, h = region.rect
+        border_x, border_y = region.border
+        array = self._arrays[slot][region.index]
+        out = np.full((h + 2 * border_y, w + 2 * border_x) + array.shape[2:], FRAME_REGION_BORDER, dtype=np.uint8)
+        out[border_y:border_y + h, border_x:border_x + w] = array[y:y + h, x:x + w]
+        if not self._end_read(seq, slot, version):
+            return None
+        return out
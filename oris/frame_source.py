@@ -0,0 +1,559 @@
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from yuv_frame import rgb_to_yuv, yuv_to_rgb
+
+import numpy as np
+import itertools
+import threading
+import time
+import cv2
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+IMAGE_SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+IMAGE_SOURCE_CACHE_BYTES = 64 * 1024**2     # decoded replay frames kept in memory, the rest is decoded on every pass
+PACER_MAX_LAG = 0.25                        # seconds a paced source may fall behind before its schedule restarts
+
+class FramePacer:
+    def __init__(self, fps: float):
+        """
+        Initializes the FramePacer object, which releases frames on a fixed schedule.
+        Args:
+            fps: The frames per second to pace to.
+        Notes:
+            Frames are scheduled at multiples of 1/fps from the first frame, rather than sleeping
+            1/fps after each frame, so the time spent producing a frame does not lower the rate.
+            A short delay is caught up with, while a long one, like a suspension, restarts the schedule.
+        """
+        self.interval = 1 / fps
+        self.t_next = None
+
+    def wait(self):
+        """
+        Waits until the next frame is due.
+        """
+        now = time.perf_counter()
+        if self.t_next is None or now - self.t_next > PACER_MAX_LAG:
+            self.t_next = now
+        elif self.t_next > now:
+            time.sleep(self.t_next - now)
+        self.t_next += self.interval
+
+class CaptureGeometry:
+    def __init__(self, resolution: Tuple[int, int], preview_resolution: Tuple[int, int], roi: Tuple[int, int, int, int]):
+        """
+        Initializes the CaptureGeometry object, which describes a capture delivering a downscaled
+        preview of the whole frame plus a full-resolution crop of a region of interest, and maps
+        coordinates between them.
+        Args:
+            resolution: The resolution of the full frame given by a tuple of (width, height).
+            preview_resolution: The resolution of the preview given by a tuple of (width, height).
+            roi: The region of interest as [x, y, w, h] in full-frame coordinates.
+        Raises:
+            ValueError: If the region of interest is not within the frame.
+        """
+        self.resolution = tuple(resolution)
+        self.preview_resolution = tuple(preview_resolution)
+        self.roi = tuple(roi)
+
+        x, y, w, h = self.roi
+        if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > self.resolution[0] or y + h > self.resolution[1]:
+            raise ValueError(f'The region of interest {list(roi)} is not within the frame')
+        self.scale_x = self.preview_resolution[0] / self.resolution[0]
+        self.scale_y = self.preview_resolution[1] / self.resolution[1]
+
+    def to_preview(self, x: float, y: float) -> Tuple[int, int]:
+        """
+        Maps a point from full-frame to preview coordinates.
+        """
+        return round(x * self.scale_x), round(y * self.scale_y)
+
+    def to_full(self, x: float, y: float) -> Tuple[int, int]:
+        """
+        Maps a point from preview to full-frame coordinates, e.g. a touch on the preview.
+        """
+        return round(x / self.scale_x), round(y / self.scale_y)
+
+    def roi_to_preview(self, x: float, y: float) -> Tuple[int, int]:
+        """
+        Maps a point from region of interest to preview coordinates, e.g. a detected bounding box.
+        """
+        return self.to_preview(self.roi[0] + x, self.roi[1] + y)
+
+    def roi_rect_to_preview(self, x: int, y: int, w: int, h: int) -> Tuple[int, int, int, int]:
+        """
+        Maps a rectangle [x, y, w, h] from region of interest to preview coordinates.
+        """
+        left, top = self.roi_to_preview(x, y)
+        right, bottom = self.roi_to_preview(x + w, y + h)
+        return left, top, right - left, bottom - top
+
+class FrameSource:
+    def __init__(self, resolution: Tuple[int, int], fps: float):
+        """
+        Initializes the FrameSource object, the interface of everything the CameraStreamThread
+        can capture from.
+        Args:
+            resolution: The resolution of the frames given by a tuple of (width, height).
+            fps: The frames per second to deliver.
+        """
+        self.resolution = tuple(resolution)
+        self.fps = fps
+
+    def frames(self, next_buffer: Callable[[], np.ndarray]) -> Iterator[np.ndarray]:
+        """
+        Captures frames continuously, like PiCamera.capture_continuous().
+        Args:
+            next_buffer: Returns the (height, width, 3) RGB array the next frame is written into.
+                         It is called once per frame, so the consumer can hand out a different
+                         buffer every time.
+        Returns:
+            An iterator yielding each filled buffer, at the rate of the source. It ends when the
+            source is exhausted.
+        """
+        raise NotImplementedError()
+
+    def yuv_frames(self, next_buffer: Callable[[], np.ndarray]) -> Iterator[np.ndarray]:
+        """
+        Captures YUV420 (I420) frames continuously.
+        Args:
+            next_buffer: Returns the array of the shape given by yuv_frame.get_yuv_shape() the next
+                         frame is written into, called once per frame.
+        Returns:
+            An iterator yielding each filled buffer, at the rate of the source.
+        Notes:
+            This implementation captures RGB frames and converts them in software. Sources which
+            can deliver YUV420 directly override it.
+        """
+        scratch = np.empty((self.resolution[1], self.resolution[0], 3), dtype=np.uint8)
+        for frame in self.frames(lambda: scratch):
+            buffer = next_buffer()
+            rgb_to_yuv(frame, dst=buffer)
+            yield buffer
+
+    def roi_frames(self, next_buffers: Callable[[], Tuple[np.ndarray, np.ndarray]],
+                         geometry: CaptureGeometry) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Captures previews and region of interest crops continuously.
+        Args:
+            next_buffers: Returns the preview and region of interest arrays the next frame is
+                          written into, called once per frame.
+            geometry: The geometry of the capture.
+        Returns:
+            An iterator yielding each filled pair of buffers, at the rate of the source.
+        Notes:
+            This implementation captures full frames and scales and crops them in software.
+            Sources which can deliver the two parts directly override it.
+        """
+        x, y, w, h = geometry.roi
+        scratch = np.empty((geometry.resolution[1], geometry.resolution[0], 3), dtype=np.uint8)
+        for frame in self.frames(lambda: scratch):
+            preview, roi = next_buffers()
+            cv2.resize(frame, geometry.preview_resolution, dst=preview, interpolation=cv2.INTER_AREA)
+            np.copyto(roi, frame[y:y+h, x:x+w])
+            yield preview, roi
+
+    def close(self):
+        """
+        Releases the resources of this source.
+        """
+
+class PiCameraSource(FrameSource):
+    def __init__(self, resolution: Tuple[int, int], fps: float, rotation: int = 0, use_video_port: bool = True):
+        """
+        Initializes the PiCameraSource object, which captures from the Raspberry Pi camera.
+        Args:
+            rotation: The rotation of the camera image in degrees.
+            use_video_port: Whether to capture from the video port, which is faster than the still port.
+        """
+        super().__init__(resolution, fps)
+        import picamera
+        self.use_video_port = use_video_port
+
+        self.camera = picamera.PiCamera()
+        self.camera.resolution = self.resolution
+        self.camera.framerate = self.fps
+        self.camera.rotation = rotation
+
+    def frames(self, next_buffer: Callable[[], np.ndarray]) -> Iterator[np.ndarray]:
+        output = _BufferOutput(next_buffer)
+        for _ in self.camera.capture_continuous(output, format='rgb', use_video_port=self.use_video_port):
+            yield output.take()
+
+    def yuv_frames(self, next_buffer: Callable[[], np.ndarray]) -> Iterator[np.ndarray]:
+        """
+        Overrides the yuv_frames() method in the FrameSource superclass.
+        Notes:
+            The GPU delivers YUV420 at 1.5 bytes per pixel instead of 3 for RGB, without converting.
+            The rows must not be padded, so the width must be a multiple of 32 and the height a
+            multiple of 16.
+        """
+        if self.resolution[0] % 32 or self.resolution[1] % 16:
+            raise ValueError('The width must be a multiple of 32 and the height of 16 for unpadded YUV planes')
+        output = _BufferOutput(next_buffer)
+        for _ in self.camera.capture_continuous(output, format='yuv', use_video_port=self.use_video_port):
+            yield output.take()
+
+    def roi_frames(self, next_buffers: Callable[[], Tuple[np.ndarray, np.ndarray]],
+                         geometry: CaptureGeometry) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Overrides the roi_frames() method in the FrameSource superclass.
+        Notes:
+            The preview is captured from a second splitter port, downscaled by the GPU resizer,
+            and only the rows of the region of interest are copied out of the full-resolution
+            frames. The camera zoom would crop every port alike, so it cannot isolate the region
+            of interest without also cropping the preview. The preview is the latest one completed
+            when the region of interest arrives, at most one frame apart.
+        """
+        if geometry.preview_resolution[0] % 32 or self.resolution[0] % 32:
+            raise ValueError('Frame and preview widths must be multiples of 32 for unpadded RGB rows')
+        width, height = geometry.preview_resolution
+        preview_buffers = [np.zeros((height, width, 3), dtype=np.uint8) for _ in range(3)]
+        latest_preview = [preview_buffers[0]]
+        e_stop = threading.Event()
+
+        def capture_previews():
+            buffers = itertools.cycle(preview_buffers)
+            output = _BufferOutput(lambda: next(buffers))
+            for _ in self.camera.capture_continuous(output, format='rgb', use_video_port=True,
+                                                    resize=geometry.preview_resolution, splitter_port=1):
+                latest_preview[0] = output.take()
+                if e_stop.is_set():
+                    break
+
+        preview_thread = threading.Thread(target=capture_previews, daemon=True)
+        preview_thread.start()
+        output = _RoiOutput(next_buffers, self.resolution[0], geometry.roi)
+        try:
+            for _ in self.camera.capture_continuous(output, format='rgb', use_video_port=True, splitter_port=0):
+                preview, roi = output.take()
+                np.copyto(preview, latest_preview[0])
+                yield preview, roi
+        finally:
+            e_stop.set()
+
+    def close(self):
+        self.camera.close()
+
+class VideoCaptureSource(FrameSource):
+    def __init__(self, resolution: Tuple[int, int], fps: float, device: Union[int, str] = 0,
+                       loop: bool = True, pace: bool = None):
+        """
+        Initializes the VideoCaptureSource object, which captures from a USB camera or a video file
+        through OpenCV.
+        Args:
+            device: The index of the camera, or the path of the video file.
+            loop: Whether to restart a video file when it ends.
+            pace: Whether to pace the frames to fps, defaults to True for video files. Cameras pace
+                  themselves.
+        Raises:
+            ValueError: If the device cannot be opened.
+        """
+        super().__init__(resolution, fps)
+        self.device = device
+        self.is_file = not isinstance(device, int)
+        self.loop = loop and self.is_file
+        self.pace = self.is_file if pace is None else pace
+
+        self.capture = cv2.VideoCapture(device)
+        if not self.capture.isOpened():
+            raise ValueError(f'Cannot open the video device "{device}"')
+        if not self.is_file:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+            self.capture.set(cv2.CAP_PROP_FPS, self.fps)
+
+    def frames(self, next_buffer: Callable[[], np.ndarray]) -> Iterator[np.ndarray]:
+        pacer = FramePacer(self.fps) if self.pace else None
+        bgr = None
+        while True:
+            buffer = next_buffer()
+            ok, bgr = self.capture.read(bgr)
+            if not ok:
+                if self.loop and self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                    ok, bgr = self.capture.read()
+                if not ok:
+                    logger.info(f'The video device "{self.device}" has no more frames.')
+                    return
+            _convert_frame(bgr, buffer)
+            if pacer is not None:
+                pacer.wait()
+            yield buffer
+
+    def close(self):
+        self.capture.release()
+
+class ImageDirectorySource(FrameSource):
+    def __init__(self, resolution: Tuple[int, int], fps: float, path: str, loop: bool = True,
+                       cache_bytes: int = IMAGE_SOURCE_CACHE_BYTES):
+        """
+        Initializes the ImageDirectorySource object, which replays the images of a directory in
+        filename order, such as dataset/resistor_band_dataset/dataset_raw.
+        Args:
+            path: The image directory.
+            loop: Whether to restart from the first image after the last one.
+            cache_bytes: The memory for keeping decoded frames between passes.
+        Raises:
+            ValueError: If the directory cannot be read or contains no images.
+        """
+        super().__init__(resolution, fps)
+        self.path = path
+        self.loop = loop
+        self.cache_bytes = cache_bytes
+
+        try:
+            filenames = os.listdir(path)
+        except OSError as error:
+            raise ValueError(f'Cannot read the image directory "{path}": {error}')
+        self.filepaths = sorted(os.path.join(path, x) for x in filenames if x.lower().endswith(IMAGE_SOURCE_EXTENSIONS))
+        if not self.filepaths:
+            raise ValueError(f'"{path}" contains no images')
+        self._cache: List[Optional[np.ndarray]] = [None] * len(self.filepaths)
+
+    def _load(self, i: int, buffer: np.ndarray) -> bool:
+        if self._cache[i] is not None:
+            np.copyto(buffer, self._cache[i])
+            return True
+        image = cv2.imread(self.filepaths[i], cv2.IMREAD_COLOR)
+        if image is None:
+            logger.warning(f'Skipping the unreadable image "{self.filepaths[i]}".')
+            return False
+        _convert_frame(image, buffer)
+        if self.cache_bytes >= buffer.nbytes:
+            self.cache_bytes -= buffer.nbytes
+            self._cache[i] = buffer.copy()
+        return True
+
+    def frames(self, next_buffer: Callable[[], np.ndarray]) -> Iterator[np.ndarray]:
+        pacer = FramePacer(self.fps)
+        while True:
+            n_loaded = 0
+            for i in range(len(self.filepaths)):
+                buffer = next_buffer()
+                if not self._load(i, buffer):
+                    continue
+                n_loaded += 1
+                pacer.wait()
+                yield buffer
+            if not self.loop or not n_loaded:
+                return
+
+class SyntheticSource(FrameSource):
+    _BACKGROUND = (40, 40, 40)
+    _BODY       = (222, 196, 150)
+    _BANDS      = [(150, 75, 0), (0, 0, 0), (255, 0, 0), (212, 175, 55)]   # brown, black, red, gold in RGB
+
+    def __init__(self, resolution: Tuple[int, int], fps: float, period: float = 4):
+        """
+        Initializes the SyntheticSource object, which generates frames of a resistor sliding back
+        and forth, without any camera or files.
+        Args:
+            period: Seconds for the resistor to slide back and forth once.
+        """
+        super().__init__(resolution, fps)
+        self.period = period
+
+        width, height = self.resolution
+        self._background = np.empty((height, width, 3), dtype=np.uint8)
+        self._background[:] = self._BACKGROUND
+        self._background[:, :, 2] = np.linspace(20, 80, width, dtype=np.uint8)
+
+    def draw(self, buffer: np.ndarray, t: float):
+        """
+        Draws the frame at time t into buffer.
+        """
+        width, height = self.resolution
+        body_w, body_h = width // 4, height // 8
+        x = int((width - body_w) / 2 * (1 + 0.5 * np.sin(2 * np.pi * t / self.period)))
+        y = (height - body_h) // 2
+
+        np.copyto(buffer, self._background)
+        cv2.line(buffer, (0, y + body_h // 2), (width - 1, y + body_h // 2), (180, 180, 180), max(body_h // 8, 1))
+        cv2.rectangle(buffer, (x, y), (x + body_w, y + body_h), self._BODY, -1)
+        band_w = body_w // 12
+        for i, color in enumerate(self._BANDS):
+            band_x = x + body_w // 6 + i * 2 * band_w + (band_w if i == len(self._BANDS) - 1 else 0)
+            cv2.rectangle(buffer, (band_x, y), (band_x + band_w, y + body_h), color, -1)
+
+    def frames(self, next_buffer: Callable[[], np.ndarray]) -> Iterator[np.ndarray]:
+        pacer = FramePacer(self.fps)
+        n = 0
+        while True:
+            buffer = next_buffer()
+            self.draw(buffer, n / self.fps)
+            n += 1
+            pacer.wait()
+            yield buffer
+
+class _BufferOutput:
+    def __init__(self, next_buffer: Callable[[], np.ndarray]):
+        """
+        Initializes the _BufferOutput object, a file-like output for PiCamera which writes every
+        frame into the buffer handed out by next_buffer.
+        """
+        self.next_buffer = next_buffer
+        self._buffer: np.ndarray = None
+        self._view: memoryview = None
+        self._offset = 0
+
+    def write(self, data: bytes) -> int:
+        if self._buffer is None:
+            self._buffer = self.next_buffer()
+            self._view = memoryview(self._buffer).cast('B')
+            self._offset = 0
+        n = min(len(data), len(self._view) - self._offset)
+        self._view[self._offset:self._offset + n] = memoryview(data)[:n]
+        self._offset += n
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> np.ndarray:
+        """
+        Returns the buffer of the completed frame; the next write starts a new frame.
+        """
+        buffer, self._buffer = self._buffer, None
+        return buffer
+
+class _RoiOutput:
+    def __init__(self, next_buffers: Callable[[], Tuple[np.ndarray, np.ndarray]], width: int,
+                       roi: Tuple[int, int, int, int]):
+        """
+        Initializes the _RoiOutput object, a file-like output for PiCamera which receives full RGB
+        frames and only copies the region of interest out of them.
+        """
+        self.next_buffers = next_buffers
+        self.stride = width * 3
+        self.roi = roi
+        self._buffers: Tuple[np.ndarray, np.ndarray] = None
+        self._view: memoryview = None
+        self._offset = 0
+
+    def write(self, data: bytes) -> int:
+        if self._buffers is None:
+            self._buffers = self.next_buffers()
+            self._view = memoryview(self._buffers[1]).cast('B')
+            self._offset = 0
+        x, y, w, h = self.roi
+        data = memoryview(data)
+        start, end = self._offset, self._offset + len(data)
+        for row in range(max(y, start // self.stride), min(y + h, (end - 1) // self.stride + 1)):
+            lo = max(row * self.stride + x * 3, start)
+            hi = min(row * self.stride + (x + w) * 3, end)
+            if lo < hi:
+                dst = (row - y) * w * 3 + lo - (row * self.stride + x * 3)
+                self._view[dst:dst + hi - lo] = data[lo - start:hi - start]
+        self._offset = end
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the buffers of the completed frame; the next write starts a new frame.
+        """
+        buffers, self._buffers = self._buffers, None
+        return buffers
+
+def _convert_frame(bgr: np.ndarray, buffer: np.ndarray):
+    height, width = buffer.shape[:2]
+    if bgr.shape[:2] != (height, width):
+        bgr = cv2.resize(bgr, (width, height), interpolation=cv2.INTER_AREA)
+    cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=buffer)
+
+def create_frame_source(spec: str, resolution: Tuple[int, int], fps: float, **options) -> FrameSource:
+    """
+    Creates a frame source from its specification.
+    Args:
+        spec: "picamera", "synthetic", "video:<camera index or video file>" or "images:<directory>".
+        resolution: The resolution of the frames given by a tuple of (width, height).
+        fps: The frames per second to deliver.
+        options: Keyword arguments for the PiCameraSource.
+    Raises:
+        ValueError: If spec is not a valid specification or the source cannot be opened.
+    """
+    kind, _, arg = spec.partition(':')
+    if kind == 'picamera':
+        return PiCameraSource(resolution, fps, **options)
+    if kind == 'synthetic':
+        return SyntheticSource(resolution, fps)
+    if kind == 'video' and arg:
+        return VideoCaptureSource(resolution, fps, int(arg) if arg.isdigit() else arg)
+    if kind == 'images' and arg:
+        return ImageDirectorySource(resolution, fps, arg)
+    raise ValueError(f'"{spec}" is not a valid frame source')
+
+def main():
+    """
+    Measures the capture throughput of a frame source through the CameraStreamThread, or the
+    CameraStreamProcess with --process, and the lateness of the consumer loop.
+    """
+    import argparse
+    from camera_stream import CameraStreamThread, CameraStreamProcess
+    import metrics
+
+    parser = argparse.ArgumentParser(description='Measure the throughput of a frame source.')
+    parser.add_argument('source', help='"picamera", "synthetic", "video:<index or file>" or "images:<directory>"')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--read-fps', type=float, default=None, help='rate of the simulated consumer, defaults to --fps')
+    parser.add_argument('--preview', default=None, help='capture a WxH preview plus the region of interest')
+    parser.add_argument('--roi', default='375,175,300,300', help='the region of interest x,y,w,h with --preview or --format yuv')
+    parser.add_argument('--format', choices=('rgb', 'yuv'), default='rgb',
+                        help='with yuv, the consumer converts the region of interest and the --preview size lazily')
+    parser.add_argument('--process', action='store_true', help='capture in a separate process writing to shared memory')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    resolution = (args.width, args.height)
+    roi = [int(x) for x in args.roi.split(',')]
+    preview_resolution = tuple(int(x) for x in args.preview.split('x')) if args.preview else None
+    geometry = None
+    if preview_resolution and args.format == 'rgb':
+        geometry = CaptureGeometry(resolution, preview_resolution, roi)
+    if args.process:
+        thread = CameraStreamProcess(resolution, args.fps, args.source, geometry, pixel_format=args.format)
+    else:
+        source = create_frame_source(args.source, resolution, args.fps)
+        thread = CameraStreamThread(resolution, args.fps, source, geometry, pixel_format=args.format)
+    pacer = FramePacer(args.read_fps or args.fps)
+
+    thread.start()
+    t_start = time.perf_counter()
+    n_read = 0
+    t_convert = 0.0
+    lateness = []
+    while time.perf_counter() - t_start < args.seconds and thread.is_alive():
+        t_due = pacer.t_next
+        pacer.wait()
+        if t_due is not None:
+            lateness.append(time.perf_counter() - t_due)
+        image = thread.get_frame()
+        if args.format == 'yuv':
+            t_frame = time.perf_counter()
+            yuv_to_rgb(image, rect=roi)
+            yuv_to_rgb(image, size=preview_resolution)
+            t_convert += time.perf_counter() - t_frame
+        n_read += 1
+    thread.signal_stop()
+    thread.join()
+    t_total = time.perf_counter() - t_start
+
+    n_frames = metrics.camera_frames.get()
+    print(f'captured: {n_frames:.0f} frames, {n_frames / t_total:.2f} fps')
+    print(f'read:     {n_read} frames, {n_read / t_total:.2f} fps')
+    print(f'dropped:  {metrics.camera_dropped_frames.get():.0f} frames')
+    if args.format == 'yuv' and n_read:
+        print(f'convert:  {t_convert / n_read * 1000:.2f} ms per frame read')
+    if lateness:
+        p50, p99 = np.percentile(lateness, [50, 99]) * 1000
+        print(f'lateness: {p50:.2f} ms median, {p99:.2f} ms p99, {max(lateness) * 1000:.2f} ms max of the consumer loop')
+
+if __name__ == '__main__':
+    main()
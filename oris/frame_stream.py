@@ -0,0 +1,560 @@
+from typing import Callable, List, Optional, Tuple
+
+from band_detection import BandDetectionResult, BandDetectionProcess
+from remote_detection import decode_image, result_to_json
+
+import multiprocessing
+import multiprocessing.connection
+import numpy as np
+import collections
+import threading
+import argparse
+import socket
+import struct
+import json
+import time
+import cv2
+
+import logging
+logger = logging.getLogger(__name__)
+
+FRAME_SERVER_PORT       = 8090
+FRAME_WINDOW            = 8                 # frames a client may have in flight, granted as credits
+FRAME_QUEUE_DEPTH       = 2                 # frames queued per client before the oldest is dropped
+FRAME_MAX_CLIENTS       = 4
+FRAME_MAX_PAYLOAD       = 16 * 1024**2      # the maximum size of one message payload
+
+PROTOCOL_VERSION        = 1
+
+# message types
+MSG_HELLO       = 1     # client -> server, JSON {"version", "window"}
+MSG_WELCOME     = 2     # server -> client, JSON {"version", "window", "queue_depth", "max_payload"}
+MSG_FRAME_JPEG  = 3     # client -> server, a JPEG or PNG encoded RGB frame
+MSG_FRAME_RAW   = 4     # client -> server, _RAW_HEADER followed by the uint8 RGB pixels
+MSG_RESULT      = 5     # server -> client, JSON result of the frame with the same sequence number
+MSG_DROPPED     = 6     # server -> client, the frame with this sequence number was skipped
+MSG_ERROR       = 7     # server -> client, JSON {"error"}, the connection is closed afterwards
+
+# every message: type, flags, reserved, sequence number, payload length
+_HEADER         = struct.Struct('<BBHQI')
+_RAW_HEADER     = struct.Struct('<HHH')     # height, width, channels
+
+class FrameProtocolError(Exception):
+    def __init__(self, error_msg='The peer violated the frame protocol'):
+        super().__init__()
+        self.error_msg = error_msg
+
+    def __str__(self):
+        return f'{type(self).__name__}: {self.error_msg}'
+
+def pack_message(msg_type: int, seq: int = 0, payload: bytes = b'') -> bytes:
+    """
+    Packs one protocol message.
+    """
+    return _HEADER.pack(msg_type, 0, 0, seq, len(payload)) + payload
+
+def pack_raw_frame(image: np.ndarray) -> bytes:
+    """
+    Packs an RGB image into the payload of a MSG_FRAME_RAW message.
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    channels = image.shape[2] if image.ndim == 3 else 1
+    return _RAW_HEADER.pack(height, width, channels) + image.data.tobytes()
+
+def unpack_raw_frame(payload: bytes) -> np.ndarray:
+    """
+    Unpacks the payload of a MSG_FRAME_RAW message.
+    Raises:
+        FrameProtocolError: If the payload is not a valid RGB frame.
+    """
+    if len(payload) < _RAW_HEADER.size:
+        raise FrameProtocolError('The raw frame is truncated')
+    height, width, channels = _RAW_HEADER.unpack_from(payload)
+    if channels != 3 or len(payload) != _RAW_HEADER.size + height * width * channels:
+        raise FrameProtocolError('The raw frame is not a complete RGB image')
+    return np.frombuffer(payload, dtype=np.uint8, offset=_RAW_HEADER.size).reshape(height, width, channels)
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return bytes(buffer)
+
+def recv_message(sock: socket.socket, max_payload: int = FRAME_MAX_PAYLOAD) -> Optional[Tuple[int, int, bytes]]:
+    """
+    Receives one protocol message.
+    Returns:
+        The type, the sequence number and the payload of the message, or None if the peer closed
+        the connection.
+    Raises:
+        FrameProtocolError: If the payload is larger than max_payload.
+    """
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    msg_type, _, _, seq, length = _HEADER.unpack(header)
+    if length > max_payload:
+        raise FrameProtocolError(f'The payload of {length} bytes exceeds {max_payload} bytes')
+    payload = _recv_exact(sock, length) if length else b''
+    if payload is None:
+        return None
+    return msg_type, seq, payload
+
+class _FrameClient:
+    def __init__(self, sock: socket.socket, address, window: int):
+        self.sock = sock
+        self.address = address
+        self.window = window
+
+        self.pending = collections.deque()  # (seq, image, t_recv), oldest first
+        self.in_flight = 0                  # frames received but not yet answered
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def send(self, msg_type: int, seq: int = 0, payload: bytes = b''):
+        with self._send_lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(pack_message(msg_type, seq, payload))
+            except OSError:
+                self.closed = True
+
+    def close(self):
+        with self._send_lock:
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class FrameStreamServer(threading.Thread):
+    def __init__(self, host: str = '0.0.0.0', port: int = FRAME_SERVER_PORT, window: int = FRAME_WINDOW,
+                       queue_depth: int = FRAME_QUEUE_DEPTH, max_clients: int = FRAME_MAX_CLIENTS,
+                       process_factory: Callable = BandDetectionProcess):
+        """
+        Initializes the FrameStreamServer object, which serves the band detection to remote scanners
+        streaming frames over TCP.
+        Args:
+            host: The address to listen on.
+            port: The port to listen on, or 0 for any free port.
+            window: The maximum number of frames a client may have in flight.
+            queue_depth: The number of frames queued per client before the oldest one is dropped.
+            max_clients: The maximum number of connected clients.
+            process_factory: Creates the detection process from the child end of a duplex pipe.
+        Notes:
+            Clients pipeline up to window frames and get one credit back with every MSG_RESULT or
+            MSG_DROPPED. A client thread decodes the frames of its connection, and a single dispatcher
+            feeds the BandDetectionProcess round-robin from the client queues. When detection falls
+            behind, the oldest queued frames are dropped, so results stay at most queue_depth frames
+            behind the live stream.
+        """
+        super().__init__(daemon=True)
+        self.window = window
+        self.queue_depth = queue_depth
+        self.max_clients = max_clients
+        self.process_factory = process_factory
+
+        self.sock = socket.create_server((host, port))
+        self.sock.settimeout(1)
+        self.port = self.sock.getsockname()[1]
+
+        self._cond = threading.Condition()
+        self._clients: List[_FrameClient] = []
+        self._next_client = 0
+
+        self.n_frames = 0
+        self.n_dropped = 0
+
+        self.e_stop = threading.Event()
+
+    def run(self):
+        """
+        Overrides the run() method in the threading.Thread superclass.
+        Runs the mainloop of this object.
+        """
+        logger.info(f'FrameStreamServer started on port {self.port}.')
+
+        p_conn, c_conn = multiprocessing.Pipe(duplex=True)
+        detection_proc = self.process_factory(c_conn)
+        detection_proc.start()
+        dispatcher = threading.Thread(target=self._dispatch, args=(p_conn,), daemon=True)
+        dispatcher.start()
+
+        while not self.e_stop.is_set():
+            try:
+                sock, address = self.sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(sock, address), daemon=True).start()
+
+        self.sock.close()
+        with self._cond:
+            self._cond.notify_all()
+            clients = list(self._clients)
+        for client in clients:
+            self._close_client(client)
+        dispatcher.join()
+        detection_proc.signal_stop()
+        detection_proc.join()
+        logger.info('FrameStreamServer ended.')
+
+    def _serve_client(self, sock: socket.socket, address):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = None
+        try:
+            message = recv_message(sock, max_payload=4096)
+            if message is None:
+                return
+            msg_type, _, payload = message
+            try:
+                hello = json.loads(payload) if msg_type == MSG_HELLO else None
+            except ValueError:
+                hello = None
+            if not isinstance(hello, dict) or hello.get('version') != PROTOCOL_VERSION:
+                sock.sendall(pack_message(MSG_ERROR, 0, json.dumps({'error': 'Unsupported protocol'}).encode()))
+                return
+
+            try:
+                window = max(1, min(int(hello.get('window') or self.window), self.window))
+            except (TypeError, ValueError, OverflowError):
+                sock.sendall(pack_message(MSG_ERROR, 0, json.dumps({'error': 'The window is not a number'}).encode()))
+                return
+            client = _FrameClient(sock, address, window)
+            with self._cond:
+                if len(self._clients) >= self.max_clients:
+                    client = None
+                else:
+                    self._clients.append(client)
+            if client is None:
+                sock.sendall(pack_message(MSG_ERROR, 0, json.dumps({'error': 'Too many clients'}).encode()))
+                return
+            client.send(MSG_WELCOME, 0, json.dumps({
+                'version': PROTOCOL_VERSION, 'window': window,
+                'queue_depth': self.queue_depth, 'max_payload': FRAME_MAX_PAYLOAD,
+            }).encode())
+            logger.info(f'Frame client {address} connected.')
+
+            while not self.e_stop.is_set():
+                message = recv_message(sock)
+                if message is None:
+                    break
+                msg_type, seq, payload = message
+                if msg_type == MSG_FRAME_JPEG:
+                    image = decode_image(payload)
+                elif msg_type == MSG_FRAME_RAW:
+                    image = unpack_raw_frame(payload)
+                else:
+                    raise FrameProtocolError(f'Unexpected message type {msg_type}')
+                self._enqueue(client, seq, image)
+        except (FrameProtocolError, ValueError) as error:
+            logger.warning(f'Frame client {address} disconnected: {error}')
+            if client is not None:
+                client.send(MSG_ERROR, 0, json.dumps({'error': str(error)}).encode())
+        except OSError:
+            pass
+        finally:
+            if client is not None:
+                self._close_client(client)
+                logger.info(f'Frame client {address} disconnected.')
+            else:
+                sock.close()
+
+    def _enqueue(self, client: _FrameClient, seq: int, image: np.ndarray):
+        dropped = None
+        with self._cond:
+            if client.in_flight >= client.window:
+                raise FrameProtocolError('The client exceeded its window')
+            client.in_flight += 1
+            if len(client.pending) >= self.queue_depth:
+                dropped = client.pending.popleft()[0]
+                client.in_flight -= 1
+                self.n_dropped += 1
+            client.pending.append((seq, image, time.monotonic()))
+            self._cond.notify()
+        if dropped is not None:
+            client.send(MSG_DROPPED, dropped)
+
+    def _take_frame(self, timeout: float) -> Optional[Tuple[_FrameClient, int, np.ndarray, float]]:
+        with self._cond:
+            self._cond.wait_for(lambda: self.e_stop.is_set() or any(x.pending for x in self._clients), timeout)
+            n = len(self._clients)
+            for i in range(n):
+                client = self._clients[(self._next_client + i) % n]
+                if client.pending:
+                    self._next_client = (self._next_client + i + 1) % n
+                    return (client,) + client.pending.popleft()
+        return None
+
+    def _dispatch(self, conn: multiprocessing.connection.Connection):
+        while not self.e_stop.is_set():
+            item = self._take_frame(timeout=1)
+            if item is None:
+                continue
+            client, seq, image, t_recv = item
+
+            conn.send(image)
+            while not conn.poll(1):
+                if self.e_stop.is_set():
+                    return
+            result: BandDetectionResult = conn.recv()
+
+            obj = result_to_json(result)
+            obj['latency_ms'] = round((time.monotonic() - t_recv) * 1000, 1)
+            with self._cond:
+                client.in_flight -= 1
+                self.n_frames += 1
+            client.send(MSG_RESULT, seq, json.dumps(obj).encode())
+
+    def _close_client(self, client: _FrameClient):
+        with self._cond:
+            if client in self._clients:
+                self._clients.remove(client)
+            client.pending.clear()
+        client.close()
+
+    def signal_stop(self):
+        """
+        Sends stop signal to this thread to terminate it. All clients are disconnected.
+        """
+        self.e_stop.set()
+
+class FrameStreamClient:
+    def __init__(self, host: str, port: int = FRAME_SERVER_PORT, window: int = FRAME_WINDOW,
+                       on_result: Callable[[int, Optional[dict]], None] = None, timeout: float = 10):
+        """
+        Initializes the FrameStreamClient object, the reference client of the frame streaming protocol.
+        Args:
+            host: The address of the FrameStreamServer.
+            port: The port of the FrameStreamServer.
+            window: The number of frames to keep in flight, capped by the server.
+            on_result: Called from the receiving thread with the sequence number and the JSON result
+                of every frame, or None as the result of a dropped frame.
+            timeout: Seconds to wait for the connection and the handshake.
+        Raises:
+            FrameProtocolError: If the server refuses the connection.
+        """
+        self.on_result = on_result
+
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(pack_message(MSG_HELLO, 0, json.dumps({'version': PROTOCOL_VERSION, 'window': window}).encode()))
+        message = recv_message(self.sock)
+        if message is None or message[0] != MSG_WELCOME:
+            error = json.loads(message[2]).get('error') if message and message[0] == MSG_ERROR else None
+            self.sock.close()
+            raise FrameProtocolError(error or 'The server did not accept the connection')
+        self.sock.settimeout(None)
+
+        welcome = json.loads(message[2])
+        self.window = welcome['window']
+        self.max_payload = welcome['max_payload']
+
+        self._credits = threading.BoundedSemaphore(self.window)
+        self._send_lock = threading.Lock()
+        self._sent_times = {}
+        self._seq = 0
+
+        self.n_results = 0
+        self.n_dropped = 0
+        self.latencies = collections.deque(maxlen=10000)   # round-trip seconds of the latest results
+        self.error: Optional[str] = None
+
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+
+    def send_jpeg(self, data: bytes, timeout: float = None) -> Optional[int]:
+        """
+        Sends a JPEG or PNG encoded frame, waiting for a credit if the window is full.
+        Returns:
+            The sequence number of the frame, or None if no credit became free within timeout.
+        """
+        return self._send(MSG_FRAME_JPEG, data, timeout)
+
+    def send_image(self, image: np.ndarray, jpeg_quality: int = None, timeout: float = None) -> Optional[int]:
+        """
+        Sends an RGB frame, waiting for a credit if the window is full.
+        Args:
+            image: The RGB frame.
+            jpeg_quality: The JPEG quality to encode the frame with, or None to send it raw.
+            timeout: Seconds to wait for a credit, or None to wait forever.
+        Returns:
+            The sequence number of the frame, or None if no credit became free within timeout.
+        """
+        if jpeg_quality is None:
+            return self._send(MSG_FRAME_RAW, pack_raw_frame(image), timeout)
+        ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(image, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        return self._send(MSG_FRAME_JPEG, buffer.tobytes(), timeout)
+
+    def _send(self, msg_type: int, payload: bytes, timeout: float) -> Optional[int]:
+        if self.error is not None:
+            raise FrameProtocolError(self.error)
+        if not self._credits.acquire(timeout=timeout):
+            return None
+        with self._send_lock:
+            self._seq += 1
+            seq = self._seq
+            self._sent_times[seq] = time.monotonic()
+            self.sock.sendall(pack_message(msg_type, seq, payload))
+        return seq
+
+    def _receive(self):
+        try:
+            while True:
+                message = recv_message(self.sock)
+                if message is None:
+                    break
+                msg_type, seq, payload = message
+                if msg_type == MSG_ERROR:
+                    self.error = json.loads(payload).get('error', 'Unknown error')
+                    break
+                if msg_type not in (MSG_RESULT, MSG_DROPPED):
+                    continue
+
+                result = None
+                with self._send_lock:
+                    t_sent = self._sent_times.pop(seq, None)
+                if msg_type == MSG_RESULT:
+                    result = json.loads(payload)
+                    self.n_results += 1
+                    if t_sent is not None:
+                        self.latencies.append(time.monotonic() - t_sent)
+                else:
+                    self.n_dropped += 1
+                self._credits.release()
+                if self.on_result is not None:
+                    self.on_result(seq, result)
+        except (OSError, FrameProtocolError):
+            pass
+        finally:
+            if self.error is None:
+                self.error = 'The connection was closed'
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """
+        Waits until every sent frame has been answered.
+        Returns:
+            Whether all frames were answered within timeout.
+        """
+        t_end = None if timeout is None else time.monotonic() + timeout
+        acquired = 0
+        try:
+            while acquired < self.window:
+                remaining = None if t_end is None else max(t_end - time.monotonic(), 0)
+                if not self._credits.acquire(timeout=remaining):
+                    return False
+                acquired += 1
+            return True
+        finally:
+            for _ in range(acquired):
+                self._credits.release()
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._receiver.join()
+
+class _NullDetectionProcess(threading.Thread):
+    """
+    Answers every frame with an empty result, so the benchmark can measure the protocol alone.
+    """
+    def __init__(self, conn: multiprocessing.connection.Connection):
+        super().__init__(daemon=True)
+        self.conn = conn
+        self.e_stop = threading.Event()
+
+    def run(self):
+        while not self.e_stop.is_set():
+            if self.conn.poll(0.1):
+                self.conn.recv()
+                self.conn.send(BandDetectionResult([]))
+
+    def signal_stop(self):
+        self.e_stop.set()
+
+def run_benchmark(n_frames: int = 300, size: Tuple[int, int] = (640, 480), jpeg_quality: int = None,
+                  window: int = FRAME_WINDOW, null_detector: bool = False) -> dict:
+    """
+    Streams synthetic frames through a FrameStreamServer on the loopback interface.
+    Args:
+        n_frames: The number of frames to send.
+        size: The width and height of the frames.
+        jpeg_quality: The JPEG quality of the frames, or None to send them raw.
+        window: The window requested by the client.
+        null_detector: Whether to skip the detection, measuring the protocol overhead only.
+    Returns:
+        The throughput in frames/s, the number of results and dropped frames, and the round-trip
+        latency percentiles in milliseconds.
+    """
+    server = FrameStreamServer('127.0.0.1', 0, process_factory=_NullDetectionProcess if null_detector else BandDetectionProcess)
+    server.start()
+    client = FrameStreamClient('127.0.0.1', server.port, window)
+
+    width, height = size
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    t_start = time.monotonic()
+    for _ in range(n_frames):
+        client.send_image(image, jpeg_quality)
+    client.wait_idle()
+    elapsed = time.monotonic() - t_start
+
+    client.close()
+    server.signal_stop()
+    server.join()
+
+    latencies = np.array(client.latencies) * 1000 if client.latencies else np.zeros(1)
+    return {
+        'frames_per_second': round(client.n_results / elapsed, 1),
+        'results': client.n_results,
+        'dropped': client.n_dropped,
+        'latency_ms': {p: round(float(np.percentile(latencies, q)), 2) for p, q in (('p50', 50), ('p95', 95), ('p99', 99))},
+    }
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Serve or benchmark the frame streaming protocol.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='serve the band detection to remote scanners')
+    serve_parser.add_argument('--port', type=int, default=FRAME_SERVER_PORT)
+
+    bench_parser = subparsers.add_parser('benchmark', help='measure frames/s and latency on the loopback interface')
+    bench_parser.add_argument('--frames', type=int, default=300)
+    bench_parser.add_argument('--width', type=int, default=640)
+    bench_parser.add_argument('--height', type=int, default=480)
+    bench_parser.add_argument('--jpeg', type=int, default=None, metavar='QUALITY', help='send JPEG frames instead of raw ones')
+    bench_parser.add_argument('--window', type=int, default=FRAME_WINDOW)
+    bench_parser.add_argument('--null-detector', action='store_true', help='skip the detection to measure the protocol alone')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = FrameStreamServer(port=args.port)
+        server.start()
+        try:
+            while server.is_alive():
+                server.join(1)
+        except KeyboardInterrupt:
+            server.signal_stop()
+            server.join()
+    else:
+        print(json.dumps(run_benchmark(
+            args.frames, (args.width, args.height), args.jpeg, args.window, args.null_detector
+        ), indent=2))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
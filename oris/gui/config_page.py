@@ -1,9 +1,8 @@
 from web_server import start_http_server, close_http_server
-from record import RECORD_SAVE_PATH
+from retention import clear_all_records
 from . import font
 
 import tkinter as tk
-import os
 
 class ConfigPage(tk.Frame):
     def __init__(self, parent: tk.Frame, controller: tk.Frame):
@@ -66,15 +65,12 @@ class ConfigPage(tk.Frame):
             self.share_record_l.config(text='Record sharing via HTTP server is currently OFF.')
 
     def clear_record_btn_callback(self):
-        os.makedirs(RECORD_SAVE_PATH, exist_ok=True)
-
-        for file in os.scandir(RECORD_SAVE_PATH):
-            if file.is_file():
-                os.remove(file.path)
-                self.clear_record_l.config(text=f'Deleted: "{file.name}"')
-                self.update_idletasks()
-
-        self.clear_record_l.config(text='All scan records have been deleted.')
+        try:
+            clear_all_records()
+        except OSError as error:
+            self.clear_record_l.config(text=f'Clearing the scan records failed: {error.strerror or error}')
+        else:
+            self.clear_record_l.config(text='All scan records have been deleted.')
         self.clear_record_l.after(
             5000,
             lambda: self.clear_record_l.config(text='Clear all saved scan record on this device.')
@@ -1,12 +1,13 @@
 from band_detection import BandDetectionResult
 from resistor import Resistor, ResistorError
 from record import DetectionRecord
+from scan_stats import stats
 
+from .preview_renderer import PreviewRenderer
 from . import font
 
 import tkinter as tk
 import numpy as np
-from PIL import Image, ImageTk
 
 class DResultPage(tk.Frame):
     def __init__(self, parent: tk.Frame, controller: tk.Frame):
@@ -18,7 +19,7 @@ class DResultPage(tk.Frame):
 
         self.canvas = tk.Canvas(self)
         self.canvas.grid(row=0, column=0, rowspan=1, sticky='nsew')
-        self.canvas.image_container = None
+        self.preview_renderer = PreviewRenderer(self.canvas)
 
         self.label = tk.Label(
             self, font=font.NORMAL_LABEL_FONT,
@@ -30,7 +31,7 @@ class DResultPage(tk.Frame):
         self.cont_button = tk.Button(
             self, font=font.NORMAL_BUTTON_FONT,
             text='Continue',
-            command=self.controller.raise_main_page
+            command=self.cont_button_callback
         )
         self.cont_button.grid(row=1, column=1, sticky='nsew')
 
@@ -48,10 +49,16 @@ class DResultPage(tk.Frame):
         # member variables of this frame
         self.detection_image: np.ndarray           = None
         self.detection_result: BandDetectionResult = None
+        self.detection_cycles: int                 = None
+
+    def cont_button_callback(self):
+        stats.record_scan(self.detection_result, saved=False, cycles=self.detection_cycles)
+        self.controller.raise_main_page()
 
     def contsave_button_callback(self):
         detection_record = DetectionRecord(self.detection_image, self.detection_result)
         detection_record.save()
+        stats.record_scan(self.detection_result, saved=True, cycles=self.detection_cycles)
         self.controller.raise_main_page()
 
     def set_label_to_result(self, detection_result: BandDetectionResult):
@@ -82,26 +89,21 @@ class DResultPage(tk.Frame):
         """
         Sets the canvas in this frame to format and display the corresponding image.
         Args:
-            image: The image to display in the canvas.
+            image: The image to display in the canvas, which is downscaled to fit it.
         """
-        pil_image = Image.fromarray(image, mode='RGB')
-        image_tk = ImageTk.PhotoImage(pil_image)
-        self.canvas.image_tk = image_tk
-
-        if self.canvas.image_container is None:
-            self.canvas.image_container = self.canvas.create_image(0, 0, anchor='nw', image=image_tk)
-        else:
-            self.canvas.itemconfig(self.canvas.image_container, image=image_tk)
+        self.preview_renderer.render(image)
 
-    def set_result(self, image: np.ndarray, detection_result: BandDetectionResult):
+    def set_result(self, image: np.ndarray, detection_result: BandDetectionResult, cycles: int = None):
         """
         Sets the result of this frame and update the UI on this frame to reflect the result.
         Args:
             image: The original image used for detection.
             detection_result: The detection result output from the inference.
+            cycles: The number of detection results processed until this result was taken, if known.
         """
         self.detection_image  = image.copy()
         self.detection_result = detection_result
+        self.detection_cycles = cycles
 
         self.detection_result.draw_on_img(image)
         self.set_canvas_to_image(image)
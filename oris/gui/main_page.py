@@ -1,20 +1,34 @@
-from camera_stream import CameraStreamThread
+from typing import Tuple
+
+from camera_stream import CameraStreamThread, CameraStreamProcess, get_capture_stats
+from frame_source import CaptureGeometry
+from yuv_frame import SceneChangeDetector, get_luma, focus_score, yuv_to_rgb
 from band_detection import BandDetectionResult, BandDetectionProcess
-from utils import FPSCounter
+from frame_ring import FrameRegion
+from detected_object import DetectedBand
+from utils import FPSCounter, draw_overlay_text
+from preview_stream import preview_broadcaster
+import metrics
+from .preview_renderer import PreviewRenderer
 from . import font
 
 import multiprocessing
+import time
 
 import tkinter as tk
 import numpy as np
 import cv2
-from PIL import Image, ImageTk
 
 class MainPage(tk.Frame):
     _CAMERA_RESOLUTION    = (1280, 720)
     _CAMERA_FPS           = 30
     _INFERENCE_AREA       = [375, 175, 300, 300]    # the rectangle with [x, y, w, h] on the image to run the inference on
     _INFERENCE_AREA_FM    = [200, 100]              # the focusmode inference area in the format [w, h]
+    _PREVIEW_RESOLUTION   = (480, 270)              # the resolution the camera delivers the displayed preview at, None to display full frames
+    _CAPTURE_FORMAT       = 'rgb'                   # 'yuv' captures full YUV420 frames and converts only the preview and the inference area
+    _CAPTURE_PROCESS      = False                   # captures in a separate process writing to shared memory, instead of a thread of the GUI
+    _SHOW_CAPTURE_STATS   = False                   # draws the capture statistics below the FPS value
+    _FOCUS_MIN_SCORE      = None                    # the focus_score() of the luma below which frames are not sent for detection in the 'yuv' capture format, None to send all
     _STABILIZATION_CYCLES = 3                       # the number of inference cycles the detection result has to stabilize to be taken as the final result
 
     def __init__(self, parent: tk.Frame, controller: tk.Frame):
@@ -28,7 +42,7 @@ class MainPage(tk.Frame):
         self.canvas.bind('<Button-1>', self.canvas_onclick_callback)
 
         self.canvas.grid(row=0, column=0, rowspan=2, sticky='nsew')
-        self.canvas_image_container = None
+        self.preview_renderer = PreviewRenderer(self.canvas)
 
         self.exit_button = tk.Button(
             self, font=font.NORMAL_BUTTON_FONT,
@@ -49,17 +63,39 @@ class MainPage(tk.Frame):
         self.columnconfigure(1, weight=1)
 
         # member variables of this frame 
-        self.camera_thread = CameraStreamThread(self._CAMERA_RESOLUTION, self._CAMERA_FPS)
+        self.geometry = CaptureGeometry(self._CAMERA_RESOLUTION, self._PREVIEW_RESOLUTION or self._CAMERA_RESOLUTION, self._INFERENCE_AREA)
+        camera_class = CameraStreamProcess if self._CAPTURE_PROCESS else CameraStreamThread
+        use_geometry = self._PREVIEW_RESOLUTION and self._CAPTURE_FORMAT == 'rgb'
+        self.camera_thread = camera_class(
+            self._CAMERA_RESOLUTION, self._CAMERA_FPS,
+            geometry=self.geometry if use_geometry else None,
+            pixel_format=self._CAPTURE_FORMAT
+        )
         self.process_loop_delay = int(1000 / self._CAMERA_FPS)
 
+        # with the capture process, the detection process copies the inference area out of the
+        # capture ring itself, given as (array index, x, y) in the frames of the ring
+        ring = None
+        self.ring_inference_area = None
+        if self._CAPTURE_PROCESS and self._CAPTURE_FORMAT == 'rgb':
+            ring = self.camera_thread.ring
+            self.ring_inference_area = (1, 0, 0) if use_geometry else (0, *self._INFERENCE_AREA[:2])
+
         self.p_conn, self.c_conn = multiprocessing.Pipe(duplex=True)
-        self.inference_proc = BandDetectionProcess(self.c_conn)
+        self.inference_proc = BandDetectionProcess(self.c_conn, ring)
+
+        self.frame_seq = 0
+        self.t_loop_due: float = None                   # the time.perf_counter() the process loop is scheduled for
+        self.frame_image: np.ndarray = None             # the copy of the latest preview which is drawn upon
+        self.frame_yuv: np.ndarray = None               # the latest YUV420 frame in the 'yuv' capture format
+        self.scene_detector = SceneChangeDetector()     # compares the luma with the one last sent for detection
 
         self.last_detection_image: np.ndarray = None
         self.last_detection_result: BandDetectionResult = None
 
         self.last_stable_detection: BandDetectionResult = None
         self.stable_count = 0
+        self.decision_cycles = 0
 
         self.e_suspend_processing = True
         self.e_focusmode = False
@@ -72,16 +108,9 @@ class MainPage(tk.Frame):
         """
         Updates the canvas in this frame to format and display the corresponding image.
         Args:
-            image: The image to display in the canvas.
+            image: The image to display in the canvas, which is downscaled to fit it.
         """
-        pil_image = Image.fromarray(image, mode='RGB')
-        image_tk = ImageTk.PhotoImage(pil_image)
-        self.canvas.image_tk = image_tk
-
-        if self.canvas_image_container is None:
-            self.canvas_image_container = self.canvas.create_image(0, 0, anchor='nw', image=image_tk)
-        else:
-            self.canvas.itemconfig(self.canvas_image_container, image=image_tk)
+        self.preview_renderer.render(image)
 
     def draw_inference_box(self, image, x, y, w, h):
         """
@@ -102,6 +131,7 @@ class MainPage(tk.Frame):
             return
         if not self.last_detection_result.is_valid():
             return
+        self.decision_cycles += 1
 
         if (self.last_stable_detection is not None) and (self.last_stable_detection.is_identical(self.last_detection_result)):
             self.stable_count += 1
@@ -112,33 +142,139 @@ class MainPage(tk.Frame):
 
         if self.stable_count > self._STABILIZATION_CYCLES:
             self.stable_count = 0
-            self.controller.dresult_page.set_result(self.last_detection_image, self.last_detection_result)
+            metrics.stabilization_cycles.observe(self.decision_cycles)
+            self.controller.dresult_page.set_result(self.last_detection_image, self.last_detection_result, self.decision_cycles)
+            self.decision_cycles = 0
             self.controller.raise_dresult_page()
 
+    def get_new_frame(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Copies the latest camera preview into the frame image, which may be drawn upon, converting
+        it from YUV420 first in the 'yuv' capture format.
+        Returns:
+            The frame image and the read-only inference area at full resolution, or None if no new
+            frame has been captured since the last call. The inference area is None in the 'yuv'
+            capture format, where send_detection_input() converts it only if it is sent.
+        """
+        frame = self.camera_thread.get_latest(self.frame_seq)
+        if frame is None:
+            return None
+        self.frame_seq = frame.seq
+        if self._CAPTURE_FORMAT == 'yuv':
+            # the frame is converted lazily: the preview downscaled first, the inference area only
+            # once it is sent for detection
+            self.frame_yuv = frame.image
+            self.frame_image = yuv_to_rgb(frame.image, size=self._PREVIEW_RESOLUTION)
+            return self.frame_image, None
+        if self.frame_image is None:
+            self.frame_image = np.empty_like(frame.image)
+        np.copyto(self.frame_image, frame.image)
+
+        if frame.roi is not None:
+            return self.frame_image, frame.roi
+        x, y, w, h = self._INFERENCE_AREA
+        return self.frame_image, frame.image[y:y+h, x:x+w]
+
+    def draw_detection_result(self, image: np.ndarray, detection_result: BandDetectionResult):
+        """
+        Draws a detection result, whose coordinates are within the inference area, onto the preview.
+        Args:
+            image: The preview to draw on.
+            detection_result: The detection result to draw.
+        """
+        for band in detection_result.detected_bands:
+            box = band.bounding_box
+            left, top = self.geometry.roi_to_preview(box.left, box.top)
+            right, bottom = self.geometry.roi_to_preview(box.right, box.bottom)
+            mapped_band = DetectedBand(band.id, band.label, band.score, [left, top, right, bottom])
+            mapped_band.draw_bounding_box(image)
+            mapped_band.draw_statistics(image)
+
+    def draw_capture_stats(self, image: np.ndarray):
+        """
+        Draws the camera frame rate, the overwritten frames, the median and 99th percentile
+        interval between frames and the median age of frames below the FPS value.
+        """
+        stats = get_capture_stats()
+        ms = lambda value: '-' if value is None else f'{value * 1000:.0f}'
+        draw_overlay_text(image, [
+            f'CAM: {stats["fps"]:.2f}, DROP: {stats["overwritten"]:.0f}',
+            f'INT: {ms(stats["interval"]["p50"])}/{ms(stats["interval"]["p99"])} ms, AGE: {ms(stats["age"]["p50"])} ms',
+        ])
+
+    def send_detection_input(self, sub_image: np.ndarray, x: int, y: int, w: int, h: int,
+                                   padding_x: int = 0, padding_y: int = 0):
+        """
+        Sends a rectangle within the inference area of the current frame, padded with gray, to the
+        detection process.
+        Args:
+            sub_image: The inference area, or None to convert it from the YUV420 frame.
+            x, y, w, h: The rectangle within the inference area.
+            padding_x, padding_y: The width of the gray padding.
+        Notes:
+            In the 'yuv' capture format the rectangle is first checked on the luma, which costs no
+            conversion. It is not sent if it is blurrier than _FOCUS_MIN_SCORE, or if it shows the
+            same scene as the rectangle last sent and that yielded no valid result, so an empty
+            or unchanged tray costs neither the RGB conversion nor an inference.
+        """
+        if self.frame_yuv is not None:
+            x_area, y_area, _, _ = self._INFERENCE_AREA
+            luma = get_luma(self.frame_yuv)[y_area+y:y_area+y+h, x_area+x:x_area+x+w]
+            if self._FOCUS_MIN_SCORE is not None and focus_score(luma) < self._FOCUS_MIN_SCORE:
+                metrics.detection_skipped_frames['blurred'].inc()
+                return
+            idle = self.last_detection_result is not None and not self.last_detection_result.is_valid()
+            if not self.scene_detector.is_changed(luma) and idle:
+                metrics.detection_skipped_frames['unchanged'].inc()
+                return
+            self.scene_detector.accept()
+            sub_image = yuv_to_rgb(self.frame_yuv, rect=self._INFERENCE_AREA)
+
+        if self.ring_inference_area is not None:
+            index, x_area, y_area = self.ring_inference_area
+            detection_input = FrameRegion(self.frame_seq, index, (x_area + x, y_area + y, w, h), (padding_x, padding_y))
+        elif not padding_x and not padding_y:
+            detection_input = sub_image[y:y+h, x:x+w]
+        else:
+            detection_input = cv2.copyMakeBorder(
+                sub_image[y:y+h, x:x+w],
+                padding_y, padding_y,
+                padding_x, padding_x,
+                cv2.BORDER_CONSTANT, value=(128, 128, 128)
+            )
+        self.p_conn.send(detection_input)
+        metrics.detection_queue_depth.set(1)
+        self.last_detection_image = sub_image.copy()
+
     def process_image(self):
         """
         Captures the image from the camera thread, sends it to the detection process if applicable,
         and updates the UI to show the last detection result.
         """
-        image = self.camera_thread.get_frame()
-
-        x, y, w, h = self._INFERENCE_AREA
-        sub_image = image[y:y+h, x:x+w]
+        frame = self.get_new_frame()
+        if frame is None:
+            return
+        image, sub_image = frame
+        _, _, w, h = self._INFERENCE_AREA
 
         if self.p_conn.poll():
             self.last_detection_result = self.p_conn.recv()
+            metrics.detection_queue_depth.set(0)
             self.process_result()
 
         if self.inference_proc.is_recv_ready():
-            self.p_conn.send(sub_image)
-            self.last_detection_image = sub_image.copy()
+            self.send_detection_input(sub_image, 0, 0, w, h)
 
-        self.draw_inference_box(image, x, y, w, h)
+        self.draw_inference_box(image, *self.geometry.roi_rect_to_preview(0, 0, w, h))
 
         if self.last_detection_result is not None:
-            self.last_detection_result.draw_on_img(sub_image)
+            self.draw_detection_result(image, self.last_detection_result)
 
         self.fps_counter.update_and_draw(image)
+        metrics.display_fps.set(self.fps_counter.fps)
+        if self._SHOW_CAPTURE_STATS:
+            self.draw_capture_stats(image)
+        preview_broadcaster.publish(image)
         self.update_canvas_to_image(image)
 
     def process_image_focusmode(self):
@@ -146,36 +282,34 @@ class MainPage(tk.Frame):
         The focusmode version of process_image(). This function uses a smaller inference area centered within
         the original inference area for detection.
         """
-        image = self.camera_thread.get_frame()
-
-        x, y, w, h = self._INFERENCE_AREA
-        sub_image = image[y:y+h, x:x+w]
+        frame = self.get_new_frame()
+        if frame is None:
+            return
+        image, sub_image = frame
+        _, _, w, h = self._INFERENCE_AREA
 
         w_fm, h_fm = self._INFERENCE_AREA_FM
         x_fm = padding_x = round((w - w_fm) / 2)
         y_fm = padding_y = round((h - h_fm) / 2)
 
-        fm_image = cv2.copyMakeBorder(
-            sub_image[y_fm:y_fm+h_fm, x_fm:x_fm+w_fm],
-            padding_y, padding_y,
-            padding_x, padding_x,
-            cv2.BORDER_CONSTANT, value=(128, 128, 128)
-        )
-
         if self.p_conn.poll():
             self.last_detection_result = self.p_conn.recv()
+            metrics.detection_queue_depth.set(0)
             self.process_result()
 
         if self.inference_proc.is_recv_ready():
-            self.p_conn.send(fm_image)
-            self.last_detection_image = sub_image.copy()
+            self.send_detection_input(sub_image, x_fm, y_fm, w_fm, h_fm, padding_x, padding_y)
 
-        self.draw_inference_box(image, x+x_fm, y+y_fm, w_fm, h_fm)
+        self.draw_inference_box(image, *self.geometry.roi_rect_to_preview(x_fm, y_fm, w_fm, h_fm))
 
         if self.last_detection_result is not None:
-            self.last_detection_result.draw_on_img(sub_image)
+            self.draw_detection_result(image, self.last_detection_result)
 
         self.fps_counter.update_and_draw(image)
+        metrics.display_fps.set(self.fps_counter.fps)
+        if self._SHOW_CAPTURE_STATS:
+            self.draw_capture_stats(image)
+        preview_broadcaster.publish(image)
         self.update_canvas_to_image(image)
 
     def process_loop(self):
@@ -184,10 +318,13 @@ class MainPage(tk.Frame):
         updating the UI.
         """
         if not self.e_suspend_processing:
+            if self.t_loop_due is not None:
+                metrics.gui_loop_lateness_seconds.observe(max(time.perf_counter() - self.t_loop_due, 0))
             if self.e_focusmode:
                 self.process_image_focusmode()
             else:
                 self.process_image()
+            self.t_loop_due = time.perf_counter() + self.process_loop_delay / 1000
             self.after(self.process_loop_delay, self.process_loop)
 
     def tkraise(self):
@@ -205,7 +342,10 @@ class MainPage(tk.Frame):
         else:
             while self.p_conn.poll():
                 self.p_conn.recv()
+            metrics.detection_queue_depth.set(0)
+        self.decision_cycles = 0
 
+        self.t_loop_due = None
         self.after(0, self.process_loop)
         self.e_suspend_processing = False
         super().tkraise()
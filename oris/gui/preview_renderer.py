@@ -0,0 +1,122 @@
+from typing import Tuple
+
+import tkinter as tk
+import numpy as np
+import cv2
+from PIL import Image, ImageTk
+
+class PreviewRenderer:
+    def __init__(self, canvas: tk.Canvas, upscale: bool = False):
+        """
+        Initializes the PreviewRenderer object, which displays images on a canvas, downscaled to
+        fit the canvas.
+        Args:
+            canvas: The canvas to display the images on.
+            upscale: Whether to also enlarge images smaller than the canvas.
+        Notes:
+            Images are resized once to the size shown, before they are handed to PIL and Tk, so
+            nothing is done for pixels the canvas would cut off. The PhotoImage is created once
+            per display size and updated in place with paste(), instead of creating a new Tk
+            image and reconfiguring the canvas for every frame.
+        """
+        self.canvas = canvas
+        self.upscale = upscale
+
+        self.canvas_size = (0, 0)           # the last known (width, height) of the canvas
+        self.image_size: Tuple[int, int] = None     # the (width, height) the images are displayed at
+        self.photo_image: ImageTk.PhotoImage = None
+        self.image_container = None
+
+        self.canvas.bind('<Configure>', self.canvas_onconfigure_callback, add='+')
+
+    def canvas_onconfigure_callback(self, event):
+        self.canvas_size = (event.width, event.height)
+
+    def get_display_size(self, image_size: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Gets the size an image of image_size is displayed at, keeping its aspect ratio.
+        """
+        width, height = image_size
+        canvas_width, canvas_height = self.canvas_size
+        if canvas_width <= 1 or canvas_height <= 1:
+            # not laid out yet
+            return image_size
+        scale = min(canvas_width / width, canvas_height / height)
+        if scale >= 1 and not self.upscale:
+            return image_size
+        return max(round(width * scale), 1), max(round(height * scale), 1)
+
+    def render(self, image: np.ndarray):
+        """
+        Displays an RGB image on the canvas.
+        Args:
+            image: The image to display, which is not modified.
+        """
+        size = self.get_display_size((image.shape[1], image.shape[0]))
+        # halving by averaging first avoids aliasing, and unlike averaging over a fractional
+        # factor it is about as fast as interpolating
+        while size[0] * 2 <= image.shape[1] and size[1] * 2 <= image.shape[0]:
+            image = cv2.resize(image, (image.shape[1] // 2, image.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        if size != (image.shape[1], image.shape[0]):
+            image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+        pil_image = Image.fromarray(image, mode='RGB')
+
+        if size != self.image_size:
+            self.image_size = size
+            self.photo_image = ImageTk.PhotoImage(pil_image)
+            if self.image_container is None:
+                self.image_container = self.canvas.create_image(0, 0, anchor='nw', image=self.photo_image)
+            else:
+                self.canvas.itemconfig(self.image_container, image=self.photo_image)
+        else:
+            self.photo_image.paste(pil_image)
+
+def main():
+    """
+    Measures the GUI thread milliseconds per frame of displaying camera-sized frames, by creating
+    a new PhotoImage per frame and by the PreviewRenderer.
+    """
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Measure the time of displaying frames on a canvas.')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--canvas', default='400x320', help='the WxH of the canvas, e.g. the preview area on the 3.5" LCD')
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+
+    canvas_width, canvas_height = (int(x) for x in args.canvas.split('x'))
+    root = tk.Tk()
+    canvas = tk.Canvas(root, width=canvas_width, height=canvas_height, highlightthickness=0)
+    canvas.pack()
+    root.update()
+
+    frames = [np.full((args.height, args.width, 3), i * 40 % 256, dtype=np.uint8) for i in range(4)]
+
+    def new_photo_image(image: np.ndarray):
+        # the previous way of displaying a frame
+        image_tk = ImageTk.PhotoImage(Image.fromarray(image, mode='RGB'))
+        canvas.image_tk = image_tk
+        if canvas.image_container is None:
+            canvas.image_container = canvas.create_image(0, 0, anchor='nw', image=image_tk)
+        else:
+            canvas.itemconfig(canvas.image_container, image=image_tk)
+
+    canvas.image_container = None
+    renderer = PreviewRenderer(canvas)
+    renderer.canvas_size = (canvas.winfo_width(), canvas.winfo_height())
+    for name, render in (('new PhotoImage', new_photo_image), ('PreviewRenderer', renderer.render)):
+        t_total = 0.0
+        for i in range(args.frames):
+            t_start = time.perf_counter()
+            render(frames[i % len(frames)])
+            root.update_idletasks()
+            t_total += time.perf_counter() - t_start
+        print(f'{name}: {t_total / args.frames * 1000:.2f} ms per frame')
+        canvas.delete('all')
+        canvas.image_container = renderer.image_container = renderer.image_size = None
+    root.destroy()
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 from web_server import close_http_server
+from retention import RetentionThread
+from scan_stats import ScanStatisticsThread, stats
 
 from .main_page import MainPage
 from .dresult_page import DResultPage
@@ -20,6 +22,9 @@ class TkRoot(tk.Tk):
         self.grid_rowconfigure(index=0, weight=1)
         self.grid_columnconfigure(index=0, weight=1)
         self.update_idletasks()
+
+        # loads the persisted statistics before any scan can be recorded
+        self.stats_thread = ScanStatisticsThread(stats)
         
         self.main_page = MainPage(self, self)
         self.main_page.grid(row=0, column=0, sticky='nsew')
@@ -32,6 +37,11 @@ class TkRoot(tk.Tk):
 
         self.protocol('WM_DELETE_WINDOW', self.close)
 
+        self.retention_thread = RetentionThread()
+        self.retention_thread.start()
+
+        self.stats_thread.start()
+
         self.active_frame = None
         self.raise_main_page()
 
@@ -68,4 +78,9 @@ class TkRoot(tk.Tk):
         """
         self.main_page.close()
         close_http_server()
+
+        self.retention_thread.signal_stop()
+        self.retention_thread.join()
+        self.stats_thread.signal_stop()
+        self.stats_thread.join()
         self.destroy()
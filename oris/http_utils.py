@@ -0,0 +1,180 @@
+from typing import BinaryIO, Optional, Tuple
+
+from email.utils import formatdate, parsedate_to_datetime
+import hashlib
+import zlib
+import os
+
+CHUNK_SIZE          = 16 * 1024     # bytes buffered before a chunk is sent
+GZIP_MIN_SIZE       = 512           # bodies smaller than this are not worth compressing
+GZIP_LEVEL          = 6
+
+def accepts_gzip(headers) -> bool:
+    """
+    Returns whether the client accepts gzip content encoding, according to its request headers.
+    """
+    for coding in headers.get('accept-encoding', '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def gzip_compress(data: bytes) -> bytes:
+    """
+    Compresses data in gzip format.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def make_etag(*parts, weak: bool = False) -> str:
+    """
+    Makes an entity tag from the values which determine the content of a response.
+    """
+    digest = hashlib.sha1('\0'.join(str(x) for x in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+def format_http_date(timestamp: float) -> str:
+    """
+    Formats a timestamp as an HTTP date.
+    """
+    return formatdate(timestamp, usegmt=True)
+
+def is_not_modified(headers, etag: Optional[str], last_modified: Optional[float]) -> bool:
+    """
+    Evaluates the conditional request headers against the current validators of a resource.
+    Args:
+        headers: The request headers.
+        etag: The current entity tag of the resource, or None.
+        last_modified: The current modification timestamp of the resource, or None.
+    Returns:
+        Whether the client's cached copy is still valid, i.e. a 304 response should be sent.
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        opaque = etag[2:] if etag.startswith('W/') else etag
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if (tag[2:] if tag.startswith('W/') else tag) == opaque:
+                return True
+        return False
+
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def safe_join(root: str, *parts: str) -> str:
+    """
+    Joins untrusted path components onto a root directory.
+    Returns:
+        The joined path.
+    Raises:
+        ValueError: If the joined path would point outside of root.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, *[x.lstrip('/\\') for x in parts]))
+    if '\0' in path or os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError('The path points outside of the served directory')
+    return path
+
+def parse_range(value: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses the Range request header for a resource.
+    Args:
+        value: The value of the Range header, or None if it is absent.
+        size: The size of the resource in bytes.
+    Returns:
+        The first and last (inclusive) byte position of the requested range, or None if the whole
+        resource should be sent. Multiple ranges are not supported and are answered with the whole
+        resource, which is allowed by RFC 9110.
+    Raises:
+        ValueError: If the range cannot be satisfied.
+    """
+    if value is None:
+        return None
+    unit, _, ranges = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    suffix = not first
+    try:
+        if suffix:
+            length = int(last)
+        else:
+            first = int(first)
+            last = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if suffix:
+        # a suffix range of the last length bytes
+        if length <= 0 or size == 0:
+            raise ValueError('The range is not satisfiable')
+        return max(size - length, 0), size - 1
+    if first >= size:
+        raise ValueError('The range is not satisfiable')
+    if first < 0 or first > last:
+        return None
+    return first, min(last, size - 1)
+
+class ChunkedWriter:
+    def __init__(self, wfile: BinaryIO, chunk_size: int = CHUNK_SIZE, compress: bool = False):
+        """
+        Initializes the ChunkedWriter object, which writes a response body using the HTTP/1.1
+        chunked transfer encoding.
+        Args:
+            wfile: The output stream of the connection.
+            chunk_size: The number of bytes to buffer before a chunk is sent.
+            compress: Whether to gzip-compress the body on the fly.
+        Notes:
+            The response headers must contain "Transfer-Encoding: chunked", plus "Content-Encoding: gzip"
+            if compress is set, and close() must be called to terminate the body.
+        """
+        self.wfile = wfile
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+
+    def write(self, data):
+        """
+        Writes data to the response body. Strings are encoded as UTF-8.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the buffered data as one chunk.
+        """
+        if not self._buffer:
+            return
+        self.wfile.write(b'%x\r\n' % len(self._buffer))
+        self.wfile.write(self._buffer)
+        self.wfile.write(b'\r\n')
+        self.wfile.flush()
+        self._buffer.clear()
+
+    def close(self):
+        """
+        Sends the remaining buffered data and terminates the response body.
+        """
+        if self._compressor is not None:
+            self._buffer += self._compressor.flush()
+        self.flush()
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
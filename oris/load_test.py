@@ -0,0 +1,336 @@
+from typing import Dict, List, Optional, Tuple
+
+import record
+from band_detection import BandDetectionResult
+from detected_object import DetectedBand
+
+import http.client
+import numpy as np
+import subprocess
+import collections
+import threading
+import argparse
+import datetime
+import tempfile
+import random
+import gzip
+import shutil
+import json
+import time
+import sys
+import os
+import cv2
+
+import logging
+logger = logging.getLogger(__name__)
+
+LOAD_TEST_PORT      = 8181
+LOAD_TEST_ROUTES    = {     # route -> share of the requests
+    'index':        0.25,
+    'image':        0.35,
+    'search':       0.10,
+    'api_list':     0.15,
+    'api_record':   0.10,
+    'next_page':    0.05,
+}
+
+_SIGNIFICANT_LABELS = ['black_band', 'brown_band', 'red_band', 'orange_band', 'yellow_band',
+                       'green_band', 'blue_band', 'violet_band', 'grey_band', 'white_band']
+_TOLERANCE_LABELS   = ['brown_band', 'red_band', 'gold_band', 'silver_band']
+
+def make_fake_result(rng: random.Random, width: int, height: int) -> BandDetectionResult:
+    """
+    Makes a plausible band detection result: mostly four or five evenly spaced bands, sometimes
+    too few bands to be decoded.
+    """
+    n_bands = rng.choice([4, 4, 4, 5, 5, 3])
+    labels = [rng.choice(_SIGNIFICANT_LABELS) for _ in range(n_bands - 1)] + [rng.choice(_TOLERANCE_LABELS)]
+    step = width // (n_bands + 1)
+    bands = []
+    for i, label in enumerate(labels):
+        x = step * (i + 1)
+        box = [x - step // 4, height // 4, x + step // 4, height * 3 // 4]
+        bands.append(DetectedBand(_SIGNIFICANT_LABELS.index(label) if label in _SIGNIFICANT_LABELS else 10,
+                                  label, round(rng.uniform(0.3, 1), 3), box))
+    return BandDetectionResult(bands)
+
+def synthesize_records(path: str, count: int, size: Tuple[int, int] = (300, 300), days: int = 30,
+                       seed: int = 0) -> float:
+    """
+    Writes fake scan records into a directory.
+    Args:
+        path: The record directory.
+        count: The number of records to write.
+        size: The width and height of the record images.
+        days: The number of days the record times are spread over, ending now.
+        seed: The seed of the random generator.
+    Returns:
+        The number of seconds it took.
+    """
+    rng = random.Random(seed)
+    width, height = size
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    base[:, :, 0] = np.linspace(60, 200, width, dtype=np.uint8)
+    base[:, :, 1] = np.linspace(40, 160, height, dtype=np.uint8)[:, None]
+    base[:, :, 2] = 90
+
+    t_end = datetime.datetime.now().replace(microsecond=0)
+    interval = datetime.timedelta(days=days) / max(count, 1)
+
+    saved_path = record.RECORD_SAVE_PATH
+    record.RECORD_SAVE_PATH = path
+    t_start = time.monotonic()
+    try:
+        for i in range(count):
+            result = make_fake_result(rng, width, height)
+            image = base.copy()
+            for band in result.detected_bands:
+                box = band.bounding_box
+                cv2.rectangle(image, (box.left, box.top), (box.right, box.bottom), box.color, -1)
+            record.DetectionRecord(image, result, t_end - interval * (count - i)).save()
+    finally:
+        record.RECORD_SAVE_PATH = saved_path
+    return time.monotonic() - t_start
+
+def get_rss(pid: int) -> Optional[int]:
+    """
+    Returns the resident set size of a process in bytes, or None if it cannot be read.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class _Client(threading.Thread):
+    def __init__(self, port: int, record_ids: List[str], days: List[str], deadline: float, seed: int,
+                       think_time: float):
+        super().__init__(daemon=True)
+        self.port = port
+        self.record_ids = record_ids
+        self.days = days
+        self.deadline = deadline
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.status: Dict[int, int] = collections.Counter()
+        self.errors = 0
+        self.bytes = 0
+        self._next_cursor: Optional[str] = None
+
+    def make_path(self, route: str) -> str:
+        record_id = self.rng.choice(self.record_ids)
+        if route == 'index':
+            return '/'
+        if route == 'image':
+            return '/' + record_id + '.png'
+        if route == 'search':
+            day = self.rng.choice(self.days)
+            return f'/?from={day}&to={day}'
+        if route == 'api_list':
+            return '/api/records?limit=50'
+        if route == 'api_record':
+            return '/api/records/' + record_id
+        if self._next_cursor is not None:
+            return '/api/records?limit=50&cursor=' + self._next_cursor
+        return '/api/records?limit=50'
+
+    def run(self):
+        routes, weights = zip(*LOAD_TEST_ROUTES.items())
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        while time.monotonic() < self.deadline:
+            route = self.rng.choices(routes, weights)[0]
+            path = self.make_path(route)
+            t_start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers={'accept-encoding': 'gzip'})
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+                continue
+            self.latencies[route].append(time.perf_counter() - t_start)
+            self.status[response.status] += 1
+            self.bytes += len(body)
+            if route in ('api_list', 'next_page') and response.status == 200:
+                if response.getheader('content-encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                self._next_cursor = json.loads(body).get('next_cursor')
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1 / self.think_time))
+        conn.close()
+
+def wait_for_server(port: int, process: subprocess.Popen, timeout: float = 120):
+    """
+    Waits until the server answers requests, which includes loading its record index.
+    Raises:
+        RuntimeError: If the server exits or does not answer within timeout.
+    """
+    t_end = time.monotonic() + timeout
+    while time.monotonic() < t_end:
+        if process.poll() is not None:
+            raise RuntimeError(f'The server exited with code {process.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/records?limit=1')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+            conn.close()
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('The server did not become ready in time')
+
+def run_load_test(path: str, port: int = LOAD_TEST_PORT, clients: int = 10, duration: float = 30,
+                  think_time: float = 0, seed: int = 0) -> dict:
+    """
+    Starts web_server.py on a record directory and drives concurrent clients against it.
+    Args:
+        path: The record directory to serve.
+        port: The port of the server.
+        clients: The number of concurrent clients, each with its own keep-alive connection.
+        duration: The number of seconds to generate load.
+        think_time: The mean number of seconds a client waits between two requests.
+        seed: The seed of the random generators.
+    Returns:
+        The report with the throughput, the latency percentiles per route and the server RSS.
+    """
+    record_ids = [record.get_record_id(x) for x in record.list_records(path)]
+    if not record_ids:
+        raise RuntimeError(f'There are no records in "{path}"')
+    days = sorted({x[:10] for x in record_ids})
+
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    t_start = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, 'web_server.py', '--port', str(port), '--record-path', path],
+        cwd=server_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(port, process)
+        t_ready = time.monotonic() - t_start
+        rss_idle = get_rss(process.pid)
+
+        rss_peak = [rss_idle or 0]
+        e_done = threading.Event()
+        def sample_rss():
+            while not e_done.wait(0.25):
+                rss_peak[0] = max(rss_peak[0], get_rss(process.pid) or 0)
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+
+        deadline = time.monotonic() + duration
+        workers = [_Client(port, record_ids, days, deadline, seed + i, think_time) for i in range(clients)]
+        t_load = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - t_load
+        e_done.set()
+        sampler.join()
+        rss_end = get_rss(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    latencies = collections.defaultdict(list)
+    status = collections.Counter()
+    for worker in workers:
+        for route, values in worker.latencies.items():
+            latencies[route] += values
+        status.update(worker.status)
+    n_requests = sum(len(x) for x in latencies.values())
+
+    def summarize(values: List[float]) -> dict:
+        ms = np.array(values) * 1000
+        return {
+            'requests': len(values),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2),
+            'max_ms': round(float(ms.max()), 2),
+        }
+
+    return {
+        'records': len(record_ids),
+        'clients': clients,
+        'duration_s': round(elapsed, 2),
+        'server_ready_s': round(t_ready, 2),
+        'requests': n_requests,
+        'requests_per_second': round(n_requests / elapsed, 1),
+        'megabytes': round(sum(x.bytes for x in workers) / 1024**2, 2),
+        'errors': sum(x.errors for x in workers),
+        'status': {str(k): v for k, v in sorted(status.items())},
+        'all': summarize(sum(latencies.values(), [])) if n_requests else None,
+        'routes': {route: summarize(values) for route, values in sorted(latencies.items())},
+        'server_rss_mb': {
+            'idle': round((rss_idle or 0) / 1024**2, 1),
+            'peak': round(rss_peak[0] / 1024**2, 1),
+            'end': round((rss_end or 0) / 1024**2, 1),
+        },
+    }
+
+def print_report(report: dict):
+    """
+    Prints a load test report as a table.
+    """
+    print(f"{report['records']} records, {report['clients']} clients, {report['duration_s']}s "
+          f"(server ready after {report['server_ready_s']}s)")
+    print(f"{report['requests']} requests, {report['requests_per_second']} req/s, "
+          f"{report['megabytes']} MB, {report['errors']} errors, status {report['status']}")
+    print(f"{'route':<12}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(report['routes'].items()) + ([('all', report['all'])] if report['all'] else [])
+    for route, summary in rows:
+        print(f"{route:<12}{summary['requests']:>10}{summary['p50_ms']:>10}{summary['p95_ms']:>10}"
+              f"{summary['p99_ms']:>10}{summary['max_ms']:>10}")
+    rss = report['server_rss_mb']
+    print(f"server RSS: {rss['idle']} MB idle, {rss['peak']} MB peak, {rss['end']} MB at the end")
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Load test the record web server with synthetic records.')
+    parser.add_argument('--records', type=int, default=5000, help='the number of records to synthesize')
+    parser.add_argument('--width', type=int, default=300, help='the width of the synthesized images')
+    parser.add_argument('--height', type=int, default=300, help='the height of the synthesized images')
+    parser.add_argument('--days', type=int, default=30, help='the number of days the records are spread over')
+    parser.add_argument('--path', default=None, help='serve this record directory instead of synthesizing one')
+    parser.add_argument('--keep', action='store_true', help='keep the synthesized records')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--think-time', type=float, default=0, help='mean seconds between two requests of a client')
+    parser.add_argument('--port', type=int, default=LOAD_TEST_PORT)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    path = args.path
+    temp_path = None
+    if path is None:
+        temp_path = tempfile.mkdtemp(prefix='oris-load-test-')
+        path = os.path.join(temp_path, 'scan_record')
+        elapsed = synthesize_records(path, args.records, (args.width, args.height), args.days)
+        logger.info(f'Synthesized {args.records} records in "{path}" in {elapsed:.1f}s.')
+
+    try:
+        report = run_load_test(path, args.port, args.clients, args.duration, args.think_time)
+    finally:
+        if temp_path is not None and not args.keep:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
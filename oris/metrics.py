@@ -0,0 +1,225 @@
+from typing import Dict, List, Sequence, Tuple
+
+import multiprocessing
+import bisect
+import math
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HTTP_ROUTES = ('index', 'api', 'image', 'export', 'search', 'detect', 'metrics', 'stats', 'other')
+
+class _Metric:
+    def __init__(self, registry: 'MetricsRegistry', offset: int, size: int = 1):
+        self._registry = registry
+        self._offset = offset
+        self.size = size      # the number of values of this metric in the shared block
+
+class Counter(_Metric):
+    def inc(self, amount: float = 1):
+        """
+        Increases the counter. Each counter must only be increased from one thread.
+        """
+        self._registry.values[self._offset] += amount
+
+    def get(self) -> float:
+        return self._registry.values[self._offset]
+
+class Gauge(_Metric):
+    def set(self, value: float):
+        """
+        Sets the value of the gauge.
+        """
+        self._registry.values[self._offset] = value
+
+    def get(self) -> float:
+        return self._registry.values[self._offset]
+
+class Histogram(_Metric):
+    def __init__(self, registry: 'MetricsRegistry', offset: int, buckets: Sequence[float]):
+        super().__init__(registry, offset, len(buckets) + 3)
+        self.buckets = tuple(buckets)
+        self._sum = offset + len(self.buckets) + 1
+        self._count = self._sum + 1
+
+    def observe(self, value: float):
+        """
+        Records one observation. Each histogram must only be observed from one thread, or under
+        a lock held by all its writers.
+        """
+        values = self._registry.values
+        values[self._offset + bisect.bisect_left(self.buckets, value)] += 1
+        values[self._sum] += value
+        values[self._count] += 1
+
+    def get(self) -> Tuple[List[float], float, float]:
+        """
+        Returns the cumulative bucket counts (the last one being +Inf), the sum and the count.
+        """
+        values = self._registry.values
+        cumulative, total = [], 0
+        for i in range(len(self.buckets) + 1):
+            total += values[self._offset + i]
+            cumulative.append(total)
+        return cumulative, values[self._sum], values[self._count]
+
+    def get_counts(self) -> List[float]:
+        """
+        Returns the count of each bucket, the last one being the observations above all bounds.
+        """
+        return list(self._registry.values[self._offset:self._offset + len(self.buckets) + 1])
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket it falls into, which is math.inf
+        above all bounds, or NaN without observations. The quantile 0 falls into the first bucket
+        holding an observation.
+        """
+        cumulative, _, count = self.get()
+        if not count:
+            return math.nan
+        i = bisect.bisect_left(cumulative, max(q * count, 1))
+        return self.buckets[i] if i < len(self.buckets) else math.inf
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Initializes the MetricsRegistry object, which keeps metrics in one block of shared memory.
+        Notes:
+            Metrics are declared first and then allocate() creates the block. Processes forked
+            afterwards, like the BandDetectionProcess, write into the same memory, so updating a
+            metric is a plain store without locks or messages, and scraping only reads the block.
+            Every metric must have a single writer; a scrape may observe a histogram between two
+            of its stores, which is harmless for monitoring.
+        """
+        self._families: List[Tuple[str, str, str, str, Dict[str, _Metric]]] = []   # (kind, name, help, label name, label value -> metric)
+        self._size = 0
+        self.values = None
+
+    def _declare(self, kind: str, name: str, help: str, label: str, label_values: Sequence[str], factory):
+        if self.values is not None:
+            raise RuntimeError('Metrics must be declared before the registry is allocated')
+        children = {}
+        for value in (label_values if label else ('',)):
+            children[value] = factory(self._size)
+            self._size += children[value].size
+        self._families.append((kind, name, help, label, children))
+        return children if label else children['']
+
+    def counter(self, name: str, help: str, label: str = None, label_values: Sequence[str] = ()):
+        """
+        Declares a counter, or a dict of counters by label value if label is given.
+        """
+        return self._declare('counter', name, help, label, label_values, lambda offset: Counter(self, offset))
+
+    def gauge(self, name: str, help: str, label: str = None, label_values: Sequence[str] = ()):
+        """
+        Declares a gauge, or a dict of gauges by label value if label is given.
+        """
+        return self._declare('gauge', name, help, label, label_values, lambda offset: Gauge(self, offset))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float], label: str = None,
+                        label_values: Sequence[str] = ()):
+        """
+        Declares a histogram, or a dict of histograms by label value if label is given.
+        """
+        return self._declare('histogram', name, help, label, label_values, lambda offset: Histogram(self, offset, buckets))
+
+    def allocate(self):
+        """
+        Allocates the shared memory block of all declared metrics.
+        """
+        self.values = multiprocessing.RawArray('d', self._size)
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for kind, name, help, label, children in self._families:
+            lines.append(f'# HELP {name} {_escape_help(help)}')
+            lines.append(f'# TYPE {name} {kind}')
+            for label_value, metric in children.items():
+                labels = f'{label}="{_escape_label_value(label_value)}"' if label else ''
+                if kind != 'histogram':
+                    lines.append(f'{name}{{{labels}}} {_format_value(metric.get())}' if labels else f'{name} {_format_value(metric.get())}')
+                    continue
+                cumulative, total, count = metric.get()
+                sep = ',' if labels else ''
+                for bound, value in zip(list(metric.buckets) + [math.inf], cumulative):
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{_format_value(bound)}"}} {_format_value(value)}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}_sum{suffix} {_format_value(total)}')
+                lines.append(f'{name}_count{suffix} {_format_value(count)}')
+        return '\n'.join(lines) + '\n'
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _escape_label_value(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_gauge(name: str, help: str, value: float) -> str:
+    """
+    Renders a gauge computed at scrape time in the Prometheus text exposition format.
+    """
+    return f'# HELP {name} {_escape_help(help)}\n# TYPE {name} gauge\n{name} {_format_value(value)}\n'
+
+registry = MetricsRegistry()
+
+# camera thread
+camera_frames           = registry.counter('oris_camera_frames_total', 'Frames captured by the camera.')
+camera_dropped_frames   = registry.counter('oris_camera_dropped_frames_total', 'Captured frames replaced before anybody read them.')
+camera_delivered_frames = registry.counter('oris_camera_delivered_frames_total', 'Captured frames taken by the reader.')
+camera_suspended_frames = registry.counter('oris_camera_suspended_frames_total', 'Frames captured while capturing was suspended, which were discarded.')
+camera_fps              = registry.gauge('oris_camera_fps', 'Frames per second captured by the camera.')
+camera_frame_interval_seconds = registry.histogram(
+    'oris_camera_frame_interval_seconds', 'Time between two consecutive captured frames, excluding suspensions.',
+    (0.01, 0.02, 0.03, 0.035, 0.04, 0.05, 0.067, 0.1, 0.2, 0.5, 1)
+)
+camera_frame_age_seconds = registry.histogram(
+    'oris_camera_frame_age_seconds', 'Time from capturing a frame to the reader taking it.',
+    (0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25)
+)
+
+# detection process
+inference_seconds       = registry.histogram(
+    'oris_inference_seconds', 'Duration of one band detection in the detection process.',
+    (0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1, 2)
+)
+
+# GUI
+display_fps             = registry.gauge('oris_display_fps', 'Frames per second shown on the main page.')
+gui_loop_lateness_seconds = registry.histogram(
+    'oris_gui_loop_lateness_seconds', 'Delay of the main page process loop behind its schedule.',
+    (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+)
+detection_queue_depth   = registry.gauge('oris_detection_queue_depth', 'Frames sent to the detection process and not answered yet.')
+detection_skipped_frames = registry.counter(
+    'oris_detection_skipped_frames_total', 'Frames the detection process was ready for but not sent, as the luma showed nothing new.',
+    'reason', ('unchanged', 'blurred')
+)
+stabilization_cycles    = registry.histogram(
+    'oris_stabilization_cycles', 'Valid detection results processed until a result was taken as final.',
+    (2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100)
+)
+record_save_seconds     = registry.histogram(
+    'oris_record_save_seconds', 'Duration of writing one scan record.',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+# web server
+http_request_seconds    = registry.histogram(
+    'oris_http_request_seconds', 'Duration of handling one HTTP request, excluding long-lived streams.',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10), 'route', HTTP_ROUTES
+)
+
+registry.allocate()
@@ -0,0 +1,120 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import cv2
+import threading
+import time
+
+PREVIEW_STREAM_ENABLED  = True
+PREVIEW_MAX_FPS         = 10        # the maximum rate at which frames are published to viewers
+PREVIEW_MAX_WIDTH       = 640       # frames wider than this are downscaled before publishing
+PREVIEW_JPEG_QUALITY    = 70
+
+class FrameBroadcaster:
+    def __init__(self, max_fps: float = PREVIEW_MAX_FPS, max_width: int = PREVIEW_MAX_WIDTH,
+                       jpeg_quality: int = PREVIEW_JPEG_QUALITY):
+        """
+        Initializes the FrameBroadcaster object, which shares the latest preview frame with any
+        number of viewers.
+        Args:
+            max_fps: The maximum rate at which frames are published.
+            max_width: The maximum width of a published frame.
+            jpeg_quality: The JPEG quality of the encoded frames.
+        Notes:
+            publish() never blocks on viewers and does nothing while nobody is watching. Each frame is
+            JPEG-encoded at most once, by the first viewer asking for it, and viewers which fall behind
+            simply skip to the latest frame.
+        """
+        self.max_fps = max_fps
+        self.max_width = max_width
+        self.jpeg_quality = jpeg_quality
+
+        self._cond = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._viewers = 0
+        self._frame: Optional[np.ndarray] = None
+        self._seq = 0
+        self._jpeg: Optional[bytes] = None
+        self._jpeg_seq = 0
+        self._t_last_publish = 0
+
+    def has_viewers(self) -> bool:
+        """
+        Returns whether anybody is currently watching the preview.
+        """
+        return self._viewers > 0
+
+    def add_viewer(self):
+        """
+        Registers a viewer. Frames are only published while at least one viewer is registered.
+        """
+        with self._cond:
+            self._viewers += 1
+
+    def remove_viewer(self):
+        """
+        Unregisters a viewer registered by add_viewer().
+        """
+        with self._cond:
+            self._viewers -= 1
+            if self._viewers == 0:
+                self._frame = self._jpeg = None
+                self._jpeg_seq = 0
+
+    def publish(self, image: np.ndarray):
+        """
+        Publishes a frame to all viewers, if any are watching and the rate limit allows it.
+        Args:
+            image: The RGB frame to publish. It is copied, so the caller may modify it afterwards.
+        """
+        if not self._viewers:
+            return
+        t_now = time.monotonic()
+        if t_now - self._t_last_publish < 1 / self.max_fps:
+            return
+        self._t_last_publish = t_now
+
+        height, width = image.shape[:2]
+        if width > self.max_width:
+            size = (self.max_width, round(height * self.max_width / width))
+            frame = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        else:
+            frame = image.copy()
+
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def wait_jpeg(self, last_seq: int, timeout: float = None) -> Tuple[int, Optional[bytes]]:
+        """
+        Waits for a frame newer than the one a viewer got last, and gets it JPEG-encoded.
+        Args:
+            last_seq: The sequence number of the last frame the viewer got, or 0.
+            timeout: The maximum number of seconds to wait, or None to wait forever.
+        Returns:
+            The sequence number and the JPEG data of the latest frame, or (last_seq, None) on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq and self._frame is not None, timeout):
+                return last_seq, None
+
+        # encoding happens outside of self._cond, so publish() never waits for an encoder
+        with self._encode_lock:
+            with self._cond:
+                seq, frame = self._seq, self._frame
+                if self._jpeg_seq == seq:
+                    return seq, self._jpeg
+            if frame is None:
+                return last_seq, None
+
+            ok, buffer = cv2.imencode(
+                '.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            )
+            jpeg = buffer.tobytes() if ok else b''
+            with self._cond:
+                self._jpeg, self._jpeg_seq = jpeg, seq
+            return seq, jpeg
+
+preview_broadcaster = FrameBroadcaster()
@@ -1,12 +1,161 @@
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
 from band_detection import BandDetectionResult
+from detected_object import DetectedBand
+from resistor import decode_resistor
 
 import numpy as np
+import itertools
+import threading
 import datetime
+import struct
+import json
+import time
 import os
 import pickle
 
+import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
 RECORD_SAVE_PATH = './scan_record/'
 
+RECORD_FILE_EXT     = '.rec'
+LEGACY_FILE_EXT     = '.pickle'
+RECORD_TIME_FORMAT  = '%Y-%m-%d_%H-%M-%S'
+
+# On-disk layout of a record file (all integers little-endian):
+#   [prelude][header][padding][image bytes]
+#   prelude: magic (8s), format version (H), reserved (H), header length (I)
+#   header:  utf-8 JSON with the record metadata, see RecordHeader
+#   image:   raw C-ordered pixel data, aligned to _IMAGE_ALIGNMENT so it can be memory-mapped
+_RECORD_MAGIC       = b'ORISREC\x00'
+_RECORD_VERSION     = 1
+_PRELUDE_STRUCT     = struct.Struct('<8sHHI')
+_IMAGE_ALIGNMENT    = 64
+
+_save_listeners: List[Callable[['RecordHeader'], None]] = []
+
+class RecordFormatError(Exception):
+    def __init__(self, filepath: str, error_msg='The file is not a valid scan record'):
+        super().__init__()
+        self.filepath = filepath
+        self.error_msg = error_msg
+    def __str__(self):
+        return f'{type(self).__name__}: "{self.filepath}": {self.error_msg}'
+
+class RecordBand(NamedTuple):
+    """A detected band as stored in the record header."""
+    id: int
+    label: str
+    score: float
+    box: Tuple[int, int, int, int]      # left, top, right, bottom
+
+class RecordHeader:
+    def __init__(self, record_id: str, time: datetime.datetime, bands: List[RecordBand],
+                       resistance: Optional[float], tolerance: Optional[float], error: Optional[str],
+                       image_shape: Tuple[int], image_dtype: str, image_offset: int, filepath: str = None):
+        """
+        Initializes the RecordHeader object, which holds the metadata of a scan record without its image.
+        Args:
+            record_id: The id of the record, which is its filename without extension.
+            time: The time at which the detection result is generated.
+            bands: The detected bands of the record, in the order they were sorted by the detection result.
+            resistance, tolerance: The decoded resistor value, or None if it cannot be decoded.
+            error: The decoding error message, or None if the value was decoded.
+            image_shape, image_dtype, image_offset: Describes where and how the image is stored in the file.
+            filepath: The path of the record file.
+        """
+        self.record_id = record_id
+        self.time = time
+        self.bands = bands
+        self.resistance = resistance
+        self.tolerance = tolerance
+        self.error = error
+
+        self.image_shape = tuple(image_shape)
+        self.image_dtype = image_dtype
+        self.image_offset = image_offset
+        self.filepath = filepath
+
+    def is_decoded(self) -> bool:
+        """
+        Returns whether the resistor value of this record has been decoded successfully.
+        """
+        return self.resistance is not None and self.tolerance is not None
+
+    def get_labels(self) -> List[str]:
+        """
+        Returns the labels of the detected bands.
+        """
+        return [band.label for band in self.bands]
+
+    def to_detection_result(self) -> BandDetectionResult:
+        """
+        Rebuilds the BandDetectionResult object described by this header.
+        """
+        detected_bands = [DetectedBand(band.id, band.label, band.score, list(band.box)) for band in self.bands]
+        return BandDetectionResult(detected_bands)
+
+    def load_image(self, mmap: bool = True) -> np.ndarray:
+        """
+        Loads the image of the record from its file.
+        Args:
+            mmap: Whether to memory-map the image read-only instead of reading it into memory.
+        Returns:
+            The image of the record.
+        Notes:
+            Legacy pickle records cannot be memory-mapped, so they are unpickled instead.
+        """
+        if self.filepath.endswith(LEGACY_FILE_EXT):
+            with open(self.filepath, 'rb') as f:
+                return np.asarray(pickle.load(f).image)
+        if mmap:
+            return np.memmap(self.filepath, dtype=self.image_dtype, mode='r',
+                             offset=self.image_offset, shape=self.image_shape)
+
+        count = int(np.prod(self.image_shape))
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.image_offset)
+            return np.fromfile(f, dtype=self.image_dtype, count=count).reshape(self.image_shape)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the JSON-serializable representation of this header, as stored in the record file.
+        """
+        return {
+            'time': self.time.isoformat(),
+            'bands': [
+                {'id': band.id, 'label': band.label, 'score': band.score, 'box': list(band.box)}
+                for band in self.bands
+            ],
+            'resistance': self.resistance,
+            'tolerance': self.tolerance,
+            'error': self.error,
+            'image': {
+                'shape': list(self.image_shape),
+                'dtype': self.image_dtype,
+                'offset': self.image_offset,
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, record_id: str, data: dict, filepath: str = None) -> 'RecordHeader':
+        """
+        Creates a RecordHeader object from its JSON-serializable representation.
+        """
+        bands = [
+            RecordBand(band['id'], band['label'], band['score'], tuple(band['box']))
+            for band in data['bands']
+        ]
+        return cls(
+            record_id, datetime.datetime.fromisoformat(data['time']), bands,
+            data['resistance'], data['tolerance'], data['error'],
+            data['image']['shape'], data['image']['dtype'], data['image']['offset'],
+            filepath
+        )
+
 class DetectionRecord:
     def __init__(self, image: np.ndarray, detection_result: BandDetectionResult,
                        time: datetime.datetime = None):
@@ -24,26 +173,237 @@ class DetectionRecord:
         if time is None:
             self.time = datetime.datetime.now()
 
-    def save(self, filename: str = None):
+    def make_header(self, record_id: str) -> RecordHeader:
         """
-        Saves the pickle representation of this DetectionRecord object to a file.
+        Creates the RecordHeader object describing this DetectionRecord object.
         Args:
-            filename: The filename of the save file to create.
+            record_id: The id of the record.
+        """
+        bands = []
+        for band in self.detection_result.detected_bands:
+            box = band.bounding_box
+            bands.append(RecordBand(
+                int(band.id), band.label, float(band.score),
+                (int(box.left), int(box.top), int(box.right), int(box.bottom))
+            ))
+
+        resistance, tolerance, error = decode_resistor(self.detection_result)
+
+        return RecordHeader(
+            record_id, self.time, bands, resistance, tolerance, error,
+            self.image.shape, self.image.dtype.str, 0
+        )
+
+    def save(self, filename: str = None, notify: bool = True):
         """
+        Saves this DetectionRecord object to a record file.
+        Args:
+            filename: The filename of the save file to create, which is replaced if it exists.
+                      Defaults to the time of the record, with a sequence suffix such as "_1" if
+                      a record of the same second exists already.
+            notify: Whether to call the save listeners and record the save duration, which is
+                    not wanted when rewriting an existing record rather than saving a new scan.
+        Notes:
+            The file is written to a temporary file first and then renamed, so readers never see a
+            partially written record.
+        """
+        t_start = time.perf_counter()
         os.makedirs(RECORD_SAVE_PATH, exist_ok=True)
-        if filename is None:
-            filename = '{}.pickle'.format(self.time.strftime('%Y-%m-%d_%H-%M-%S'))
+        unique = filename is None
+        if unique:
+            filename = self.time.strftime(RECORD_TIME_FORMAT) + RECORD_FILE_EXT
 
         filepath = os.path.join(RECORD_SAVE_PATH, filename)
-        with open(filepath, 'wb') as f:
-            pickle.dump(self, f)
+        header = self.make_header(get_record_id(filename))
+        image = np.ascontiguousarray(self.image)
+
+        # the image offset depends on the header length, which in turn contains the image offset
+        header_len = len(json.dumps(header.to_dict()).encode())
+        while True:
+            header.image_offset = _align(_PRELUDE_STRUCT.size + header_len, _IMAGE_ALIGNMENT)
+            header_bytes = json.dumps(header.to_dict()).encode()
+            if len(header_bytes) == header_len:
+                break
+            header_len = len(header_bytes)
+
+        prelude = _PRELUDE_STRUCT.pack(_RECORD_MAGIC, _RECORD_VERSION, 0, len(header_bytes))
+        padding = header.image_offset - _PRELUDE_STRUCT.size - len(header_bytes)
+
+        temp_filepath = f'{filepath}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(temp_filepath, 'wb') as f:
+            f.write(prelude)
+            f.write(header_bytes)
+            f.write(b'\x00' * padding)
+            f.write(image.data)
+        if unique:
+            # the record id is not stored in the file, so the file can be named after writing it
+            filepath = _rename_unique(temp_filepath, filepath)
+            header.record_id = get_record_id(filepath)
+        else:
+            os.replace(temp_filepath, filepath)
+
+        header.filepath = filepath
+        if not notify:
+            return
+        # only new scans saved by the GUI thread are timed, as the metric has a single writer
+        metrics.record_save_seconds.observe(time.perf_counter() - t_start)
+        for listener in list(_save_listeners):
+            try:
+                listener(header)
+            except Exception:
+                logger.exception('Record save listener failed.')
 
-def read_from_file(filename: str) -> DetectionRecord:
+def add_save_listener(listener: Callable[[RecordHeader], None]):
+    """
+    Registers a function to be called with the RecordHeader of every record saved by DetectionRecord.save().
+    Notes:
+        Listeners run synchronously in the saving thread, so they must return quickly.
+    """
+    _save_listeners.append(listener)
+
+def remove_save_listener(listener: Callable[[RecordHeader], None]):
+    """
+    Unregisters a function registered by add_save_listener().
+    """
+    _save_listeners.remove(listener)
+
+def _rename_unique(temp_filepath: str, filepath: str) -> str:
+    # renames temp_filepath to filepath, or to filepath with the first free sequence suffix, without
+    # ever replacing an existing file, and returns the new path
+    root, ext = os.path.splitext(filepath)
+    for n in itertools.count():
+        candidate = f'{root}_{n}{ext}' if n else filepath
+        try:
+            os.link(temp_filepath, candidate)
+        except FileExistsError:
+            continue
+        except OSError:
+            # without hard links, e.g. on FAT, checking first is the best there is
+            if os.path.exists(candidate):
+                continue
+            os.replace(temp_filepath, candidate)
+            return candidate
+        os.remove(temp_filepath)
+        return candidate
+
+def _align(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+def get_record_id(filename: str) -> str:
+    """
+    Returns the record id of a record file, which is its filename without directory and extension.
+    """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def is_record_file(filename: str) -> bool:
+    """
+    Returns whether filename names a (current or legacy format) record file.
+    """
+    return filename.endswith(RECORD_FILE_EXT) or filename.endswith(LEGACY_FILE_EXT)
+
+def list_records(path: str = None) -> List[str]:
+    """
+    Lists the record files in a directory.
+    Args:
+        path: The directory to list, defaults to RECORD_SAVE_PATH.
+    Returns:
+        The filenames of the record files found.
+    """
+    if path is None:
+        path = RECORD_SAVE_PATH
+    os.makedirs(path, exist_ok=True)
+    return [entry.name for entry in os.scandir(path) if entry.is_file() and is_record_file(entry.name)]
+
+def find_record_file(record_id: str, path: str = None) -> Optional[str]:
+    """
+    Finds the record file of a record.
+    Args:
+        record_id: The id of the record.
+        path: The directory to search in, defaults to RECORD_SAVE_PATH.
+    Returns:
+        The path of the record file, or None if the record does not exist.
+    """
+    if path is None:
+        path = RECORD_SAVE_PATH
+    for ext in (RECORD_FILE_EXT, LEGACY_FILE_EXT):
+        filepath = os.path.join(path, record_id + ext)
+        if os.path.isfile(filepath):
+            return filepath
+    return None
+
+def read_header(filename: str) -> RecordHeader:
+    """
+    Reads the metadata of a record from a save file without loading its image.
+    Returns:
+        The read RecordHeader object.
+    Notes:
+        Legacy pickle records have no separate header, so they are fully unpickled.
+    """
+    filepath = os.path.join(RECORD_SAVE_PATH, filename)
+    if filepath.endswith(LEGACY_FILE_EXT):
+        return _read_legacy_header(filepath)
+
+    with open(filepath, 'rb') as f:
+        prelude = f.read(_PRELUDE_STRUCT.size)
+        if len(prelude) != _PRELUDE_STRUCT.size:
+            raise RecordFormatError(filepath, 'The record file is truncated')
+
+        magic, version, _, header_len = _PRELUDE_STRUCT.unpack(prelude)
+        if magic != _RECORD_MAGIC:
+            raise RecordFormatError(filepath)
+        if version > _RECORD_VERSION:
+            raise RecordFormatError(filepath, f'Unsupported record format version {version}')
+
+        header_bytes = f.read(header_len)
+        if len(header_bytes) != header_len:
+            raise RecordFormatError(filepath, 'The record file is truncated')
+
+    return RecordHeader.from_dict(get_record_id(filepath), json.loads(header_bytes), filepath)
+
+def _read_legacy_header(filepath: str) -> RecordHeader:
+    with open(filepath, 'rb') as f:
+        legacy_record = pickle.load(f)
+
+    record = DetectionRecord(legacy_record.image, legacy_record.detection_result, legacy_record.time)
+    header = record.make_header(get_record_id(filepath))
+    header.filepath = filepath
+    return header
+
+def read_from_file(filename: str, mmap: bool = True) -> DetectionRecord:
     """
     Reads the DetectionRecord object from a save file.
+    Args:
+        mmap: Whether to memory-map the image instead of reading it into memory.
     Returns:
         The read DetectionRecord object.
     """
     filepath = os.path.join(RECORD_SAVE_PATH, filename)
+    if filepath.endswith(LEGACY_FILE_EXT):
+        with open(filepath, 'rb') as f:
+            return pickle.load(f)
+
+    header = read_header(filename)
+    return DetectionRecord(header.load_image(mmap), header.to_detection_result(), header.time)
+
+def migrate_legacy_record(filename: str) -> str:
+    """
+    Converts a legacy pickle record into the current record format and removes the pickle file.
+    Returns:
+        The filename of the converted record file.
+    Notes:
+        The converted file keeps the modification time of the pickle file, which retention ages
+        records by, and the save listeners are not called, since no new scan was saved.
+    """
+    filepath = os.path.join(RECORD_SAVE_PATH, filename)
+    stat = os.stat(filepath)
     with open(filepath, 'rb') as f:
-        return pickle.load(f)
+        legacy_record = pickle.load(f)
+
+    new_filename = get_record_id(filepath) + RECORD_FILE_EXT
+    new_filepath = os.path.join(os.path.abspath(os.path.dirname(filepath)), new_filename)
+    record = DetectionRecord(legacy_record.image, legacy_record.detection_result, legacy_record.time)
+    record.save(new_filepath, notify=False)
+    os.utime(new_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    os.remove(filepath)
+    return new_filename
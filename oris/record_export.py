@@ -0,0 +1,221 @@
+from typing import Iterator, List, Optional
+
+from record import RecordHeader
+from record_index import RecordIndex, parse_time_prefix
+from web_api import header_to_json
+
+import argparse
+import datetime
+import zipfile
+import json
+import csv
+import io
+import sys
+import cv2
+
+import logging
+logger = logging.getLogger(__name__)
+
+EXPORT_IMAGE_FORMAT     = '.png'
+EXPORT_IMAGE_DIR        = 'images/'
+EXPORT_FLUSH_SIZE       = 64 * 1024     # bytes of archive data collected before they are yielded
+
+_CSV_FIELDS = ['id', 'time', 'resistance', 'tolerance', 'error', 'bands', 'scores', 'image']
+
+class _ZipOutput:
+    """
+    A write-only, unseekable file object collecting the output of zipfile.ZipFile, so the archive
+    can be handed out piece by piece while it is being written.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def get_pending_size(self) -> int:
+        return len(self._buffer)
+
+def get_export_records(index: RecordIndex, start: datetime.datetime = None,
+                       end: datetime.datetime = None) -> List[RecordHeader]:
+    """
+    Takes a snapshot of the records to export, oldest first.
+    Args:
+        index: The record index to query.
+        start: The start (inclusive) of the time range, or None for no lower bound.
+        end: The end (exclusive) of the time range, or None for no upper bound.
+    Notes:
+        Only references to the indexed headers are copied, so the snapshot is cheap, and the
+        manifest and the images of an archive always describe the same records.
+    """
+    records, _ = index.query(start, end, newest_first=False)
+    return records
+
+def get_image_name(header: RecordHeader, image_format: str = EXPORT_IMAGE_FORMAT) -> str:
+    """
+    Returns the path of the image of a record inside an export archive.
+    """
+    return EXPORT_IMAGE_DIR + header.record_id + image_format
+
+def iter_export_csv(records: List[RecordHeader], image_format: str = EXPORT_IMAGE_FORMAT) -> Iterator[str]:
+    """
+    Generates the CSV manifest of exported records, one line at a time.
+    Args:
+        records: The headers of the exported records.
+        image_format: The file extension of the exported images.
+    """
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    def take_line() -> str:
+        text = line.getvalue()
+        line.seek(0)
+        line.truncate()
+        return text
+
+    writer.writerow(_CSV_FIELDS)
+    yield take_line()
+    for header in records:
+        writer.writerow([
+            header.record_id, header.time.isoformat(),
+            '' if header.resistance is None else header.resistance,
+            '' if header.tolerance is None else header.tolerance,
+            header.error or '',
+            ' '.join(band.label for band in header.bands),
+            ' '.join(f'{band.score:.3f}' for band in header.bands),
+            get_image_name(header, image_format),
+        ])
+        yield take_line()
+
+def iter_export_json(records: List[RecordHeader], image_format: str = EXPORT_IMAGE_FORMAT) -> Iterator[str]:
+    """
+    Generates the JSON manifest of exported records piece by piece.
+    Args:
+        records: The headers of the exported records.
+        image_format: The file extension of the exported images.
+    """
+    yield '['
+    for i, header in enumerate(records):
+        obj = header_to_json(header)
+        obj['image'] = get_image_name(header, image_format)
+        yield (',\n' if i else '\n') + json.dumps(obj)
+    yield '\n]\n'
+
+def encode_image(header: RecordHeader, image_format: str = EXPORT_IMAGE_FORMAT) -> Optional[bytes]:
+    """
+    Encodes the full-resolution image of a record.
+    Returns:
+        The encoded image, or None if the record can no longer be read.
+    """
+    try:
+        image = header.load_image()
+    except (OSError, ValueError) as error:
+        logger.warning(f'Skipped the image of record "{header.record_id}": {error}')
+        return None
+    ok, buffer = cv2.imencode(image_format, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    return buffer.tobytes() if ok else None
+
+def iter_export_zip(records: List[RecordHeader], image_format: str = EXPORT_IMAGE_FORMAT,
+                    flush_size: int = EXPORT_FLUSH_SIZE) -> Iterator[bytes]:
+    """
+    Generates a ZIP archive of records on the fly, containing manifest.csv, manifest.json and the
+    image of every record.
+    Args:
+        records: The headers of the exported records.
+        image_format: The file extension, and thus the encoding, of the exported images.
+        flush_size: The number of bytes collected before a piece of the archive is yielded.
+    Notes:
+        The archive is never staged anywhere: the first bytes are yielded right away, and at most
+        one encoded image plus flush_size bytes are held in memory at any time. Entries are written
+        with data descriptors, so the output does not need to be seekable.
+    """
+    output = _ZipOutput()
+    now = datetime.datetime.now().timetuple()[:6]
+
+    with zipfile.ZipFile(output, 'w') as archive:
+        for name, parts in (('manifest.csv', iter_export_csv(records, image_format)),
+                            ('manifest.json', iter_export_json(records, image_format))):
+            info = zipfile.ZipInfo(name, now)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for part in parts:
+                    entry.write(part.encode())
+                    if output.get_pending_size() >= flush_size:
+                        yield output.take()
+
+        for header in records:
+            data = encode_image(header, image_format)
+            if data is None:
+                continue
+            # encoded images are already compressed, so they are stored as they are
+            info = zipfile.ZipInfo(get_image_name(header, image_format), header.time.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            archive.writestr(info, data)
+            if output.get_pending_size() >= flush_size:
+                yield output.take()
+
+    yield output.take()
+
+def get_export_filename(start: datetime.datetime = None, end: datetime.datetime = None,
+                        extension: str = '.zip') -> str:
+    """
+    Returns the suggested filename of an export covering a time range.
+    """
+    name = 'oris-export'
+    if start is not None:
+        name += '-from-' + start.strftime('%Y-%m-%d_%H-%M-%S')
+    if end is not None:
+        name += '-to-' + end.strftime('%Y-%m-%d_%H-%M-%S')
+    return name + extension
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Export scan records as a ZIP archive or a CSV manifest.')
+    parser.add_argument('--path', default=None, help='the record directory, defaults to RECORD_SAVE_PATH')
+    parser.add_argument('--from', dest='start', default=None, help='the first time to export, e.g. 2022-03-14')
+    parser.add_argument('--to', dest='end', default=None, help='the last time to export, e.g. 2022-03-14_18')
+    parser.add_argument('--format', choices=('zip', 'csv'), default='zip', help='the export format')
+    parser.add_argument('-o', '--output', default=None, help='the output file, or "-" for stdout')
+    args = parser.parse_args(argv)
+
+    try:
+        start = parse_time_prefix(args.start)[0] if args.start else None
+        end = parse_time_prefix(args.end)[1] if args.end else None
+    except ValueError as error:
+        parser.error(str(error))
+
+    index = RecordIndex(args.path)
+    index.refresh()
+    records = get_export_records(index, start, end)
+
+    filename = args.output or get_export_filename(start, end, '.' + args.format)
+    f = sys.stdout.buffer if filename == '-' else open(filename, 'wb')
+    try:
+        if args.format == 'zip':
+            for part in iter_export_zip(records):
+                f.write(part)
+        else:
+            for part in iter_export_csv(records):
+                f.write(part.encode())
+    finally:
+        if f is not sys.stdout.buffer:
+            f.close()
+    if filename != '-':
+        logger.info(f'Exported {len(records)} records to "{filename}".')
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,398 @@
+from typing import Callable, List, Optional, Tuple
+
+import record
+from record import RecordHeader, RecordFormatError
+from record_search import SearchIndex
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import threading
+import bisect
+import time
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+INDEX_LOAD_WORKERS  = 4       # threads reading record headers while the index is loaded
+INDEX_POLL_INTERVAL = 2       # seconds between two checks of the record directory for changes
+
+_RACY_MTIME_NS      = 2 * 10**9     # a modification time this close to a refresh may hide a later change with the same timestamp
+
+_TIME_PREFIX_UNITS = {      # length of a RECORD_TIME_FORMAT prefix -> the period it covers
+    4:  'year',
+    7:  'month',
+    10: datetime.timedelta(days=1),
+    13: datetime.timedelta(hours=1),
+    16: datetime.timedelta(minutes=1),
+    19: datetime.timedelta(seconds=1),
+}
+_TIME_PREFIX_TEMPLATE = '0001-01-01_00-00-00'
+
+def parse_time_prefix(value: str) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    Parses a (possibly truncated) time in RECORD_TIME_FORMAT or ISO format into the period it covers.
+    Args:
+        value: The time to parse, e.g. "2022-03", "2022-03-14_10" or "2022-03-14T10:30".
+    Returns:
+        The start (inclusive) and end (exclusive) of the covered period.
+    Raises:
+        ValueError: If value is not a valid time prefix.
+    """
+    value = value.strip().replace('T', '_').replace(' ', '_').replace(':', '-')
+    unit = _TIME_PREFIX_UNITS.get(len(value))
+    if unit is None:
+        raise ValueError(f'"{value}" is not a valid time')
+
+    start = datetime.datetime.strptime(value + _TIME_PREFIX_TEMPLATE[len(value):], record.RECORD_TIME_FORMAT)
+    if unit == 'year':
+        end = start.replace(year=start.year + 1)
+    elif unit == 'month':
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    else:
+        end = start + unit
+    return start, end
+
+def make_cursor(header: RecordHeader) -> str:
+    """
+    Makes the pagination cursor pointing at a record.
+    """
+    return f'{header.time.isoformat()}~{header.record_id}'
+
+def parse_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    """
+    Parses a pagination cursor made by make_cursor() into its index key.
+    Raises:
+        ValueError: If cursor is not a valid cursor.
+    """
+    time, sep, record_id = cursor.partition('~')
+    if not sep:
+        raise ValueError(f'"{cursor}" is not a valid cursor')
+    return datetime.datetime.fromisoformat(time), record_id
+
+class RecordIndex:
+    def __init__(self, path: str = None):
+        """
+        Initializes the RecordIndex object, which keeps the headers of all records in a directory
+        in memory, sorted by time.
+        Args:
+            path: The record directory to index, defaults to record.RECORD_SAVE_PATH.
+        Notes:
+            All methods are safe to call from multiple threads.
+        """
+        self.path = path if path is not None else record.RECORD_SAVE_PATH
+
+        self._lock = threading.Lock()
+        self._keys: List[Tuple[datetime.datetime, str]] = []    # (time, record_id), sorted ascending
+        self._headers = {}                                      # record_id -> RecordHeader
+        self._files = {}                                        # filename -> record_id
+        self._stats = {}                                        # filename -> (st_mtime_ns, st_size)
+        self._dir_mtime_ns = None
+        self._racy_files = set()                                # filenames whose stat cannot tell a later change apart
+        self._search = SearchIndex()                            # secondary index over values and bands
+
+        self.ready = threading.Event()      # set once the directory has been loaded
+        self.version = 0                    # incremented on every change of the index
+        self.last_modified = time.time()    # the time of the last change of the index
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, header: RecordHeader, stat: Tuple[int, int] = None):
+        """
+        Adds a record to the index, replacing any record with the same id.
+        Args:
+            header: The header of the record.
+            stat: The (st_mtime_ns, st_size) of the record file, looked up if not given.
+        """
+        self.add_many([(header, stat)])
+
+    def add_many(self, entries: List[Tuple[RecordHeader, Optional[Tuple[int, int]]]]):
+        """
+        Adds records to the index at once, which is much faster than adding them one by one.
+        Args:
+            entries: The headers of the records, with the (st_mtime_ns, st_size) of their files or None.
+        """
+        entries = list({header.record_id: (header, stat) for header, stat in entries}.values())
+        stats = []
+        for header, stat in entries:
+            if stat is None:
+                try:
+                    st = os.stat(header.filepath)
+                    stat = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    pass
+            stats.append(stat)
+
+        with self._lock:
+            for header, _ in entries:
+                self._remove_locked(header.record_id)
+            for (header, _), stat in zip(entries, stats):
+                filename = os.path.basename(header.filepath)
+                self._headers[header.record_id] = header
+                self._files[filename] = header.record_id
+                self._stats[filename] = stat
+                self._keys.append((header.time, header.record_id))
+            self._keys.sort()
+            self._search.add_many([header for header, _ in entries])
+            self._touch_locked()
+
+    def remove(self, record_id: str):
+        """
+        Removes a record from the index, if it is indexed.
+        """
+        with self._lock:
+            self._remove_locked(record_id)
+
+    def _remove_locked(self, record_id: str):
+        header = self._headers.pop(record_id, None)
+        if header is None:
+            return
+        key = (header.time, record_id)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+        filename = os.path.basename(header.filepath)
+        self._files.pop(filename, None)
+        self._stats.pop(filename, None)
+        self._search.remove(record_id)
+        self._touch_locked()
+
+    def _touch_locked(self):
+        self.version += 1
+        self.last_modified = time.time()
+
+    def refresh(self, max_workers: int = 1) -> Tuple[List[str], List[str]]:
+        """
+        Synchronizes the index with the record directory, reading the headers of new and modified
+        records only.
+        Args:
+            max_workers: The number of threads reading headers concurrently.
+        Returns:
+            The ids of the added or modified records and the ids of the removed records.
+        Notes:
+            A file or directory modified shortly before the refresh may be modified again with
+            the same timestamp, as timestamps are only as fine as the clock of the file system.
+            Such files are read again by the next refresh, which only reports them if they changed,
+            and the next poll() refreshes regardless of the directory timestamp.
+        """
+        racy_ns = time.time_ns() - _RACY_MTIME_NS
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+            self._dir_mtime_ns = mtime_ns if mtime_ns < racy_ns else None
+            with os.scandir(self.path) as it:
+                files = {}
+                for entry in it:
+                    if entry.is_file() and record.is_record_file(entry.name):
+                        st = entry.stat()
+                        files[entry.name] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            files = {}
+
+        with self._lock:
+            removed_files = [x for x in self._files if x not in files]
+            changed_files = [x for x, stat in files.items() if self._stats.get(x) != stat or x in self._racy_files]
+        self._racy_files = {x for x, (mtime_ns, _) in files.items() if mtime_ns >= racy_ns}
+
+        removed = []
+        for filename in removed_files:
+            record_id = self._files.get(filename)
+            if record_id is not None:
+                self.remove(record_id)
+                removed.append(record_id)
+
+        def read(filename: str) -> Optional[RecordHeader]:
+            try:
+                return record.read_header(os.path.join(self.path, filename))
+            except (OSError, ValueError, RecordFormatError) as error:
+                logger.warning(f'Skipped unreadable record "{filename}": {error}')
+                return None
+
+        if max_workers > 1 and len(changed_files) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                headers = list(executor.map(read, changed_files))
+        else:
+            headers = [read(x) for x in changed_files]
+
+        entries = [(h, files[x]) for x, h in zip(changed_files, headers) if h is not None]
+        with self._lock:
+            entries = [(h, stat) for h, stat in entries if not self._is_unchanged_locked(h, stat)]
+        if entries:
+            self.add_many(entries)
+        return [h.record_id for h, _ in entries], removed
+
+    def _is_unchanged_locked(self, header: RecordHeader, stat: Tuple[int, int]) -> bool:
+        # returns whether a record read again is indexed already as it is
+        indexed = self._headers.get(header.record_id)
+        return (indexed is not None and indexed.filepath == header.filepath
+                and self._stats.get(os.path.basename(header.filepath)) == stat
+                and indexed.to_dict() == header.to_dict())
+
+    def load(self, max_workers: int = INDEX_LOAD_WORKERS) -> int:
+        """
+        Loads the whole record directory, reading the headers in parallel, and marks the index ready.
+        Returns:
+            The number of indexed records.
+        """
+        t_start = time.monotonic()
+        self.refresh(max_workers)
+        self.ready.set()
+        logger.info(f'Indexed {len(self)} records in {time.monotonic() - t_start:.2f}s.')
+        return len(self)
+
+    def poll(self) -> Tuple[List[str], List[str]]:
+        """
+        Refreshes the index if the record directory has changed since the last refresh. Saving,
+        replacing or deleting a record changes the modification time of the directory, so this
+        costs a single stat() while nothing happens.
+        Returns:
+            The ids of the added or modified records and the ids of the removed records.
+        """
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns is not None and mtime_ns == self._dir_mtime_ns:
+            return [], []
+        return self.refresh()
+
+    def covers(self, filepath: str) -> bool:
+        """
+        Returns whether a record file belongs to the indexed directory.
+        """
+        return os.path.dirname(os.path.abspath(filepath)) == os.path.abspath(self.path)
+
+    def get(self, record_id: str) -> Optional[RecordHeader]:
+        """
+        Gets the header of a record, or None if it is not indexed.
+        """
+        return self._headers.get(record_id)
+
+    def get_ids(self) -> List[str]:
+        """
+        Gets the ids of all indexed records.
+        """
+        with self._lock:
+            return list(self._headers)
+
+    def query(self, start: datetime.datetime = None, end: datetime.datetime = None,
+                    cursor: str = None, limit: int = None, newest_first: bool = True, **filters
+        ) -> Tuple[List[RecordHeader], Optional[str]]:
+        """
+        Queries the records within a time range, one page at a time.
+        Args:
+            start: The start (inclusive) of the time range, or None for no lower bound.
+            end: The end (exclusive) of the time range, or None for no upper bound.
+            cursor: The cursor returned by the previous page, or None for the first page.
+            limit: The maximum number of records in the page, or None for no limit.
+            newest_first: Whether to order the records from newest to oldest.
+            filters: Value, tolerance and band filters, see SearchIndex.search(). Filtered queries
+                     must be newest first.
+        Returns:
+            The headers of the records in the page, and the cursor of the next page or None if this
+            is the last page.
+        Raises:
+            ValueError: If filters are given for an oldest first query.
+        """
+        if filters:
+            if not newest_first:
+                raise ValueError('Filtered queries can only be ordered from newest to oldest')
+            return self.search(start=start, end=end, cursor=cursor, limit=limit, **filters)
+
+        with self._lock:
+            lo = 0 if start is None else bisect.bisect_left(self._keys, (start, ''))
+            hi = len(self._keys) if end is None else bisect.bisect_left(self._keys, (end, ''))
+
+            if cursor is not None:
+                key = parse_cursor(cursor)
+                if newest_first:
+                    hi = min(hi, bisect.bisect_left(self._keys, key))
+                else:
+                    lo = max(lo, bisect.bisect_right(self._keys, key))
+
+            if newest_first:
+                page_lo = lo if limit is None else max(lo, hi - limit)
+                keys = self._keys[page_lo:hi][::-1]
+                has_more = page_lo > lo
+            else:
+                page_hi = hi if limit is None else min(hi, lo + limit)
+                keys = self._keys[lo:page_hi]
+                has_more = page_hi < hi
+
+            headers = [self._headers[record_id] for _, record_id in keys]
+
+        next_cursor = make_cursor(headers[-1]) if has_more and headers else None
+        return headers, next_cursor
+
+    def search(self, cursor: str = None, limit: int = None, **filters) -> Tuple[List[RecordHeader], Optional[str]]:
+        """
+        Searches the records by decoded value, tolerance, band count, band colors and time, newest
+        first, one page at a time.
+        Args:
+            cursor: The cursor returned by the previous page, or None for the first page.
+            limit: The maximum number of records in the page, or None for no limit.
+            filters: The filters passed to SearchIndex.search().
+        Returns:
+            The headers of the records in the page, and the cursor of the next page or None if this
+            is the last page.
+        """
+        key = None if cursor is None else parse_cursor(cursor)
+        with self._lock:
+            headers, has_more = self._search.search(cursor=key, limit=limit, **filters)
+
+        next_cursor = make_cursor(headers[-1]) if has_more and headers else None
+        return headers, next_cursor
+
+class RecordIndexThread(threading.Thread):
+    def __init__(self, index: RecordIndex, interval: float = INDEX_POLL_INTERVAL,
+                       on_change: Callable[[List[str], List[str]], None] = None):
+        """
+        Initializes the RecordIndexThread object, which loads a RecordIndex and keeps it current.
+        Args:
+            index: The index to maintain.
+            interval: Seconds between two polls of the record directory.
+            on_change: Called with the ids of the added and the removed records after every change.
+        Notes:
+            Records saved by this process are added the moment they are written, through a save
+            listener of DetectionRecord. Polling catches everything else, such as deletions by the
+            retention policy, at the cost of one stat() per interval.
+        """
+        super().__init__(daemon=True)
+        self.index = index
+        self.interval = interval
+        self.on_change = on_change
+
+        self.e_stop = threading.Event()
+
+    def _on_save(self, header: RecordHeader):
+        if self.index.covers(header.filepath):
+            self.index.add(header)
+            self._notify([header.record_id], [])
+
+    def _notify(self, added: List[str], removed: List[str]):
+        if self.on_change is not None and (added or removed):
+            try:
+                self.on_change(added, removed)
+            except Exception:
+                logger.exception('Record index change handler failed.')
+
+    def run(self):
+        """
+        Overrides the run() method in the threading.Thread superclass.
+        Runs the mainloop of this object.
+        """
+        logger.info('RecordIndexThread started.')
+        record.add_save_listener(self._on_save)
+        try:
+            self.index.load()
+            while not self.e_stop.wait(self.interval):
+                self._notify(*self.index.poll())
+        finally:
+            record.remove_save_listener(self._on_save)
+        logger.info('RecordIndexThread ended.')
+
+    def signal_stop(self):
+        """
+        Sends stop signal to this thread to terminate it.
+        """
+        self.e_stop.set()
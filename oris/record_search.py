@@ -0,0 +1,258 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from record import RecordHeader
+from detected_object import CATEGORY_2_COLOR_DICT
+
+import numpy as np
+import datetime
+import bisect
+import heapq
+import re
+
+_SI_PREFIXES = {'': 1, 'r': 1, 'k': 1e3, 'm': 1e6, 'g': 1e9}
+_VALUE_PATTERN = re.compile(r'^\s*(\d*\.?\d*)\s*([rkmg]?)\s*(\d*)\s*(?:ohms?|Ω)?\s*$', re.IGNORECASE)
+_DURATION_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+_VALUE_MATCH_EPSILON = 1e-6    # the relative difference within which two resistances are equal
+_BULK_INSERT_SIZE = 64         # inserting more items than this into a sorted list appends and sorts once
+
+class BandFilter(NamedTuple):
+    label: str                      # the band color label, e.g. "violet_band"
+    min_score: Optional[float]      # the exclusive lower bound of the band score, or None
+    max_score: Optional[float]      # the exclusive upper bound of the band score, or None
+
+def parse_resistance(value: str) -> float:
+    """
+    Parses a resistance written with an optional SI prefix, e.g. "470", "4.7k", "4k7" or "1M".
+    Raises:
+        ValueError: If value is not a valid resistance.
+    """
+    match = _VALUE_PATTERN.match(value)
+    if match is None or not (match.group(1) or match.group(3)) or match.group(1) == '.':
+        raise ValueError(f'"{value}" is not a valid resistance')
+    number, prefix, decimals = match.groups()
+    if decimals:
+        if '.' in number or not prefix:
+            raise ValueError(f'"{value}" is not a valid resistance')
+        number = f'{number or 0}.{decimals}'
+    return float(number) * _SI_PREFIXES[prefix.lower()]
+
+def parse_duration(value: str) -> datetime.timedelta:
+    """
+    Parses a duration such as "30m", "24h", "7d" or "2w".
+    Raises:
+        ValueError: If value is not a valid duration.
+    """
+    value = value.strip().lower()
+    unit = _DURATION_UNITS.get(value[-1:])
+    try:
+        amount = float(value[:-1])
+    except ValueError:
+        unit = None
+    if unit is None or not amount >= 0:
+        raise ValueError(f'"{value}" is not a valid duration')
+    try:
+        return datetime.timedelta(**{unit: amount})
+    except OverflowError:
+        raise ValueError(f'"{value}" is too long a duration')
+
+def parse_band_filter(value: str) -> BandFilter:
+    """
+    Parses a band filter such as "violet", "violet<0.6" or "red>0.9".
+    Raises:
+        ValueError: If value is not a valid band filter, or the color is not one the detector knows.
+    """
+    match = re.match(r'^\s*([a-z]+)(?:_band)?\s*(?:([<>])\s*(\d*\.?\d+))?\s*$', value.lower())
+    if match is None:
+        raise ValueError(f'"{value}" is not a valid band filter')
+    color, op, score = match.groups()
+    if color + '_band' not in CATEGORY_2_COLOR_DICT:
+        raise ValueError(f'"{color}" is not a band color')
+    if op is None:
+        return BandFilter(color + '_band', None, None)
+    if op == '<':
+        return BandFilter(color + '_band', None, float(score))
+    return BandFilter(color + '_band', float(score), None)
+
+def _make_bitmap(slots: Iterable[int], size: int) -> int:
+    # setting bits in a bytearray first is linear, while or-ing the bits into an int one by one
+    # would copy the whole int for every slot
+    buffer = bytearray((size + 7) // 8)
+    for slot in slots:
+        buffer[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buffer, 'little')
+
+def _iter_bitmap(bitmap: int, size: int) -> np.ndarray:
+    data = np.frombuffer(bitmap.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(data, bitorder='little'))
+
+class SearchIndex:
+    def __init__(self):
+        """
+        Initializes the SearchIndex object, a secondary index over the decoded values, tolerances,
+        band counts and band colors of records.
+        Notes:
+            Every record gets a small integer slot. Tolerances, band counts and band colors map to
+            bitmaps of slots, held as Python ints, so combining filters is a handful of big-integer
+            ANDs. Resistances, times and band scores are kept in sorted lists for range queries.
+            The index is not thread-safe; RecordIndex updates and queries it under its own lock.
+        """
+        self._slots: Dict[str, int] = {}                # record_id -> slot
+        self._headers: List[Optional[RecordHeader]] = []   # slot -> header
+        self._free: List[int] = []
+
+        self._all = 0
+        self._times: List[Tuple[datetime.datetime, str, int]] = []     # sorted (time, record_id, slot)
+        self._values: List[Tuple[float, int]] = []                      # sorted (resistance, slot)
+        self._tolerances: Dict[float, int] = {}                         # tolerance -> bitmap
+        self._band_counts: Dict[int, int] = {}                          # band count -> bitmap
+        self._colors: Dict[str, int] = {}                               # band label -> bitmap
+        self._scores: Dict[str, List[Tuple[float, int]]] = {}           # band label -> sorted (score, slot)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, header: RecordHeader):
+        """
+        Adds a record to the index, replacing any record with the same id.
+        """
+        self.add_many([header])
+
+    def add_many(self, headers: List[RecordHeader]):
+        """
+        Adds records to the index at once, replacing any records with the same ids.
+        Notes:
+            Large batches are appended to the sorted lists and sorted once, and the bits of each
+            posting are collected into a single bitmap, so loading a whole directory stays fast.
+            If a batch holds several headers of the same record, the last one wins.
+        """
+        headers = list({header.record_id: header for header in headers}.values())
+        for header in headers:
+            self.remove(header.record_id)
+        postings: Dict[Tuple[str, object], List[int]] = {}
+        times, values, scores = [], [], {}
+        for header in headers:
+            slot = self._free.pop() if self._free else len(self._headers)
+            if slot == len(self._headers):
+                self._headers.append(None)
+            self._slots[header.record_id] = slot
+            self._headers[slot] = header
+
+            postings.setdefault(('all', None), []).append(slot)
+            times.append((header.time, header.record_id, slot))
+            if header.resistance is not None:
+                values.append((float(header.resistance), slot))
+            if header.tolerance is not None:
+                postings.setdefault(('tolerance', float(header.tolerance)), []).append(slot)
+            postings.setdefault(('band_count', len(header.bands)), []).append(slot)
+            for band in header.bands:
+                postings.setdefault(('color', band.label), []).append(slot)
+                scores.setdefault(band.label, []).append((band.score, slot))
+
+        size = len(self._headers)
+        for (kind, key), slots in postings.items():
+            bitmap = _make_bitmap(slots, size)
+            if kind == 'all':
+                self._all |= bitmap
+            else:
+                table = {'tolerance': self._tolerances, 'band_count': self._band_counts, 'color': self._colors}[kind]
+                table[key] = table.get(key, 0) | bitmap
+        _insert_sorted(self._times, times)
+        _insert_sorted(self._values, values)
+        for label, new_scores in scores.items():
+            _insert_sorted(self._scores.setdefault(label, []), new_scores)
+
+    def remove(self, record_id: str):
+        """
+        Removes a record from the index, if it is indexed.
+        """
+        slot = self._slots.pop(record_id, None)
+        if slot is None:
+            return
+        header = self._headers[slot]
+        self._headers[slot] = None
+        self._free.append(slot)
+        mask = ~(1 << slot)
+
+        self._all &= mask
+        _remove_sorted(self._times, (header.time, header.record_id, slot))
+        if header.resistance is not None:
+            _remove_sorted(self._values, (float(header.resistance), slot))
+        if header.tolerance is not None:
+            self._tolerances[float(header.tolerance)] &= mask
+        self._band_counts[len(header.bands)] &= mask
+        for band in header.bands:
+            self._colors[band.label] &= mask
+            _remove_sorted(self._scores[band.label], (band.score, slot))
+
+    def _range_bitmap(self, items: List[tuple], lo, hi) -> int:
+        i = 0 if lo is None else bisect.bisect_left(items, (lo,))
+        j = len(items) if hi is None else bisect.bisect_left(items, (hi,))
+        return _make_bitmap((item[-1] for item in items[i:j]), len(self._headers))
+
+    def search(self, min_resistance: float = None, max_resistance: float = None, resistance: float = None,
+                     tolerance: float = None, band_count: int = None, bands: List[BandFilter] = (),
+                     start: datetime.datetime = None, end: datetime.datetime = None,
+                     cursor: Tuple[datetime.datetime, str] = None, limit: int = None
+        ) -> Tuple[List[RecordHeader], bool]:
+        """
+        Finds the records matching all given filters, newest first.
+        Args:
+            min_resistance: The inclusive lower bound of the resistance.
+            max_resistance: The inclusive upper bound of the resistance.
+            resistance: The exact resistance, overriding min_resistance and max_resistance.
+            tolerance: The exact tolerance in percent.
+            band_count: The exact number of detected bands.
+            bands: Band colors which must all be present, optionally with a score bound.
+            start: The start (inclusive) of the time range.
+            end: The end (exclusive) of the time range.
+            cursor: Only return records older than this (time, record_id) key.
+            limit: The maximum number of records to return.
+        Returns:
+            The headers of the matching records, and whether more records match beyond limit.
+        """
+        bitmap = self._all
+        if resistance is not None:
+            min_resistance = resistance * (1 - _VALUE_MATCH_EPSILON)
+            max_resistance = resistance * (1 + _VALUE_MATCH_EPSILON)
+        if min_resistance is not None or max_resistance is not None:
+            hi = None if max_resistance is None else np.nextafter(max_resistance, np.inf)
+            bitmap &= self._range_bitmap(self._values, min_resistance, hi)
+        if tolerance is not None:
+            bitmap &= self._tolerances.get(float(tolerance), 0)
+        if band_count is not None:
+            bitmap &= self._band_counts.get(band_count, 0)
+        for band in bands:
+            if band.min_score is None and band.max_score is None:
+                bitmap &= self._colors.get(band.label, 0)
+                continue
+            lo = None if band.min_score is None else np.nextafter(band.min_score, np.inf)
+            bitmap &= self._range_bitmap(self._scores.get(band.label, []), lo, band.max_score)
+            if not bitmap:
+                break
+
+        if start is not None or end is not None or cursor is not None:
+            i = 0 if start is None else bisect.bisect_left(self._times, (start,))
+            j = len(self._times) if end is None else bisect.bisect_left(self._times, (end,))
+            if cursor is not None:
+                j = min(j, bisect.bisect_left(self._times, tuple(cursor)))
+            bitmap &= _make_bitmap((x[2] for x in self._times[i:j]), len(self._headers))
+
+        headers = [self._headers[slot] for slot in _iter_bitmap(bitmap, len(self._headers)).tolist()]
+        key = lambda x: (x.time, x.record_id)
+        if limit is not None and len(headers) > limit:
+            return heapq.nlargest(limit, headers, key=key), True
+        headers.sort(key=key, reverse=True)
+        return headers, False
+
+def _insert_sorted(items: list, new_items: list):
+    if len(new_items) > _BULK_INSERT_SIZE:
+        items.extend(new_items)
+        items.sort()
+    else:
+        for item in new_items:
+            bisect.insort(items, item)
+
+def _remove_sorted(items: list, item):
+    i = bisect.bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
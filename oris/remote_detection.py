@@ -0,0 +1,190 @@
+from typing import Callable, List, Tuple
+
+from band_detection import BandDetectionResult, create_detector, detect_bands
+from resistor import decode_resistor
+
+from concurrent.futures import Future
+from PIL import Image
+import numpy as np
+import threading
+import queue
+import time
+import io
+import cv2
+
+import logging
+logger = logging.getLogger(__name__)
+
+DETECT_ENDPOINT_ENABLED = False         # serve POST /detect, which loads a second detector into the web server
+DETECT_MAX_BATCH        = 4             # the maximum number of requests processed as one batch
+DETECT_MAX_WAIT         = 0.01          # seconds a batch waits for more requests after its first one
+DETECT_MAX_QUEUE        = 16            # requests waiting beyond this are rejected as busy
+DETECT_MAX_IMAGE_BYTES  = 8 * 1024**2   # the maximum size of an uploaded image
+DETECT_MAX_PIXELS       = 4096 * 4096   # the maximum resolution of an uploaded image
+
+class DetectionBusyError(Exception):
+    def __init__(self, error_msg='The detection queue is full'):
+        super().__init__()
+        self.error_msg = error_msg
+
+    def __str__(self):
+        return f'{type(self).__name__}: {self.error_msg}'
+
+def decode_image(data: bytes, max_pixels: int = DETECT_MAX_PIXELS) -> np.ndarray:
+    """
+    Decodes an uploaded JPEG or PNG image.
+    Args:
+        data: The encoded image.
+        max_pixels: The maximum number of pixels of the image.
+    Returns:
+        The RGB image.
+    Raises:
+        ValueError: If data is not a supported image or the image is too large.
+    """
+    if not data.startswith((b'\xff\xd8', b'\x89PNG')):
+        raise ValueError('The image is not a JPEG or PNG image')
+    # the resolution is read from the header, so an oversized image is rejected before its
+    # bitmap is allocated by decoding it
+    try:
+        with Image.open(io.BytesIO(data)) as pil_image:
+            width, height = pil_image.size
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValueError('The image cannot be decoded')
+    if width * height > max_pixels:
+        raise ValueError(f'The image is larger than {max_pixels} pixels')
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError('The image cannot be decoded')
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+def result_to_json(result: BandDetectionResult) -> dict:
+    """
+    Converts a band detection result into the JSON representation used by the record API.
+    """
+    resistance, tolerance, error = decode_resistor(result)
+    return {
+        'value': {'resistance': resistance, 'tolerance': tolerance, 'error': error},
+        'bands': [
+            {
+                'id': int(band.id), 'label': band.label, 'score': float(band.score),
+                'box': [int(band.bounding_box.left), int(band.bounding_box.top),
+                        int(band.bounding_box.right), int(band.bounding_box.bottom)],
+            }
+            for band in result.detected_bands
+        ],
+    }
+
+class DetectionBatcher(threading.Thread):
+    def __init__(self, max_batch: int = DETECT_MAX_BATCH, max_wait: float = DETECT_MAX_WAIT,
+                       max_queue: int = DETECT_MAX_QUEUE, detector_factory: Callable = create_detector):
+        """
+        Initializes the DetectionBatcher object, which runs the band detection for concurrent
+        remote requests on a single detector.
+        Args:
+            max_batch: The maximum number of requests processed as one batch.
+            max_wait: Seconds a batch waits for more requests after its first one.
+            max_queue: The maximum number of waiting requests.
+            detector_factory: Creates the ObjectDetector, called once from this thread.
+        Notes:
+            The detection model takes one image per invocation, so a batch runs back to back on the
+            one interpreter, without handing it between threads or waking up once per request. The
+            detector is only created when the thread starts, so enabling the endpoint costs nothing
+            until the server runs.
+        """
+        super().__init__(daemon=True)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.detector_factory = detector_factory
+
+        self._queue: queue.Queue[Tuple[np.ndarray, Future]] = queue.Queue(max_queue)
+        self.n_batches = 0
+        self.n_images = 0
+
+        self.e_stop = threading.Event()
+
+    def submit(self, image: np.ndarray) -> Future:
+        """
+        Queues an image for detection.
+        Args:
+            image: The RGB image to perform the detection upon.
+        Returns:
+            The Future receiving the BandDetectionResult object.
+        Raises:
+            DetectionBusyError: If the queue is full or the batcher is stopped.
+        """
+        if self.e_stop.is_set():
+            raise DetectionBusyError('The detection service is stopped')
+        future = Future()
+        try:
+            self._queue.put_nowait((image, future))
+        except queue.Full:
+            raise DetectionBusyError()
+        return future
+
+    def get_queue_depth(self) -> int:
+        """
+        Returns the number of requests waiting for the detector.
+        """
+        return self._queue.qsize()
+
+    def _collect_batch(self) -> List[Tuple[np.ndarray, Future]]:
+        try:
+            batch = [self._queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        """
+        Overrides the run() method in the threading.Thread superclass.
+        Runs the mainloop of this object.
+        """
+        logger.info('DetectionBatcher started.')
+
+        detector = None
+        try:
+            detector = self.detector_factory()
+        except Exception:
+            logger.exception('DetectionBatcher failed to create the detector.')
+
+        while not self.e_stop.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            self.n_batches += 1
+            self.n_images += len(batch)
+            for image, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if detector is None:
+                    future.set_exception(DetectionBusyError('The detector is not available'))
+                    continue
+                try:
+                    future.set_result(detect_bands(detector, image))
+                except Exception as error:
+                    future.set_exception(error)
+
+        self._cancel_pending()
+        logger.info('DetectionBatcher ended.')
+
+    def _cancel_pending(self):
+        while True:
+            try:
+                _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(DetectionBusyError('The detection service is stopped'))
+
+    def signal_stop(self):
+        """
+        Sends stop signal to this thread to terminate it. Waiting requests fail with DetectionBusyError.
+        """
+        self.e_stop.set()
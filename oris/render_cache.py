@@ -0,0 +1,233 @@
+from typing import Iterable, Optional, Tuple
+
+from record import RecordHeader
+
+from PIL import Image
+import numpy as np
+import collections
+import threading
+import io
+import os
+
+THUMBNAIL_SIZE          = (200, 200)
+CACHE_MAX_DISK_BYTES    = 64 * 1024**2      # the disk budget of the rendered thumbnails in bytes
+CACHE_MAX_MEMORY_BYTES  = 8 * 1024**2       # the memory budget of the rendered thumbnails in bytes
+
+_THUMBNAIL_EXT = '.png'
+
+class RenderBusyError(Exception):
+    def __init__(self, error_msg='No render slot became free in time'):
+        super().__init__()
+        self.error_msg = error_msg
+    def __str__(self):
+        return f'{type(self).__name__}: {self.error_msg}'
+
+class _CacheEntry:
+    def __init__(self, key: str, filepath: str, nbytes: int):
+        self.key = key
+        self.filepath = filepath
+        self.nbytes = nbytes
+        self.data: Optional[bytes] = None
+
+class RenderCache:
+    def __init__(self, cache_path: str, size: Tuple[int] = THUMBNAIL_SIZE,
+                       max_disk_bytes: int = CACHE_MAX_DISK_BYTES,
+                       max_memory_bytes: int = CACHE_MAX_MEMORY_BYTES,
+                       render_slots: threading.Semaphore = None, render_timeout: float = None):
+        """
+        Initializes the RenderCache object, which renders record images with their detection
+        result drawn on, and caches the rendered thumbnails on disk and in memory.
+        Args:
+            cache_path: The directory to store the rendered thumbnails in.
+            size: The size of the thumbnails given by a tuple of (width, height).
+            max_disk_bytes: The maximum total size of the thumbnails kept on disk.
+            max_memory_bytes: The maximum total size of the thumbnails kept in memory.
+            render_slots: The semaphore capping the number of concurrent renders, or None for no cap.
+            render_timeout: Seconds to wait for a render slot, or None to wait forever.
+        Notes:
+            A thumbnail is keyed by its record id and the inode, modification time and size of the record
+            file, and the key is part of the thumbnail filename. A changed record therefore never
+            matches a stale thumbnail, and the disk cache stays valid across restarts.
+        """
+        self.cache_path = cache_path
+        self.size = size
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.render_slots = render_slots
+        self.render_timeout = render_timeout
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()   # record_id -> _CacheEntry, least recently used first
+        self._disk_bytes = 0
+        self._memory_bytes = 0
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        for entry in os.scandir(self.cache_path):
+            record_id, key = self._parse_filename(entry.name)
+            if record_id is None or record_id in self._entries:
+                self._remove_file(entry.path)
+                continue
+            self._entries[record_id] = _CacheEntry(key, entry.path, entry.stat().st_size)
+            self._disk_bytes += entry.stat().st_size
+
+    @staticmethod
+    def make_key(header: RecordHeader) -> str:
+        """
+        Makes the cache key of the thumbnail of a record, which changes whenever the record file changes.
+        Notes:
+            Saving a record replaces its file with a new one, so the inode number tells apart two
+            saves of the same size within the granularity of the modification time.
+        """
+        stat = os.stat(header.filepath)
+        return f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+    @staticmethod
+    def _parse_filename(filename: str) -> Tuple[Optional[str], Optional[str]]:
+        if not filename.endswith(_THUMBNAIL_EXT):
+            return None, None
+        record_id, _, key = filename[:-len(_THUMBNAIL_EXT)].rpartition('.')
+        if not record_id:
+            return None, None
+        return record_id, key
+
+    @staticmethod
+    def _remove_file(filepath: str):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+    def render(self, header: RecordHeader) -> bytes:
+        """
+        Renders the thumbnail of a record without using the cache.
+        Args:
+            header: The header of the record to render.
+        Returns:
+            The PNG-encoded thumbnail.
+        """
+        image = np.array(header.load_image())
+        header.to_detection_result().draw_on_img(image)
+
+        pil_image = Image.fromarray(image)
+        pil_image.thumbnail(self.size)
+
+        output = io.BytesIO()
+        pil_image.save(output, 'PNG')
+        return output.getvalue()
+
+    def get(self, header: RecordHeader) -> bytes:
+        """
+        Gets the thumbnail of a record, rendering it only if it is not cached or out of date.
+        Args:
+            header: The header of the record.
+        Returns:
+            The PNG-encoded thumbnail.
+        Raises:
+            RenderBusyError: If the thumbnail has to be rendered but no render slot became free in time.
+        """
+        filepath, data = self._lookup(header, load=True)
+        return data
+
+    def get_file(self, header: RecordHeader) -> Tuple[str, Optional[bytes]]:
+        """
+        Gets the thumbnail file of a record, rendering it only if it is not cached or out of date.
+        Args:
+            header: The header of the record.
+        Returns:
+            The path of the PNG-encoded thumbnail file, and its content if it is cached in memory.
+        Raises:
+            RenderBusyError: If the thumbnail has to be rendered but no render slot became free in time.
+        Notes:
+            The file may be evicted by another thread at any time, so callers must handle a
+            FileNotFoundError when opening it, e.g. by falling back to get().
+        """
+        return self._lookup(header, load=False)
+
+    def _lookup(self, header: RecordHeader, load: bool) -> Tuple[str, Optional[bytes]]:
+        key = self.make_key(header)
+
+        with self._lock:
+            entry = self._entries.get(header.record_id)
+            if entry is not None and entry.key == key:
+                self._entries.move_to_end(header.record_id)
+                if entry.data is not None or not load:
+                    return entry.filepath, entry.data
+                filepath = entry.filepath
+            else:
+                filepath = None
+
+        data = None
+        if filepath is not None:
+            try:
+                with open(filepath, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                pass
+        if data is None:
+            data = self._render_in_slot(header)
+            filepath = os.path.join(self.cache_path, f'{header.record_id}.{key}{_THUMBNAIL_EXT}')
+            os.makedirs(self.cache_path, exist_ok=True)
+            temp_filepath = f'{filepath}.{threading.get_ident()}.tmp'
+            with open(temp_filepath, 'wb') as f:
+                f.write(data)
+            os.replace(temp_filepath, filepath)
+
+        with self._lock:
+            self._store(header.record_id, key, filepath, data)
+        return filepath, data
+
+    def _render_in_slot(self, header: RecordHeader) -> bytes:
+        if self.render_slots is None:
+            return self.render(header)
+        if not self.render_slots.acquire(timeout=self.render_timeout):
+            raise RenderBusyError()
+        try:
+            return self.render(header)
+        finally:
+            self.render_slots.release()
+
+    def _store(self, record_id: str, key: str, filepath: str, data: bytes):
+        old_entry = self._entries.pop(record_id, None)
+        if old_entry is not None:
+            self._disk_bytes -= old_entry.nbytes
+            if old_entry.data is not None:
+                self._memory_bytes -= old_entry.nbytes
+            if old_entry.filepath != filepath:
+                self._remove_file(old_entry.filepath)
+
+        entry = _CacheEntry(key, filepath, len(data))
+        entry.data = data
+        self._entries[record_id] = entry
+        self._disk_bytes += entry.nbytes
+        self._memory_bytes += entry.nbytes
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        for record_id, entry in self._entries.items():
+            if self._memory_bytes <= self.max_memory_bytes:
+                break
+            if entry.data is not None:
+                entry.data = None
+                self._memory_bytes -= entry.nbytes
+
+        while self._disk_bytes > self.max_disk_bytes and len(self._entries) > 1:
+            record_id, entry = self._entries.popitem(last=False)
+            self._disk_bytes -= entry.nbytes
+            if entry.data is not None:
+                self._memory_bytes -= entry.nbytes
+            self._remove_file(entry.filepath)
+
+    def prune(self, record_ids: Iterable[str]):
+        """
+        Evicts the thumbnails of all records which no longer exist.
+        Args:
+            record_ids: The ids of all existing records.
+        """
+        record_ids = set(record_ids)
+        with self._lock:
+            for record_id in [x for x in self._entries if x not in record_ids]:
+                entry = self._entries.pop(record_id)
+                self._disk_bytes -= entry.nbytes
+                if entry.data is not None:
+                    self._memory_bytes -= entry.nbytes
+                self._remove_file(entry.filepath)
@@ -1,3 +1,5 @@
+from typing import Optional, Tuple
+
 from band_detection import BandDetectionResult
 from detected_object import DetectedBand
 
@@ -119,3 +121,16 @@ class Resistor:
         if tolerance is None:
             raise InvalidToleranceError(self.bands.detected_bands[-1])
         return tolerance
+
+def decode_resistor(bands: BandDetectionResult) -> Tuple[Optional[int], Optional[float], Optional[str]]:
+    """
+    Decodes the resistor represented by a band detection result.
+    Returns:
+        The resistance, the tolerance and None, or None, None and the error message if the bands
+        cannot be decoded.
+    """
+    try:
+        resistor = Resistor(bands)
+        return resistor.get_resistance(), resistor.get_tolerance(), None
+    except ResistorError as e:
+        return None, None, str(e)
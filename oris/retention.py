@@ -0,0 +1,213 @@
+from typing import List, Optional
+
+import record
+
+import datetime
+import threading
+import shutil
+import time
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+RETENTION_MAX_BYTES     = 512 * 1024**2     # the disk budget of the record store in bytes, None for unlimited
+RETENTION_MAX_AGE       = datetime.timedelta(days=90)   # the maximum age of a record, None for unlimited
+RETENTION_INTERVAL      = 10 * 60           # seconds between two retention passes of the RetentionThread
+
+_TRASH_SUFFIX           = '.trash-'
+_CORRUPT_SUFFIX         = '.corrupt'         # appended to legacy records which cannot be converted, so they are skipped
+_STALE_TEMP_AGE         = 60 * 60           # seconds after which a leftover partial write is considered abandoned
+
+class RetentionPolicy:
+    def __init__(self, max_bytes: Optional[int] = RETENTION_MAX_BYTES,
+                       max_age: Optional[datetime.timedelta] = RETENTION_MAX_AGE):
+        """
+        Initializes the RetentionPolicy object.
+        Args:
+            max_bytes: The maximum total size of the record files in bytes, or None for no limit.
+            max_age: The maximum age of a record file, or None for no limit.
+        """
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def select_evictions(self, entries: List[os.DirEntry], now: float = None) -> List[os.DirEntry]:
+        """
+        Selects the record files to evict under this policy, oldest first.
+        Args:
+            entries: The record files in the record store.
+            now: The current time as a timestamp, defaults to time.time().
+        Returns:
+            The record files to delete.
+        """
+        if now is None:
+            now = time.time()
+        entries = sorted(entries, key=lambda x: x.stat().st_mtime)
+
+        evictions = []
+        total_bytes = sum(x.stat().st_size for x in entries)
+        for entry in entries:
+            expired = self.max_age is not None and now - entry.stat().st_mtime > self.max_age.total_seconds()
+            over_budget = self.max_bytes is not None and total_bytes > self.max_bytes
+            if not expired and not over_budget:
+                break
+            evictions.append(entry)
+            total_bytes -= entry.stat().st_size
+        return evictions
+
+def _scan_record_files(path: str) -> List[os.DirEntry]:
+    # the entries are stat()ed here, which caches the result, skipping files deleted meanwhile
+    os.makedirs(path, exist_ok=True)
+    entries = []
+    for entry in os.scandir(path):
+        try:
+            if entry.is_file() and record.is_record_file(entry.name):
+                entry.stat()
+                entries.append(entry)
+        except OSError:
+            pass
+    return entries
+
+def enforce_retention(policy: RetentionPolicy, path: str = None) -> int:
+    """
+    Deletes the oldest record files until the record store satisfies the retention policy.
+    Args:
+        policy: The retention policy to enforce.
+        path: The record store directory, defaults to record.RECORD_SAVE_PATH.
+    Returns:
+        The number of deleted record files.
+    """
+    if path is None:
+        path = record.RECORD_SAVE_PATH
+
+    count = 0
+    for entry in policy.select_evictions(_scan_record_files(path)):
+        try:
+            os.remove(entry.path)
+            count += 1
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            logger.warning(f'Evicting the record "{entry.path}" failed: {error}')
+    if count:
+        logger.info(f'Retention evicted {count} record(s) from "{path}".')
+    return count
+
+def _compact_record_file(entry: os.DirEntry, now: float) -> int:
+    # compacts one file of the record store, returning the number of files cleaned up or converted
+    if not entry.is_file():
+        return 0
+    if entry.name.endswith(record.LEGACY_FILE_EXT):
+        try:
+            record.migrate_legacy_record(os.path.abspath(entry.path))
+        except OSError:
+            raise
+        except Exception as error:
+            # unpickling a truncated file or one of an old class raises almost anything
+            logger.warning(f'The legacy record "{entry.path}" is corrupt and is set aside: {error!r}')
+            os.replace(entry.path, entry.path + _CORRUPT_SUFFIX)
+        return 1
+    if entry.name.endswith('.tmp') and now - entry.stat().st_mtime > _STALE_TEMP_AGE:
+        os.remove(entry.path)
+        return 1
+    return 0
+
+def compact_records(path: str = None) -> int:
+    """
+    Compacts the record store by converting legacy records, and removing abandoned partial writes
+    and leftovers of earlier clear operations. Legacy records which cannot be unpickled are renamed
+    with the suffix _CORRUPT_SUFFIX and left alone afterwards. A file which cannot be handled, e.g.
+    as it was deleted meanwhile, is logged and skipped.
+    Args:
+        path: The record store directory, defaults to record.RECORD_SAVE_PATH.
+    Returns:
+        The number of files and directories cleaned up or converted.
+    """
+    if path is None:
+        path = record.RECORD_SAVE_PATH
+    os.makedirs(path, exist_ok=True)
+
+    count = 0
+    now = time.time()
+    for entry in os.scandir(path):
+        try:
+            count += _compact_record_file(entry, now)
+        except OSError as error:
+            logger.warning(f'Compacting "{entry.path}" failed: {error}')
+
+    parent, name = os.path.split(os.path.normpath(path))
+    for entry in os.scandir(parent or '.'):
+        if entry.is_dir() and entry.name.startswith(name + _TRASH_SUFFIX):
+            shutil.rmtree(entry.path, ignore_errors=True)
+            count += 1
+    return count
+
+def clear_all_records(path: str = None) -> threading.Thread:
+    """
+    Clears all records by atomically swapping the record store with an empty directory, and
+    deletes the old records in a background thread.
+    Args:
+        path: The record store directory, defaults to record.RECORD_SAVE_PATH.
+    Returns:
+        The started thread deleting the old records.
+    """
+    if path is None:
+        path = record.RECORD_SAVE_PATH
+    os.makedirs(path, exist_ok=True)
+
+    path = os.path.normpath(path)
+    trash_path = f'{path}{_TRASH_SUFFIX}{time.time_ns()}'
+    os.rename(path, trash_path)
+    os.makedirs(path, exist_ok=True)
+
+    thread = threading.Thread(target=shutil.rmtree, args=(trash_path,), kwargs={'ignore_errors': True}, daemon=True)
+    thread.start()
+    return thread
+
+class RetentionThread(threading.Thread):
+    def __init__(self, policy: RetentionPolicy = None, interval: float = RETENTION_INTERVAL):
+        """
+        Initializes the RetentionThread object, which periodically enforces the retention policy
+        and compacts the record store in the background.
+        Args:
+            policy: The retention policy to enforce, defaults to RetentionPolicy().
+            interval: Seconds between two retention passes.
+        """
+        super().__init__(daemon=True)
+        self.policy = policy if policy is not None else RetentionPolicy()
+        self.interval = interval
+
+        self.e_stop = threading.Event()
+
+    def run(self):
+        """
+        Overrides the run() method in the threading.Thread superclass.
+        Runs the mainloop of this object.
+        """
+        logger.info('RetentionThread started.')
+
+        while not self.e_stop.is_set():
+            self.run_pass()
+            self.e_stop.wait(self.interval)
+
+        logger.info('RetentionThread ended.')
+
+    def run_pass(self):
+        """
+        Compacts the record store and enforces the retention policy once. A failure of compacting
+        is logged and does not keep the retention policy from being enforced.
+        """
+        steps = [('Compacting the records', compact_records), ('Enforcing the retention', lambda: enforce_retention(self.policy))]
+        for name, step in steps:
+            try:
+                step()
+            except OSError as error:
+                logger.warning(f'{name} failed: {error}')
+            except Exception:
+                logger.exception(f'{name} failed.')
+
+    def signal_stop(self):
+        """
+        Sends stop signal to this thread to terminate it.
+        """
+        self.e_stop.set()
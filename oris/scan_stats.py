@@ -0,0 +1,289 @@
+from typing import Dict, List, Optional
+
+from band_detection import BandDetectionResult
+from resistor import decode_resistor
+import metrics
+
+import collections
+import bisect
+import datetime
+import threading
+import json
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+STATS_FILE_PATH     = './scan_stats.json'   # where the statistics are persisted
+STATS_SAVE_INTERVAL = 60                    # seconds between two saves of changed statistics
+STATS_SHIFT_HOURS   = 8                     # the length of a shift, shifts start at midnight
+STATS_MAX_SHIFTS    = 3 * 90                # the number of most recent shifts kept
+STATS_SCORE_BINS    = 10                    # equal-width bins of the band score histogram over [0, 1]
+STATS_CYCLE_BUCKETS = metrics.stabilization_cycles.buckets   # upper bounds of the stabilization cycle histogram
+
+_SHIFT_KEY_FORMAT   = '%Y-%m-%d_%H'
+
+def format_value(resistance: float, tolerance: float) -> str:
+    """
+    Formats a decoded resistor value compactly, e.g. "4.7k 5%".
+    """
+    for prefix, scale in (('G', 1e9), ('M', 1e6), ('k', 1e3)):
+        if resistance >= scale:
+            return f'{resistance / scale:g}{prefix} {tolerance:g}%'
+    return f'{resistance:g} {tolerance:g}%'
+
+def get_shift_key(time: datetime.datetime) -> str:
+    """
+    Gets the key of the shift a time falls into, which is the start hour of the shift.
+    """
+    start = time.replace(hour=time.hour - time.hour % STATS_SHIFT_HOURS, minute=0, second=0, microsecond=0)
+    return start.strftime(_SHIFT_KEY_FORMAT)
+
+class ScanAggregate:
+    def __init__(self):
+        """
+        Initializes the ScanAggregate object, which holds the running aggregates of a set of scans.
+        """
+        self.scans = 0
+        self.saved = 0
+        self.rejected = 0
+        self.undecoded = 0
+        self.scored = 0                 # the scans with at least one band, which have a mean band score
+        self.confidence_sum = 0.0       # the sum over scored scans of the mean band score of a scan
+        self.values: Dict[str, int] = collections.Counter()        # format_value() -> saved scans
+        self.score_histogram = [0] * STATS_SCORE_BINS
+        self.cycle_histogram = [0] * (len(STATS_CYCLE_BUCKETS) + 1)
+        self.cycles_sum = 0
+        self.cycles_count = 0
+
+    def add(self, scores: List[float], value: Optional[str], saved: bool, cycles: Optional[int]):
+        """
+        Adds one scan to the aggregates, in time proportional to its number of bands.
+        Args:
+            scores: The scores of the detected bands.
+            value: The decoded value as formatted by format_value(), or None if it cannot be decoded.
+            saved: Whether the scan was saved, otherwise it was rejected.
+            cycles: The number of detection results processed until the result was taken, if known.
+        """
+        self.scans += 1
+        if saved:
+            self.saved += 1
+        else:
+            self.rejected += 1
+        if value is None:
+            self.undecoded += 1
+        elif saved:
+            self.values[value] += 1
+        if scores:
+            self.scored += 1
+            self.confidence_sum += sum(scores) / len(scores)
+        for score in scores:
+            self.score_histogram[min(int(score * STATS_SCORE_BINS), STATS_SCORE_BINS - 1)] += 1
+        if cycles is not None:
+            self.cycle_histogram[bisect.bisect_left(STATS_CYCLE_BUCKETS, cycles)] += 1
+            self.cycles_sum += cycles
+            self.cycles_count += 1
+
+    def to_json(self) -> dict:
+        """
+        Converts the aggregates into a JSON object, including the derived rates and means.
+        """
+        return {
+            'scans': self.scans,
+            'saved': self.saved,
+            'rejected': self.rejected,
+            'undecoded': self.undecoded,
+            'rejection_rate': self.rejected / self.scans if self.scans else None,
+            'mean_confidence': self.confidence_sum / self.scored if self.scored else None,
+            'scored': self.scored,
+            'confidence_sum': self.confidence_sum,
+            'values': dict(self.values.most_common()),
+            'score_histogram': list(self.score_histogram),
+            'cycle_histogram': list(self.cycle_histogram),
+            'mean_cycles': self.cycles_sum / self.cycles_count if self.cycles_count else None,
+            'cycles_sum': self.cycles_sum,
+            'cycles_count': self.cycles_count,
+        }
+
+    @classmethod
+    def from_json(cls, obj: dict) -> 'ScanAggregate':
+        """
+        Restores the aggregates from a JSON object made by to_json().
+        Notes:
+            Files written before the scored scans were counted lack "scored", which is then taken
+            as the number of scans, the divisor of the mean confidence at that time.
+        """
+        aggregate = cls()
+        for name in ('scans', 'saved', 'rejected', 'undecoded', 'confidence_sum', 'cycles_sum', 'cycles_count'):
+            setattr(aggregate, name, obj[name])
+        aggregate.scored = obj.get('scored', aggregate.scans)
+        aggregate.values.update(obj['values'])
+        if len(obj['score_histogram']) == STATS_SCORE_BINS:
+            aggregate.score_histogram = list(obj['score_histogram'])
+        if len(obj['cycle_histogram']) == len(STATS_CYCLE_BUCKETS) + 1:
+            aggregate.cycle_histogram = list(obj['cycle_histogram'])
+        return aggregate
+
+class ScanStatistics:
+    def __init__(self, path: str = STATS_FILE_PATH):
+        """
+        Initializes the ScanStatistics object, which keeps the statistics of all scans, in total
+        and per shift.
+        Args:
+            path: The file the statistics are persisted to.
+        Notes:
+            Every scan updates the aggregates in constant time when it is saved or rejected, so
+            reading the statistics never touches the records, however many there are. All methods
+            are safe to call from multiple threads.
+        """
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._total = ScanAggregate()
+        self._shifts: Dict[str, ScanAggregate] = collections.OrderedDict()    # shift key -> aggregate, oldest first
+        self._file_mtime_ns = None
+
+        self.version = 0            # incremented on every change of the statistics
+        self.saved_version = 0      # the version last written to or read from the file
+
+    def record_scan(self, result: BandDetectionResult, saved: bool, cycles: int = None,
+                          time: datetime.datetime = None):
+        """
+        Adds a scan to the statistics.
+        Args:
+            result: The detection result of the scan.
+            saved: Whether the scan was saved, otherwise it was rejected.
+            cycles: The number of detection results processed until the result was taken, if known.
+            time: The time of the scan, defaults to now.
+        """
+        if time is None:
+            time = datetime.datetime.now()
+        resistance, tolerance, error = decode_resistor(result)
+        value = format_value(resistance, tolerance) if error is None else None
+        scores = [float(band.score) for band in result.detected_bands]
+
+        key = get_shift_key(time)
+        with self._lock:
+            shift = self._shifts.get(key)
+            if shift is None:
+                shift = self._shifts[key] = ScanAggregate()
+                while len(self._shifts) > STATS_MAX_SHIFTS:
+                    self._shifts.popitem(last=False)
+            shift.add(scores, value, saved, cycles)
+            self._total.add(scores, value, saved, cycles)
+            self.version += 1
+
+    def to_json(self, max_shifts: int = None) -> dict:
+        """
+        Converts the statistics into a JSON object.
+        Args:
+            max_shifts: The number of most recent shifts to include, or None for all kept shifts.
+        """
+        with self._lock:
+            keys = list(self._shifts)[::-1]
+            if max_shifts is not None:
+                keys = keys[:max_shifts]
+            return {
+                'shift_hours': STATS_SHIFT_HOURS,
+                'score_bins': STATS_SCORE_BINS,
+                'cycle_buckets': list(STATS_CYCLE_BUCKETS),
+                'total': self._total.to_json(),
+                'shifts': [dict(shift=key, **self._shifts[key].to_json()) for key in keys],
+            }
+
+    def save(self):
+        """
+        Writes the statistics to their file atomically, if they changed since the last save.
+        """
+        version = self.version
+        if version == self.saved_version:
+            return
+        obj = self.to_json()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(obj, file)
+        os.replace(tmp_path, self.path)
+        self.saved_version = version
+        self._file_mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def load(self) -> bool:
+        """
+        Replaces the statistics with the ones in their file, if the file changed since it was last
+        written or read.
+        Returns:
+            Whether the statistics were loaded.
+        Raises:
+            ValueError: If the file is malformed.
+        """
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime_ns == self._file_mtime_ns:
+            return False
+        with open(self.path) as file:
+            try:
+                obj = json.load(file)
+                total = ScanAggregate.from_json(obj['total'])
+                shifts = [(x['shift'], ScanAggregate.from_json(x)) for x in obj['shifts'][::-1]]
+            except (KeyError, TypeError, json.JSONDecodeError) as error:
+                raise ValueError(f'"{self.path}" is not a valid statistics file: {error}')
+
+        with self._lock:
+            self._total = total
+            self._shifts = collections.OrderedDict(shifts)
+            self.version += 1
+            self.saved_version = self.version
+            self._file_mtime_ns = mtime_ns
+        return True
+
+class ScanStatisticsThread(threading.Thread):
+    def __init__(self, statistics: 'ScanStatistics', interval: float = STATS_SAVE_INTERVAL):
+        """
+        Initializes the ScanStatisticsThread object, which loads the persisted statistics and then
+        saves them periodically while they change.
+        Args:
+            statistics: The statistics to persist.
+            interval: Seconds between two saves.
+        Notes:
+            The statistics are loaded here rather than in the thread, since loading replaces them
+            and would lose any scan recorded before it finished. Create this object before
+            scanning starts.
+        """
+        super().__init__(daemon=True)
+        self.statistics = statistics
+        self.interval = interval
+
+        self.e_stop = threading.Event()
+
+        try:
+            self.statistics.load()
+        except (OSError, ValueError) as error:
+            logger.warning(f'Loading the scan statistics failed: {error}')
+
+    def run(self):
+        """
+        Overrides the run() method in the threading.Thread superclass.
+        Runs the mainloop of this object.
+        """
+        logger.info('ScanStatisticsThread started.')
+
+        while not self.e_stop.wait(self.interval):
+            self._save()
+        self._save()
+
+        logger.info('ScanStatisticsThread ended.')
+
+    def _save(self):
+        try:
+            self.statistics.save()
+        except OSError as error:
+            logger.warning(f'Saving the scan statistics failed: {error}')
+
+    def signal_stop(self):
+        """
+        Sends stop signal to this thread to terminate it. The statistics are saved before it ends.
+        """
+        self.e_stop.set()
+
+stats = ScanStatistics()
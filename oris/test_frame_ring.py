@@ -0,0 +1,64 @@
+from frame_ring import FrameRing, FrameRegion, FRAME_REGION_BORDER
+
+import numpy as np
+import multiprocessing
+import unittest
+import time
+
+def _write_frames(ring: FrameRing, e_stop):
+    # writes frames filled with their seq, discarding every seventh
+    n = 0
+    while not e_stop.is_set():
+        n += 1
+        image, tag = ring.begin_write()
+        image.fill(n % 256)
+        tag.fill(n % 256)
+        ring.end_write(float(n), publish=n % 7 != 0)
+
+class FrameRingTest(unittest.TestCase):
+    def test_read_and_regions(self):
+        ring = FrameRing([(4, 6, 3), None], slots=3)
+        self.assertIsNone(ring.read([np.zeros((4, 6, 3), np.uint8), None]))
+        for n in range(1, 5):
+            image, _ = ring.begin_write()
+            image[:] = np.arange(n, n + 6, dtype=np.uint8)[None, :, None]
+            self.assertEqual(ring.end_write(float(n)), n > 1)
+
+        out = np.zeros((4, 6, 3), np.uint8)
+        self.assertEqual(ring.read([out, None]), (4, 4.0))
+        self.assertIsNone(ring.read([out, None], since_seq=4))
+        self.assertEqual(out[0, :, 0].tolist(), [4, 5, 6, 7, 8, 9])
+
+        region = ring.read_region(FrameRegion(3, 0, (1, 1, 2, 2), (1, 2)))
+        self.assertEqual(region.shape, (6, 4, 3))
+        self.assertEqual(region[2, :, 0].tolist(), [FRAME_REGION_BORDER, 4, 5, FRAME_REGION_BORDER])
+        self.assertEqual(region[0, 1, 0], FRAME_REGION_BORDER)
+        # the slot of frame 1 holds frame 4 by now
+        self.assertIsNone(ring.read_region(FrameRegion(1, 0, (0, 0, 2, 2))))
+
+    def test_concurrent_reads_are_consistent(self):
+        ring = FrameRing([(240, 320, 3), (16,)], slots=3)
+        e_stop = multiprocessing.Event()
+        writer = multiprocessing.Process(target=_write_frames, args=(ring, e_stop))
+        writer.start()
+        try:
+            outs = [np.zeros((240, 320, 3), np.uint8), np.zeros(16, np.uint8)]
+            last_seq, reads = 0, 0
+            t_end = time.monotonic() + 1
+            while time.monotonic() < t_end:
+                read = ring.read(outs, last_seq)
+                if read is None:
+                    continue
+                seq, timestamp = read
+                self.assertGreater(seq, last_seq)
+                value = int(timestamp) % 256
+                self.assertTrue((outs[0] == value).all() and (outs[1] == value).all())
+                last_seq = seq
+                reads += 1
+            self.assertGreater(reads, 0)
+        finally:
+            e_stop.set()
+            writer.join()
+
+if __name__ == '__main__':
+    unittest.main()
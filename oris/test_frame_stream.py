@@ -0,0 +1,147 @@
+from band_detection import BandDetectionResult
+from frame_stream import (FrameStreamServer, FrameStreamClient, pack_message, pack_raw_frame, recv_message,
+                          MSG_HELLO, MSG_WELCOME, MSG_FRAME_RAW, MSG_RESULT, MSG_DROPPED, MSG_ERROR, PROTOCOL_VERSION)
+
+import numpy as np
+import threading
+import unittest
+import socket
+import queue
+import json
+
+FRAME = pack_raw_frame(np.zeros((4, 4, 3), dtype=np.uint8))
+
+class FakeDetectionProcess(threading.Thread):
+    """
+    Stands in for the BandDetectionProcess, answering each frame with an empty result only after
+    the test released it.
+    """
+    def __init__(self, conn):
+        super().__init__(daemon=True)
+        self.conn = conn
+        self.frames = queue.Queue()             # the frames taken, in order
+        self.release = threading.Semaphore(0)   # one release answers one frame
+        self.e_stop = threading.Event()
+
+    def run(self):
+        while not self.e_stop.is_set():
+            if not self.conn.poll(0.05):
+                continue
+            self.frames.put(self.conn.recv())
+            while not self.release.acquire(timeout=0.05):
+                if self.e_stop.is_set():
+                    return
+            self.conn.send(BandDetectionResult([]))
+
+    def signal_stop(self):
+        self.e_stop.set()
+
+class FrameStreamServerTest(unittest.TestCase):
+    def setUp(self):
+        self.detector = None
+        self.server = FrameStreamServer('127.0.0.1', 0, window=4, queue_depth=2, process_factory=self.make_detector)
+        self.server.start()
+        self.socks = []
+
+    def tearDown(self):
+        for sock in self.socks:
+            sock.close()
+        self.server.signal_stop()
+        self.server.join()
+
+    def make_detector(self, conn) -> FakeDetectionProcess:
+        self.detector = FakeDetectionProcess(conn)
+        return self.detector
+
+    def connect(self, hello) -> socket.socket:
+        sock = socket.create_connection(('127.0.0.1', self.server.port), timeout=5)
+        self.socks.append(sock)
+        payload = hello if isinstance(hello, bytes) else json.dumps(hello).encode()
+        sock.sendall(pack_message(MSG_HELLO, 0, payload))
+        return sock
+
+    def handshake(self, window: int) -> socket.socket:
+        sock = self.connect({'version': PROTOCOL_VERSION, 'window': window})
+        msg_type, _, payload = recv_message(sock)
+        self.assertEqual(msg_type, MSG_WELCOME)
+        return sock
+
+    def send_frame(self, sock: socket.socket, seq: int):
+        sock.sendall(pack_message(MSG_FRAME_RAW, seq, FRAME))
+
+    def assert_error(self, sock: socket.socket, text: str):
+        msg_type, _, payload = recv_message(sock)
+        self.assertEqual(msg_type, MSG_ERROR)
+        self.assertIn(text, json.loads(payload)['error'])
+        # the connection is closed afterwards
+        self.assertIsNone(recv_message(sock))
+
+    def test_handshake(self):
+        # the windows are capped by the one of the server; all four clients stay connected
+        for window, granted in ((8, 4), (-5, 1), (None, 4), (2.5, 2)):
+            sock = self.connect({'version': PROTOCOL_VERSION, 'window': window})
+            msg_type, _, payload = recv_message(sock)
+            self.assertEqual(msg_type, MSG_WELCOME)
+            welcome = json.loads(payload)
+            self.assertEqual((welcome['version'], welcome['window'], welcome['queue_depth']),
+                             (PROTOCOL_VERSION, granted, 2), window)
+        self.assert_error(self.connect({'version': PROTOCOL_VERSION, 'window': 4}), 'Too many clients')
+
+    def test_invalid_hello_is_answered_with_an_error(self):
+        for window in ([1], 'ten', {'n': 1}, float('inf'), float('nan')):
+            self.assert_error(self.connect({'version': PROTOCOL_VERSION, 'window': window}), 'window')
+        self.assert_error(self.connect({'version': PROTOCOL_VERSION + 1}), 'Unsupported protocol')
+        self.assert_error(self.connect(b'\xff not json'), 'Unsupported protocol')
+        self.assert_error(self.connect([PROTOCOL_VERSION]), 'Unsupported protocol')
+        # the server still accepts clients afterwards
+        self.handshake(4)
+
+    def test_oldest_queued_frame_is_dropped(self):
+        sock = self.handshake(4)
+        self.send_frame(sock, 1)
+        self.detector.frames.get(timeout=5)
+
+        # frame 1 is being detected, 2 and 3 fill the queue, and 4 pushes 2 out
+        for seq in (2, 3, 4):
+            self.send_frame(sock, seq)
+        self.assertEqual(recv_message(sock), (MSG_DROPPED, 2, b''))
+
+        # every answer returns the credit of its frame, in the order the frames were taken
+        for seq in (1, 3, 4):
+            self.detector.release.release()
+            msg_type, answered, payload = recv_message(sock)
+            self.assertEqual((msg_type, answered), (MSG_RESULT, seq))
+            self.assertIn('latency_ms', json.loads(payload))
+        self.assertEqual((self.server.n_frames, self.server.n_dropped), (3, 1))
+
+        # with all credits back, a full window can be sent again
+        for seq in range(5, 9):
+            self.send_frame(sock, seq)
+        self.assertEqual(recv_message(sock), (MSG_DROPPED, 6, b''))
+
+    def test_exceeding_the_window_is_an_error(self):
+        sock = self.handshake(2)
+        self.send_frame(sock, 1)
+        self.detector.frames.get(timeout=5)
+        self.send_frame(sock, 2)
+        self.send_frame(sock, 3)
+        self.assert_error(sock, 'exceeded its window')
+
+    def test_reference_client(self):
+        answers = []
+        client = FrameStreamClient('127.0.0.1', self.server.port, window=2,
+                                   on_result=lambda seq, result: answers.append((seq, result is None)))
+        try:
+            self.assertEqual(client.window, 2)
+            for _ in range(10):
+                self.detector.release.release()
+            for _ in range(10):
+                self.assertIsNotNone(client.send_image(np.zeros((4, 4, 3), dtype=np.uint8), timeout=5))
+            self.assertTrue(client.wait_idle(timeout=5))
+        finally:
+            client.close()
+        self.assertEqual(sorted(seq for seq, _ in answers), list(range(1, 11)))
+        self.assertEqual((client.n_results, client.n_dropped), (10, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from http_utils import ChunkedWriter, is_not_modified, make_etag, format_http_date, parse_range, safe_join
+
+import unittest
+import tempfile
+import gzip
+import io
+import os
+
+def _parse_chunks(data: bytes):
+    # returns the chunks of a chunked body, and the bytes following its terminating chunk
+    chunks = []
+    while True:
+        size_line, _, data = data.partition(b'\r\n')
+        size = int(size_line, 16)
+        chunk, crlf, data = data[:size], data[size:size + 2], data[size + 2:]
+        if crlf != b'\r\n':
+            raise ValueError('A chunk is not terminated by CRLF')
+        if not size:
+            return chunks, data
+        chunks.append(chunk)
+
+class ParseRangeTest(unittest.TestCase):
+    def test_ranges(self):
+        self.assertIsNone(parse_range(None, 1000))
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-2000', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_range('bytes=-500', 1000), (500, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_unsatisfiable_ranges(self):
+        for value, size in (('bytes=1000-', 1000), ('bytes=1000-1100', 1000), ('bytes=-0', 1000), ('bytes=-500', 0)):
+            with self.assertRaises(ValueError, msg=value):
+                parse_range(value, size)
+
+    def test_unsupported_ranges_send_the_whole_resource(self):
+        for value in ('bytes=0-99,200-299', 'bytes=-1,-2', 'items=0-9', 'bytes=99-0', 'bytes=x-y', 'bytes=5'):
+            self.assertIsNone(parse_range(value, 1000), value)
+
+class ConditionalRequestTest(unittest.TestCase):
+    def test_if_none_match(self):
+        etag = make_etag('record', 1)
+        self.assertTrue(is_not_modified({'if-none-match': etag}, etag, None))
+        self.assertTrue(is_not_modified({'if-none-match': f'"other", W/{etag} , "third"'}, etag, None))
+        self.assertFalse(is_not_modified({'if-none-match': '"other", "third"'}, etag, None))
+        self.assertTrue(is_not_modified({'if-none-match': '*'}, etag, None))
+        self.assertFalse(is_not_modified({'if-none-match': '*'}, None, None))
+        # weak comparison, as for GET
+        self.assertTrue(is_not_modified({'if-none-match': etag}, 'W/' + etag, None))
+
+    def test_if_none_match_takes_precedence(self):
+        headers = {'if-none-match': '"other"', 'if-modified-since': format_http_date(2000)}
+        self.assertFalse(is_not_modified(headers, '"current"', 1000))
+
+    def test_if_modified_since(self):
+        self.assertTrue(is_not_modified({'if-modified-since': format_http_date(1000)}, None, 1000.5))
+        self.assertFalse(is_not_modified({'if-modified-since': format_http_date(1000)}, None, 1001))
+        self.assertFalse(is_not_modified({'if-modified-since': 'yesterday'}, None, 1000))
+
+class SafeJoinTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_paths_within_the_root(self):
+        self.assertEqual(safe_join(self.root, 'a.rec'), os.path.join(self.root, 'a.rec'))
+        self.assertEqual(safe_join(self.root, 'sub/../a.rec'), os.path.join(self.root, 'a.rec'))
+        # a leading slash does not make a component absolute
+        self.assertEqual(safe_join(self.root, '/a.rec'), os.path.join(self.root, 'a.rec'))
+        # percent-encoding is decoded by the caller, so it is only a strange filename here
+        self.assertEqual(safe_join(self.root, '%2e%2e%2fa.rec'), os.path.join(self.root, '%2e%2e%2fa.rec'))
+
+    def test_traversal_is_rejected(self):
+        for part in ('..', '../a.rec', 'sub/../../a.rec', '.', '', os.path.join('..', os.path.basename(self.root) + 'x', 'a'),
+                     'a\0.rec'):
+            with self.assertRaises(ValueError, msg=part):
+                safe_join(self.root, part)
+
+    def test_symlinks_out_of_the_root_are_rejected(self):
+        os.symlink('/', os.path.join(self.root, 'link'))
+        with self.assertRaises(ValueError):
+            safe_join(self.root, 'link/etc/passwd')
+
+class ChunkedWriterTest(unittest.TestCase):
+    def test_chunked_framing(self):
+        wfile = io.BytesIO()
+        writer = ChunkedWriter(wfile, chunk_size=10)
+        writer.write('hello ')
+        self.assertEqual(wfile.getvalue(), b'')
+        writer.write(b'chunked world')
+        writer.write('!')
+        writer.close()
+
+        chunks, rest = _parse_chunks(wfile.getvalue())
+        self.assertEqual(chunks, [b'hello chunked world', b'!'])
+        self.assertEqual(rest, b'')
+        self.assertTrue(wfile.getvalue().endswith(b'\r\n0\r\n\r\n'))
+
+    def test_empty_body(self):
+        wfile = io.BytesIO()
+        ChunkedWriter(wfile).close()
+        self.assertEqual(wfile.getvalue(), b'0\r\n\r\n')
+
+    def test_compressed_body(self):
+        wfile = io.BytesIO()
+        writer = ChunkedWriter(wfile, chunk_size=64, compress=True)
+        data = ''.join(f'{os.urandom(16).hex()}\n' for i in range(4000))
+        for line in data.splitlines(keepends=True):
+            writer.write(line)
+        writer.close()
+
+        chunks, rest = _parse_chunks(wfile.getvalue())
+        self.assertEqual(rest, b'')
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(gzip.decompress(b''.join(chunks)).decode(), data)
+
+if __name__ == '__main__':
+    unittest.main()
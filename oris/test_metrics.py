@@ -0,0 +1,158 @@
+from metrics import MetricsRegistry, render_gauge
+
+import multiprocessing
+import unittest
+import math
+import re
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+_LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)",?')
+
+def _unescape(text: str) -> str:
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), text)
+
+def parse_exposition(text: str):
+    """
+    Parses the Prometheus text exposition format into the help and type of each family and a dict of
+    samples, keyed by the sample name and its sorted (label, value) pairs.
+    """
+    helps, types, samples = {}, {}, {}
+    assert text.endswith('\n')
+    for line in text[:-1].split('\n'):
+        if line.startswith('# HELP '):
+            name, _, help = line[7:].partition(' ')
+            helps[name] = _unescape(help)
+        elif line.startswith('# TYPE '):
+            name, _, kind = line[7:].partition(' ')
+            types[name] = kind
+        else:
+            match = _SAMPLE_RE.match(line)
+            assert match, line
+            name, labels, value = match.groups()
+            pairs = []
+            if labels:
+                assert ''.join(m.group(0) for m in _LABEL_RE.finditer(labels)) == labels, line
+                pairs = [(k, _unescape(v)) for k, v in _LABEL_RE.findall(labels)]
+            key = (name, tuple(sorted(pairs)))
+            assert key not in samples, line
+            samples[key] = float(value)
+    return helps, types, samples
+
+def _observe_in_child(histogram, counters, values):
+    for value in values:
+        histogram.observe(value)
+    counters['b'].inc(len(values))
+
+class RenderTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.counter = self.registry.counter('test_events_total', 'Events.\nSecond line with a \\.')
+        self.gauge = self.registry.gauge('test_level', 'Level.')
+        self.histogram = self.registry.histogram('test_seconds', 'Durations.', (0.1, 0.5, 1))
+        self.routes = self.registry.histogram('test_route_seconds', 'Durations by route.', (1, 2), 'route',
+                                              ('index', 'say "hi"\\\n'))
+        self.registry.allocate()
+
+    def render(self):
+        return parse_exposition(self.registry.render())
+
+    def test_families(self):
+        self.counter.inc(3)
+        self.gauge.set(-2.5)
+        helps, types, samples = self.render()
+        self.assertEqual(types, {'test_events_total': 'counter', 'test_level': 'gauge',
+                                 'test_seconds': 'histogram', 'test_route_seconds': 'histogram'})
+        self.assertEqual(helps['test_events_total'], 'Events.\nSecond line with a \\.')
+        self.assertEqual(samples[('test_events_total', ())], 3)
+        self.assertEqual(samples[('test_level', ())], -2.5)
+
+        for value in (math.nan, math.inf, -math.inf):
+            self.gauge.set(value)
+            sample = self.render()[2][('test_level', ())]
+            self.assertTrue(math.isnan(sample) if math.isnan(value) else sample == value)
+
+    def test_histogram_buckets_are_cumulative(self):
+        # the bounds are inclusive
+        for value in (0.05, 0.1, 0.3, 0.5, 0.5, 1, 7):
+            self.histogram.observe(value)
+        _, _, samples = self.render()
+        buckets = {dict(labels)['le']: value for (name, labels), value in samples.items() if name == 'test_seconds_bucket'}
+        self.assertEqual(buckets, {'0.1': 2, '0.5': 5, '1': 6, '+Inf': 7})
+        self.assertAlmostEqual(samples[('test_seconds_sum', ())], 9.45)
+        self.assertEqual(samples[('test_seconds_count', ())], 7)
+
+        empty = [value for (name, _), value in samples.items() if name.startswith('test_route_seconds')]
+        self.assertEqual(empty, [0] * 10)
+
+    def test_labels(self):
+        self.routes['index'].observe(1.5)
+        self.routes['say "hi"\\\n'].observe(0.5)
+        self.routes['say "hi"\\\n'].observe(3)
+        _, _, samples = self.render()
+        self.assertEqual(samples[('test_route_seconds_bucket', (('le', '2'), ('route', 'index')))], 1)
+        self.assertEqual(samples[('test_route_seconds_count', (('route', 'index'),))], 1)
+        self.assertEqual(samples[('test_route_seconds_bucket', (('le', '1'), ('route', 'say "hi"\\\n')))], 1)
+        self.assertEqual(samples[('test_route_seconds_bucket', (('le', '+Inf'), ('route', 'say "hi"\\\n')))], 2)
+        self.assertEqual(samples[('test_route_seconds_sum', (('route', 'say "hi"\\\n'),))], 3.5)
+
+    def test_render_gauge(self):
+        helps, types, samples = parse_exposition(render_gauge('test_records', 'Records\non disk.', 12))
+        self.assertEqual((helps, types, samples), ({'test_records': 'Records\non disk.'}, {'test_records': 'gauge'},
+                                                   {('test_records', ()): 12}))
+
+    def test_declaring_after_allocation_fails(self):
+        with self.assertRaises(RuntimeError):
+            self.registry.counter('test_late_total', 'Too late.')
+
+class QuantileTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.histogram = self.registry.histogram('test_seconds', 'Durations.', (1, 2, 4))
+        self.registry.allocate()
+
+    def test_no_observations(self):
+        self.assertTrue(math.isnan(self.histogram.quantile(0.5)))
+
+    def test_bucket_edges(self):
+        # two observations in each of the buckets (1, 2] and (2, 4]
+        for value in (2, 2, 4, 4):
+            self.histogram.observe(value)
+        self.assertEqual(self.histogram.get_counts(), [0, 2, 2, 0])
+        self.assertEqual(self.histogram.quantile(0), 2)
+        self.assertEqual(self.histogram.quantile(0.25), 2)
+        # the rank falls exactly on the last observation of the bucket (1, 2]
+        self.assertEqual(self.histogram.quantile(0.5), 2)
+        self.assertEqual(self.histogram.quantile(0.51), 4)
+        self.assertEqual(self.histogram.quantile(1), 4)
+
+        self.histogram.observe(4.001)
+        self.assertEqual(self.histogram.quantile(0.8), 4)
+        self.assertEqual(self.histogram.quantile(0.81), math.inf)
+        self.assertEqual(self.histogram.quantile(1), math.inf)
+
+class SharedMemoryTest(unittest.TestCase):
+    def test_writes_from_a_forked_process(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('test_seconds', 'Durations.', (0.1, 1))
+        counters = registry.counter('test_events_total', 'Events.', 'kind', ('a', 'b'))
+        registry.allocate()
+        histogram.observe(0.05)
+        counters['a'].inc()
+
+        # the child process writes into the block allocated before it was forked
+        process = multiprocessing.get_context('fork').Process(target=_observe_in_child,
+                                                              args=(histogram, counters, [0.5, 0.5, 2]))
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+
+        cumulative, total, count = histogram.get()
+        self.assertEqual((cumulative, count), ([1, 3, 4], 4))
+        self.assertAlmostEqual(total, 3.05)
+        self.assertEqual((counters['a'].get(), counters['b'].get()), (1, 3))
+        _, _, samples = parse_exposition(registry.render())
+        self.assertEqual(samples[('test_seconds_bucket', (('le', '1'),))], 3)
+        self.assertEqual(samples[('test_events_total', (('kind', 'b'),))], 3)
+
+if __name__ == '__main__':
+    unittest.main()
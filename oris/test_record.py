@@ -0,0 +1,113 @@
+from band_detection import BandDetectionResult
+from detected_object import DetectedBand
+import record
+import retention
+
+import numpy as np
+import unittest
+import tempfile
+import datetime
+import pickle
+import os
+
+class LegacyRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.saved_path = record.RECORD_SAVE_PATH
+        record.RECORD_SAVE_PATH = self.tempdir.name + os.sep
+
+        self.image = np.zeros((30, 40, 3), dtype=np.uint8)
+        self.image[:, :20] = (200, 100, 50)
+        bands = [DetectedBand(0, 'red_band', 0.9, [5, 2, 9, 28]), DetectedBand(1, 'black_band', 0.8, [12, 2, 16, 28])]
+        self.time = datetime.datetime(2022, 3, 14, 10, 30, 0)
+        self.record = record.DetectionRecord(self.image, BandDetectionResult(bands), self.time)
+
+        self.filename = self.time.strftime(record.RECORD_TIME_FORMAT) + record.LEGACY_FILE_EXT
+        with open(os.path.join(record.RECORD_SAVE_PATH, self.filename), 'wb') as f:
+            pickle.dump(self.record, f)
+
+    def tearDown(self):
+        record.RECORD_SAVE_PATH = self.saved_path
+        self.tempdir.cleanup()
+
+    def test_header_loads_image(self):
+        header = record.read_header(self.filename)
+        self.assertEqual(header.time, self.time)
+        self.assertEqual(header.get_labels(), ['red_band', 'black_band'])
+        for mmap in (True, False):
+            np.testing.assert_array_equal(header.load_image(mmap), self.image)
+
+    def test_migration_round_trip(self):
+        new_filename = record.migrate_legacy_record(self.filename)
+        self.assertFalse(os.path.exists(os.path.join(record.RECORD_SAVE_PATH, self.filename)))
+
+        header = record.read_header(new_filename)
+        self.assertEqual(header.time, self.time)
+        self.assertEqual(header.get_labels(), ['red_band', 'black_band'])
+        np.testing.assert_array_equal(header.load_image(), self.image)
+        np.testing.assert_array_equal(record.read_from_file(new_filename).image, self.image)
+
+    def test_migration_keeps_age_and_skips_listeners(self):
+        filepath = os.path.join(record.RECORD_SAVE_PATH, self.filename)
+        mtime = self.time.timestamp()
+        os.utime(filepath, (mtime, mtime))
+        saved = []
+        record.add_save_listener(saved.append)
+        try:
+            new_filename = record.migrate_legacy_record(self.filename)
+        finally:
+            record.remove_save_listener(saved.append)
+        self.assertEqual(saved, [])
+        self.assertEqual(os.stat(os.path.join(record.RECORD_SAVE_PATH, new_filename)).st_mtime, mtime)
+
+    def test_compaction_sets_corrupt_records_aside(self):
+        corrupt_filename = '2022-03-14_10-31-00' + record.LEGACY_FILE_EXT
+        with open(os.path.join(record.RECORD_SAVE_PATH, corrupt_filename), 'wb') as f:
+            f.write(pickle.dumps(self.record)[:100])
+
+        retention.compact_records(record.RECORD_SAVE_PATH)
+        self.assertEqual(sorted(os.listdir(record.RECORD_SAVE_PATH)), [
+            self.time.strftime(record.RECORD_TIME_FORMAT) + record.RECORD_FILE_EXT,
+            corrupt_filename + retention._CORRUPT_SUFFIX,
+        ])
+
+class SaveTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.saved_path = record.RECORD_SAVE_PATH
+        record.RECORD_SAVE_PATH = self.tempdir.name + os.sep
+        self.time = datetime.datetime(2022, 3, 14, 10, 30, 0, 250000)
+
+    def tearDown(self):
+        record.RECORD_SAVE_PATH = self.saved_path
+        self.tempdir.cleanup()
+
+    def make_record(self, label: str, time: datetime.datetime = None) -> record.DetectionRecord:
+        result = BandDetectionResult([DetectedBand(0, label, 0.9, [1, 1, 4, 15])])
+        return record.DetectionRecord(np.zeros((16, 20, 3), dtype=np.uint8), result, time or self.time)
+
+    def test_scans_of_the_same_second_are_kept(self):
+        saved = []
+        record.add_save_listener(saved.append)
+        try:
+            for i, label in enumerate(('red_band', 'green_band', 'blue_band')):
+                self.make_record(label, self.time + datetime.timedelta(microseconds=i)).save()
+        finally:
+            record.remove_save_listener(saved.append)
+
+        name = self.time.strftime(record.RECORD_TIME_FORMAT)
+        self.assertEqual([x.record_id for x in saved], [name, name + '_1', name + '_2'])
+        self.assertEqual(sorted(os.listdir(record.RECORD_SAVE_PATH)), sorted(x.record_id + record.RECORD_FILE_EXT for x in saved))
+        for header, label in zip(saved, ('red_band', 'green_band', 'blue_band')):
+            self.assertEqual(record.read_header(header.filepath).get_labels(), [label])
+            self.assertEqual(record.read_header(header.filepath).record_id, header.record_id)
+
+    def test_explicit_filename_is_replaced(self):
+        filename = 'record' + record.RECORD_FILE_EXT
+        self.make_record('red_band').save(filename)
+        self.make_record('blue_band').save(filename)
+        self.assertEqual(os.listdir(record.RECORD_SAVE_PATH), [filename])
+        self.assertEqual(record.read_header(filename).get_labels(), ['blue_band'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from record import RecordBand, RecordHeader
+from record_index import RecordIndex
+from record_export import get_export_records, get_image_name, iter_export_csv, iter_export_zip
+from load_test import synthesize_records
+from web_api import header_to_json
+
+import numpy as np
+import unittest
+import tempfile
+import datetime
+import zipfile
+import json
+import csv
+import io
+import os
+import cv2
+
+class UnseekableSink(io.RawIOBase):
+    """
+    A write-only stream which can neither seek nor tell, like a socket or a pipe.
+    """
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.data += data
+        return len(data)
+
+class ExportZipTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        synthesize_records(self.tempdir.name, 12, size=(32, 24), days=1)
+        index = RecordIndex(self.tempdir.name)
+        index.refresh()
+        self.records = get_export_records(index)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def export(self, records) -> bytes:
+        sink = UnseekableSink()
+        pieces = 0
+        for part in iter_export_zip(records, flush_size=1024):
+            sink.write(part)
+            pieces += 1
+        # the archive is handed out piece by piece instead of at the end
+        self.assertGreater(pieces, 2)
+        return bytes(sink.data)
+
+    def test_archive_is_valid(self):
+        with zipfile.ZipFile(io.BytesIO(self.export(self.records))) as archive:
+            self.assertIsNone(archive.testzip())
+            names = ['manifest.csv', 'manifest.json'] + [get_image_name(x) for x in self.records]
+            self.assertEqual(archive.namelist(), names)
+            # every entry is followed by a data descriptor, as the output cannot be seeked back to
+            for info in archive.infolist():
+                self.assertTrue(info.flag_bits & 0x08, info.filename)
+
+            for header in self.records:
+                data = np.frombuffer(archive.read(get_image_name(header)), dtype=np.uint8)
+                image = cv2.cvtColor(cv2.imdecode(data, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+                self.assertTrue(np.array_equal(image, header.load_image()), header.record_id)
+
+    def test_manifests_match_the_records(self):
+        with zipfile.ZipFile(io.BytesIO(self.export(self.records))) as archive:
+            rows = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode())))
+            objs = json.loads(archive.read('manifest.json'))
+
+        self.assertEqual([r['id'] for r in rows], [x.record_id for x in self.records])
+        self.assertEqual([r['image'] for r in rows], [get_image_name(x) for x in self.records])
+        for row, header in zip(rows, self.records):
+            self.assertEqual(row['time'], header.time.isoformat())
+            self.assertEqual(row['bands'].split(), header.get_labels())
+
+        expected = [dict(header_to_json(x), image=get_image_name(x)) for x in self.records]
+        self.assertEqual(objs, expected)
+
+    def test_unreadable_records_are_skipped(self):
+        os.remove(self.records[3].filepath)
+        with self.assertLogs('record_export', 'WARNING'):
+            data = self.export(self.records)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertNotIn(get_image_name(self.records[3]), archive.namelist())
+            self.assertEqual(len(archive.namelist()), len(self.records) + 1)
+            # the manifests still describe the snapshot
+            self.assertEqual(len(json.loads(archive.read('manifest.json'))), len(self.records))
+
+    def test_empty_export(self):
+        with zipfile.ZipFile(io.BytesIO(b''.join(iter_export_zip([])))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read('manifest.csv').decode().splitlines(),
+                             ['id,time,resistance,tolerance,error,bands,scores,image'])
+            self.assertEqual(json.loads(archive.read('manifest.json')), [])
+
+class ExportCsvTest(unittest.TestCase):
+    def test_fields_are_quoted(self):
+        time = datetime.datetime(2022, 3, 14, 10, 30)
+        bands = [RecordBand(0, 'red_band', 0.91234, (0, 0, 1, 1)), RecordBand(1, 'gold_band', 0.5, (2, 0, 3, 1))]
+        headers = [
+            RecordHeader('plain', time, bands, 2.2, 5.0, None, (1, 1, 3), 'uint8', 0),
+            RecordHeader('with, comma', time, [], None, None, 'the "gold" band is\nmissing, try again',
+                         (1, 1, 3), 'uint8', 0),
+        ]
+        text = ''.join(iter_export_csv(headers))
+        rows = list(csv.reader(io.StringIO(text, newline='')))
+
+        self.assertEqual(rows, [
+            ['id', 'time', 'resistance', 'tolerance', 'error', 'bands', 'scores', 'image'],
+            ['plain', '2022-03-14T10:30:00', '2.2', '5.0', '', 'red_band gold_band', '0.912 0.500', 'images/plain.png'],
+            ['with, comma', '2022-03-14T10:30:00', '', '', 'the "gold" band is\nmissing, try again', '', '',
+             'images/with, comma.png'],
+        ])
+        self.assertIn('"the ""gold"" band is\nmissing, try again"', text)
+        self.assertIn('"with, comma"', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from band_detection import BandDetectionResult
+from detected_object import DetectedBand
+from record_index import RecordIndex, parse_time_prefix, make_cursor
+import record
+
+import numpy as np
+import unittest
+import tempfile
+import datetime
+import os
+
+T0 = datetime.datetime(2022, 3, 14, 10, 0, 0)
+
+class ParseTimePrefixTest(unittest.TestCase):
+    def test_partial_times(self):
+        for value, start, end in (
+            ('2022', datetime.datetime(2022, 1, 1), datetime.datetime(2023, 1, 1)),
+            ('2022-12', datetime.datetime(2022, 12, 1), datetime.datetime(2023, 1, 1)),
+            ('2022-03', datetime.datetime(2022, 3, 1), datetime.datetime(2022, 4, 1)),
+            ('2022-02-28', datetime.datetime(2022, 2, 28), datetime.datetime(2022, 3, 1)),
+            ('2022-03-14_10', datetime.datetime(2022, 3, 14, 10), datetime.datetime(2022, 3, 14, 11)),
+            ('2022-03-14T10:30', datetime.datetime(2022, 3, 14, 10, 30), datetime.datetime(2022, 3, 14, 10, 31)),
+            (' 2022-03-14 23:59:59 ', datetime.datetime(2022, 3, 14, 23, 59, 59), datetime.datetime(2022, 3, 15)),
+        ):
+            self.assertEqual(parse_time_prefix(value), (start, end), value)
+
+    def test_invalid_times(self):
+        for value in ('', '22', '2022-3', '2022-13', '2022-02-30', '2022-03-14_25', 'yesterday'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_time_prefix(value)
+
+class RecordIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.saved_path = record.RECORD_SAVE_PATH
+        record.RECORD_SAVE_PATH = self.tempdir.name + os.sep
+        self.index = RecordIndex(self.tempdir.name)
+
+    def tearDown(self):
+        record.RECORD_SAVE_PATH = self.saved_path
+        self.tempdir.cleanup()
+
+    def save(self, name: str, minutes: int, label: str = 'red_band') -> str:
+        result = BandDetectionResult([DetectedBand(0, label, 0.9, [1, 1, 4, 15])])
+        time = T0 + datetime.timedelta(minutes=minutes)
+        record.DetectionRecord(np.zeros((16, 20, 3), dtype=np.uint8), result, time).save(name + record.RECORD_FILE_EXT)
+        return name
+
+    def query_ids(self, **params):
+        headers, _ = self.index.query(**params)
+        return [x.record_id for x in headers]
+
+    def test_incremental_refresh(self):
+        for i in range(3):
+            self.save(f'r{i}', i)
+        self.assertEqual(self.index.load(), 3)
+        self.assertTrue(self.index.ready.is_set())
+        self.assertEqual(self.index.poll(), ([], []))
+
+        # saved, changed and deleted at once; the files have the same size and may share their timestamps
+        self.save('r3', 3)
+        self.save('r1', 1, label='blue_band')
+        os.remove(os.path.join(self.tempdir.name, 'r0' + record.RECORD_FILE_EXT))
+        added, removed = self.index.poll()
+        self.assertEqual((sorted(added), removed), (['r1', 'r3'], ['r0']))
+        self.assertEqual(self.query_ids(), ['r3', 'r2', 'r1'])
+        self.assertEqual(self.index.get('r1').get_labels(), ['blue_band'])
+
+        # a change within the timestamp granularity of the last refresh is still seen, although
+        # neither the timestamps of the directory and the file nor the size of the file change
+        filepath = os.path.join(self.tempdir.name, 'r1' + record.RECORD_FILE_EXT)
+        dir_mtime_ns, file_mtime_ns = os.stat(self.tempdir.name).st_mtime_ns, os.stat(filepath).st_mtime_ns
+        size = os.path.getsize(filepath)
+        self.save('r1', 1, label='grey_band')
+        os.utime(filepath, ns=(file_mtime_ns, file_mtime_ns))
+        os.utime(self.tempdir.name, ns=(dir_mtime_ns, dir_mtime_ns))
+        self.assertEqual(os.path.getsize(filepath), size)
+        self.assertEqual(self.index.poll(), (['r1'], []))
+        self.assertEqual(self.index.get('r1').get_labels(), ['grey_band'])
+        # files read again unchanged are not reported
+        self.assertEqual(self.index.refresh(), ([], []))
+
+    def test_save_listener_path(self):
+        self.index.load()
+        header = record.read_header(self.save('s', 0) + record.RECORD_FILE_EXT)
+        version = self.index.version
+        self.index.add(header)
+        self.assertGreater(self.index.version, version)
+        self.assertEqual(self.index.refresh(), ([], []))
+        self.assertEqual(self.query_ids(), ['s'])
+
+    def test_newest_first_is_stable_for_equal_times(self):
+        for name in ('b', 'd', 'a', 'c', 'e'):
+            self.save(name, 0)
+        self.save('z', -1)
+        self.index.load()
+        self.assertEqual(self.query_ids(), ['e', 'd', 'c', 'b', 'a', 'z'])
+        self.assertEqual(self.query_ids(newest_first=False), ['z', 'a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(self.query_ids(), self.query_ids())
+
+        for newest_first in (True, False):
+            ids, cursor = [], None
+            while True:
+                headers, cursor = self.index.query(cursor=cursor, limit=2, newest_first=newest_first)
+                ids += [x.record_id for x in headers]
+                if cursor is None:
+                    break
+                self.assertEqual(cursor, make_cursor(headers[-1]))
+            self.assertEqual(ids, self.query_ids(newest_first=newest_first))
+
+        # filtered queries take the same order
+        headers, _ = self.index.query(band_count=1)
+        self.assertEqual([x.record_id for x in headers], self.query_ids())
+
+    def test_time_range(self):
+        for i in range(5):
+            self.save(f'r{i}', i * 30)
+        self.index.load()
+        start, end = parse_time_prefix('2022-03-14_10')
+        self.assertEqual(self.query_ids(start=start, end=end), ['r1', 'r0'])
+        self.assertEqual(self.query_ids(start=T0 + datetime.timedelta(minutes=60)), ['r4', 'r3', 'r2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+from record import RecordBand, RecordHeader
+from record_search import BandFilter, SearchIndex, parse_band_filter, parse_duration, parse_resistance
+
+import unittest
+import datetime
+
+T0 = datetime.datetime(2022, 3, 14, 10, 0, 0)
+
+def make_header(record_id: str, minutes: int, resistance: float = None, tolerance: float = None, bands=()) -> RecordHeader:
+    """
+    Makes the header of a record taken minutes after T0, with bands given as (label, score).
+    """
+    bands = [RecordBand(i, label, score, (0, 0, 1, 1)) for i, (label, score) in enumerate(bands)]
+    return RecordHeader(record_id, T0 + datetime.timedelta(minutes=minutes), bands, resistance, tolerance,
+                        None, (1, 1, 3), 'uint8', 0)
+
+class ParserTest(unittest.TestCase):
+    def test_parse_resistance(self):
+        for value, expected in (('470', 470), ('4k7', 4700), ('4.7k', 4700), ('1M', 1e6), ('1m', 1e6),
+                                ('4R7', 4.7), ('k47', 470), ('100 ohms', 100), ('2.2 kΩ', 2200)):
+            self.assertAlmostEqual(parse_resistance(value), expected, msg=value)
+        for value in ('4.7k7', '4k7k', '47x', 'k', '.', '', '4 7'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_resistance(value)
+
+    def test_parse_band_filter(self):
+        self.assertEqual(parse_band_filter('violet'), BandFilter('violet_band', None, None))
+        self.assertEqual(parse_band_filter('violet<0.6'), BandFilter('violet_band', None, 0.6))
+        self.assertEqual(parse_band_filter(' Red_band > .9 '), BandFilter('red_band', 0.9, None))
+        for value in ('foo', 'violet<', 'violet=0.6', 'violet<0.6<0.7'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_band_filter(value)
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration('30m'), datetime.timedelta(minutes=30))
+        self.assertEqual(parse_duration('1.5d'), datetime.timedelta(hours=36))
+        for value in ('7', 'd', '-1d', '1e9d', 'nand'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_duration(value)
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        self.headers = [
+            make_header('a', 0, 4700, 5, [('yellow_band', 0.9), ('violet_band', 0.6), ('red_band', 0.8), ('gold_band', 0.9)]),
+            make_header('b', 1, 4700, 5, [('yellow_band', 0.9), ('violet_band', 0.59), ('red_band', 0.8), ('gold_band', 0.9)]),
+            make_header('c', 2, 4700, 10, [('yellow_band', 0.9), ('violet_band', 0.61), ('red_band', 0.8), ('silver_band', 0.7)]),
+            make_header('d', 3, 1000, 5, [('brown_band', 0.9), ('black_band', 0.9), ('red_band', 0.9), ('gold_band', 0.9)]),
+            make_header('e', 4, 470, 1, [('yellow_band', 0.9), ('violet_band', 0.9), ('black_band', 0.9),
+                                         ('black_band', 0.9), ('brown_band', 0.9)]),
+            make_header('f', 5),
+        ]
+        self.index.add_many(self.headers)
+
+    def search_ids(self, **filters):
+        headers, _ = self.index.search(**filters)
+        return [x.record_id for x in headers]
+
+    def test_band_score_bounds_are_exclusive(self):
+        self.assertEqual(self.search_ids(bands=[parse_band_filter('violet<0.6')]), ['b'])
+        self.assertEqual(self.search_ids(bands=[parse_band_filter('violet>0.6')]), ['e', 'c'])
+        self.assertEqual(self.search_ids(bands=[parse_band_filter('violet')]), ['e', 'c', 'b', 'a'])
+
+    def test_filters_intersect(self):
+        self.assertEqual(self.search_ids(resistance=4700), ['c', 'b', 'a'])
+        self.assertEqual(self.search_ids(resistance=4700, tolerance=5), ['b', 'a'])
+        self.assertEqual(self.search_ids(tolerance=5, band_count=4), ['d', 'b', 'a'])
+        self.assertEqual(self.search_ids(tolerance=5, band_count=4, start=T0 + datetime.timedelta(minutes=1),
+                                         end=T0 + datetime.timedelta(minutes=3)), ['b'])
+        self.assertEqual(self.search_ids(min_resistance=470, max_resistance=1000), ['e', 'd'])
+        self.assertEqual(self.search_ids(band_count=5, bands=[parse_band_filter('black')]), ['e'])
+        self.assertEqual(self.search_ids(band_count=0), ['f'])
+        self.assertEqual(self.search_ids(tolerance=20), [])
+
+    def test_cursor_and_limit_paging(self):
+        ids, cursor = [], None
+        while True:
+            headers, has_more = self.index.search(cursor=cursor, limit=2)
+            ids += [x.record_id for x in headers]
+            if not has_more:
+                break
+            cursor = (headers[-1].time, headers[-1].record_id)
+        self.assertEqual(ids, ['f', 'e', 'd', 'c', 'b', 'a'])
+
+        headers, has_more = self.index.search(tolerance=5, limit=3)
+        self.assertEqual(([x.record_id for x in headers], has_more), (['d', 'b', 'a'], False))
+
+    def test_equal_times_are_ordered_by_id(self):
+        self.index.add_many([make_header('g2', 10, 100), make_header('g1', 10, 100), make_header('g3', 10, 100)])
+        self.assertEqual(self.search_ids(resistance=100), ['g3', 'g2', 'g1'])
+        headers, _ = self.index.search(resistance=100, limit=1)
+        headers, _ = self.index.search(resistance=100, cursor=(headers[0].time, headers[0].record_id))
+        self.assertEqual([x.record_id for x in headers], ['g2', 'g1'])
+
+    def test_replacing_and_removing_records(self):
+        self.index.add(make_header('a', 0, 220, 2, [('red_band', 0.9)]))
+        self.assertEqual(len(self.index), 6)
+        self.assertEqual(self.search_ids(resistance=4700), ['c', 'b'])
+        self.assertEqual(self.search_ids(resistance=220, tolerance=2, band_count=1), ['a'])
+        self.index.remove('a')
+        self.index.remove('a')
+        self.assertEqual(self.search_ids(resistance=220), [])
+        self.assertEqual(len(self.index), 5)
+
+    def test_duplicate_ids_in_one_batch(self):
+        # a refresh may see a record twice, if it was saved again while the directory was read
+        stale, fresh = make_header('h', 20, 330, 5, [('orange_band', 0.9)]), make_header('h', 20, 680, 10, [('blue_band', 0.9)])
+        self.index.add_many([stale, fresh])
+        self.assertEqual(len(self.index), 7)
+        self.assertEqual(self.search_ids(resistance=330), [])
+        self.assertEqual(self.search_ids(bands=[parse_band_filter('orange')]), [])
+        self.assertEqual(self.index.search(resistance=680)[0], [fresh])
+        self.assertEqual(self.search_ids(start=T0 + datetime.timedelta(minutes=20)), ['h'])
+
+        self.index.remove('h')
+        self.assertEqual(self.search_ids(start=T0 + datetime.timedelta(minutes=20)), [])
+        self.assertEqual(len(self.index), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+from band_detection import BandDetectionResult
+from detected_object import DetectedBand
+from render_cache import RenderCache, RenderBusyError
+import record
+
+from unittest import mock
+import numpy as np
+import unittest
+import tempfile
+import datetime
+import threading
+import os
+
+class RenderCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.saved_path = record.RECORD_SAVE_PATH
+        record.RECORD_SAVE_PATH = os.path.join(self.tempdir.name, 'records')
+        self.cache_path = os.path.join(self.tempdir.name, 'cache')
+
+    def tearDown(self):
+        record.RECORD_SAVE_PATH = self.saved_path
+        self.tempdir.cleanup()
+
+    def save(self, name: str, label: str = 'red_band') -> record.RecordHeader:
+        # the records are of the same size for labels of the same length
+        image = np.full((40, 60, 3), 200, dtype=np.uint8)
+        result = BandDetectionResult([DetectedBand(0, label, 0.9, [10, 5, 20, 35])])
+        filename = name + record.RECORD_FILE_EXT
+        record.DetectionRecord(image, result, datetime.datetime(2022, 3, 14)).save(filename)
+        return record.read_header(filename)
+
+    def cached_ids(self):
+        return sorted(x.split('.')[0] for x in os.listdir(self.cache_path))
+
+    def test_resaved_record_gets_a_new_thumbnail(self):
+        cache = RenderCache(self.cache_path)
+        header = self.save('a', 'blue_band')
+        old_data = cache.get(header)
+        old_files = os.listdir(self.cache_path)
+
+        # a save of the same size, whose timestamp may be the same as well
+        stat = os.stat(header.filepath)
+        header = self.save('a', 'grey_band')
+        os.utime(header.filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(os.path.getsize(header.filepath), stat.st_size)
+
+        new_data = cache.get(header)
+        self.assertNotEqual(new_data, old_data)
+        self.assertEqual(new_data, cache.render(header))
+        self.assertEqual(len(os.listdir(self.cache_path)), 1)
+        self.assertNotEqual(os.listdir(self.cache_path), old_files)
+
+    def test_disk_cap_evicts_the_least_recently_used(self):
+        headers = {name: self.save(name) for name in 'abcd'}
+        size = len(RenderCache(self.cache_path).render(headers['a']))
+        cache = RenderCache(self.cache_path, max_disk_bytes=size * 3)
+        for name in 'abc':
+            cache.get(headers[name])
+        cache.get(headers['a'])
+        cache.get(headers['d'])
+        self.assertEqual(self.cached_ids(), ['a', 'c', 'd'])
+
+        # the cache is reloaded from disk after a restart, without rendering again
+        cache = RenderCache(self.cache_path, max_disk_bytes=size * 3)
+        with mock.patch.object(cache, 'render', side_effect=AssertionError('rendered again')):
+            for name in 'acd':
+                filepath, data = cache.get_file(headers[name])
+                self.assertIsNone(data)
+                self.assertTrue(os.path.exists(filepath))
+
+    def test_memory_cap_keeps_the_files(self):
+        headers = [self.save(name) for name in 'ab']
+        size = len(RenderCache(self.cache_path).render(headers[0]))
+        cache = RenderCache(self.cache_path, max_memory_bytes=size)
+        for header in headers:
+            cache.get(header)
+        self.assertIsNone(cache.get_file(headers[0])[1])
+        self.assertIsNotNone(cache.get_file(headers[1])[1])
+        self.assertEqual(self.cached_ids(), ['a', 'b'])
+        self.assertEqual(cache.get(headers[0]), cache.render(headers[0]))
+
+    def test_prune_removes_deleted_records(self):
+        headers = [self.save(name) for name in 'abc']
+        cache = RenderCache(self.cache_path)
+        for header in headers:
+            cache.get(header)
+        cache.prune(['b'])
+        self.assertEqual(self.cached_ids(), ['b'])
+
+    def test_busy_render_slots(self):
+        header = self.save('a')
+        slots = threading.BoundedSemaphore(1)
+        cache = RenderCache(self.cache_path, render_slots=slots, render_timeout=0.01)
+        slots.acquire()
+        with self.assertRaises(RenderBusyError):
+            cache.get(header)
+        slots.release()
+        data = cache.get(header)
+        self.assertEqual(data, cache.render(header))
+        # a cached thumbnail needs no slot
+        slots.acquire()
+        self.assertEqual(cache.get(header), data)
+
+if __name__ == '__main__':
+    unittest.main()
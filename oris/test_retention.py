@@ -0,0 +1,79 @@
+from band_detection import BandDetectionResult
+from detected_object import DetectedBand
+import record
+import retention
+
+from unittest import mock
+import numpy as np
+import unittest
+import tempfile
+import datetime
+import time
+import os
+
+class RetentionPassTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.saved_path = record.RECORD_SAVE_PATH
+        record.RECORD_SAVE_PATH = self.tempdir.name + os.sep
+
+        # ten records of the same size, a day apart and the oldest one 10 days old
+        image = np.zeros((16, 20, 3), dtype=np.uint8)
+        result = BandDetectionResult([DetectedBand(0, 'red_band', 0.9, [1, 1, 4, 15])])
+        now = time.time()
+        self.filenames = []
+        for days in range(10, 0, -1):
+            t = datetime.datetime.fromtimestamp(now - days * 86400)
+            filename = t.strftime(record.RECORD_TIME_FORMAT) + record.RECORD_FILE_EXT
+            record.DetectionRecord(image, result, t).save(filename)
+            os.utime(self.path(filename), (t.timestamp(), t.timestamp()))
+            self.filenames.append(filename)
+        self.corrupt_filename = '2022-03-14_10-31-00' + record.LEGACY_FILE_EXT
+        with open(self.path(self.corrupt_filename), 'wb') as f:
+            f.write(b'\x80\x04 truncated')
+
+    def tearDown(self):
+        record.RECORD_SAVE_PATH = self.saved_path
+        self.tempdir.cleanup()
+
+    def path(self, filename: str) -> str:
+        return os.path.join(record.RECORD_SAVE_PATH, filename)
+
+    def test_failures_do_not_stop_the_pruning(self):
+        scandir, replace = os.scandir, os.replace
+        vanishing = self.path(self.filenames[0])
+
+        def scandir_deleting(path):
+            # a record is deleted, e.g. by the clear button, after the directory is listed
+            entries = list(scandir(path))
+            if os.path.exists(vanishing):
+                os.remove(vanishing)
+            return iter(entries)
+
+        def replace_failing(src, dst):
+            if dst.endswith(retention._CORRUPT_SUFFIX):
+                raise PermissionError(13, 'Permission denied', dst)
+            replace(src, dst)
+
+        policy = retention.RetentionPolicy(max_bytes=os.path.getsize(self.path(self.filenames[-1])) * 5 + 100,
+                                           max_age=datetime.timedelta(days=7.5))
+        with mock.patch.object(retention.os, 'scandir', scandir_deleting), \
+             mock.patch.object(retention.os, 'replace', replace_failing):
+            with self.assertLogs(retention.logger, 'WARNING'):
+                retention.RetentionThread(policy).run_pass()
+
+        # the three records older than 7.5 days are gone by age, and two more by the budget
+        self.assertEqual(sorted(os.listdir(record.RECORD_SAVE_PATH)), sorted(self.filenames[5:] + [self.corrupt_filename]))
+
+    def test_select_evictions_by_age_and_budget(self):
+        entries = retention._scan_record_files(record.RECORD_SAVE_PATH)
+        size = os.path.getsize(self.path(self.filenames[0]))
+        # the legacy record, which has just been written, counts as well
+        self.assertEqual(len(entries), 11)
+        policy = retention.RetentionPolicy(max_bytes=None, max_age=datetime.timedelta(days=3.5))
+        self.assertEqual(sorted(x.name for x in policy.select_evictions(entries)), self.filenames[:7])
+        policy = retention.RetentionPolicy(max_bytes=size * 8 + 100, max_age=None)
+        self.assertEqual(sorted(x.name for x in policy.select_evictions(entries)), self.filenames[:2])
+
+if __name__ == '__main__':
+    unittest.main()
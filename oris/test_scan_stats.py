@@ -0,0 +1,113 @@
+from band_detection import BandDetectionResult
+from detected_object import DetectedBand
+from scan_stats import ScanAggregate, ScanStatistics, format_value, get_shift_key
+import scan_stats
+
+from unittest import mock
+import unittest
+import tempfile
+import datetime
+import json
+import os
+
+T0 = datetime.datetime(2022, 3, 14, 6, 30)
+
+def make_result(labels, score: float = 0.9) -> BandDetectionResult:
+    return BandDetectionResult([DetectedBand(i, label, score, [10 + 10 * i, 0, 15 + 10 * i, 20])
+                                for i, label in enumerate(labels)])
+
+RESULT_4K7 = ['yellow_band', 'violet_band', 'red_band', 'gold_band']
+
+class ScanAggregateTest(unittest.TestCase):
+    def test_format_value_and_shift_key(self):
+        self.assertEqual(format_value(4700, 5), '4.7k 5%')
+        self.assertEqual(format_value(2.2e6, 10), '2.2M 10%')
+        self.assertEqual(format_value(470, 1), '470 1%')
+        self.assertEqual(get_shift_key(T0), '2022-03-14_00')
+        self.assertEqual(get_shift_key(T0.replace(hour=8)), '2022-03-14_08')
+        self.assertEqual(get_shift_key(T0.replace(hour=23, minute=59)), '2022-03-14_16')
+
+    def test_mean_confidence_skips_scans_without_bands(self):
+        aggregate = ScanAggregate()
+        self.assertIsNone(aggregate.to_json()['mean_confidence'])
+        aggregate.add([], None, False, None)
+        self.assertIsNone(aggregate.to_json()['mean_confidence'])
+        aggregate.add([0.8, 0.6], '4.7k 5%', True, 3)
+        aggregate.add([], None, False, None)
+        aggregate.add([0.9], None, False, 12)
+
+        obj = aggregate.to_json()
+        self.assertEqual((obj['scans'], obj['scored'], obj['saved'], obj['rejected'], obj['undecoded']), (4, 2, 1, 3, 3))
+        self.assertAlmostEqual(obj['mean_confidence'], 0.8)
+        self.assertEqual(obj['rejection_rate'], 0.75)
+        self.assertEqual(obj['values'], {'4.7k 5%': 1})
+        self.assertEqual(sum(obj['score_histogram']), 3)
+        self.assertEqual(obj['score_histogram'][6:], [1, 0, 1, 1])
+        self.assertEqual(obj['mean_cycles'], 7.5)
+
+    def test_json_round_trip(self):
+        aggregate = ScanAggregate()
+        aggregate.add([1.0, 0.05], '470 1%', True, 2)
+        aggregate.add([], None, False, None)
+        obj = json.loads(json.dumps(aggregate.to_json()))
+        self.assertEqual(ScanAggregate.from_json(obj).to_json(), aggregate.to_json())
+
+        # the mean confidence of files written before the scored scans were counted is kept
+        del obj['scored']
+        self.assertEqual(ScanAggregate.from_json(obj).to_json()['mean_confidence'], aggregate.confidence_sum / 2)
+
+class ScanStatisticsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'scan_stats.json')
+        self.stats = ScanStatistics(self.path)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_per_shift_aggregation(self):
+        self.stats.record_scan(make_result(RESULT_4K7, 0.8), True, 4, T0)
+        self.stats.record_scan(make_result([]), False, None, T0 + datetime.timedelta(minutes=30))
+        self.stats.record_scan(make_result(RESULT_4K7, 0.6), True, 5, T0 + datetime.timedelta(minutes=60))
+        self.stats.record_scan(make_result(RESULT_4K7[:2]), False, 20, T0 + datetime.timedelta(hours=10))
+
+        obj = self.stats.to_json()
+        self.assertEqual([x['shift'] for x in obj['shifts']], ['2022-03-14_16', '2022-03-14_00'])
+        latest, first = obj['shifts']
+        self.assertEqual((first['scans'], first['scored'], first['saved'], first['rejected']), (3, 2, 2, 1))
+        self.assertAlmostEqual(first['mean_confidence'], 0.7)
+        self.assertEqual(first['values'], {'4.7k 5%': 2})
+        self.assertEqual((latest['scans'], latest['undecoded'], latest['rejection_rate']), (1, 1, 1.0))
+
+        total = obj['total']
+        self.assertEqual((total['scans'], total['scored'], total['cycles_count']), (4, 3, 3))
+        self.assertAlmostEqual(total['mean_confidence'], (0.8 + 0.6 + 0.9) / 3)
+        self.assertEqual([x['shift'] for x in self.stats.to_json(max_shifts=1)['shifts']], ['2022-03-14_16'])
+
+    def test_oldest_shifts_are_dropped(self):
+        with mock.patch.object(scan_stats, 'STATS_MAX_SHIFTS', 2):
+            for i in range(4):
+                self.stats.record_scan(make_result(RESULT_4K7), True, None, T0 + datetime.timedelta(hours=8 * i))
+        obj = self.stats.to_json()
+        self.assertEqual([x['shift'] for x in obj['shifts']], ['2022-03-15_00', '2022-03-14_16'])
+        self.assertEqual(obj['total']['scans'], 4)
+
+    def test_save_and_load(self):
+        self.stats.record_scan(make_result(RESULT_4K7), True, 3, T0)
+        self.stats.record_scan(make_result([]), False, None, T0 + datetime.timedelta(hours=9))
+        self.stats.save()
+        self.assertEqual(self.stats.saved_version, self.stats.version)
+
+        restored = ScanStatistics(self.path)
+        self.assertTrue(restored.load())
+        self.assertEqual(restored.to_json(), self.stats.to_json())
+        # the file is only read again after it changed
+        self.assertFalse(restored.load())
+
+        with open(self.path, 'w') as file:
+            file.write('{"total": {}}')
+        with self.assertRaises(ValueError):
+            ScanStatistics(self.path).load()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+from remote_detection import DETECT_MAX_IMAGE_BYTES, DETECT_MAX_PIXELS, DetectionBatcher
+from record_index import make_cursor, parse_cursor
+from load_test import synthesize_records
+import web_api
+import web_server
+
+from unittest import mock
+import numpy as np
+import http.client
+import functools
+import unittest
+import tempfile
+import socket
+import json
+import time
+import cv2
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Serves a temporary record directory with start_http_server() for the tests of a class.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.write_records(cls.tempdir.name)
+        web_server.set_record_path(cls.tempdir.name)
+        cls.port = _get_free_port()
+        # the detector is never loaded, as the tests only send requests which are rejected before
+        with mock.patch.object(web_server, 'DETECT_ENDPOINT_ENABLED', True), \
+             mock.patch.object(web_server, 'DetectionBatcher', functools.partial(DetectionBatcher, detector_factory=lambda: None)):
+            web_server.start_http_server(cls.port)
+
+        index = web_server.MyRequestHandler._record_index
+        t_end = time.monotonic() + 10
+        while len(index.get_ids()) < cls.record_count and time.monotonic() < t_end:
+            time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        web_server.close_http_server()
+        cls.tempdir.cleanup()
+
+    record_count = 0
+
+    @classmethod
+    def write_records(cls, path: str):
+        pass
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None):
+        """
+        Sends a request and returns the status, the headers and the body of the response.
+        """
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            conn.close()
+
+    def raw_request(self, data: bytes) -> bytes:
+        """
+        Sends raw request bytes and returns everything received until the server closes the connection.
+        """
+        with socket.create_connection(('127.0.0.1', self.port), timeout=10) as sock:
+            sock.sendall(data)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+
+class DetectEndpointTest(ServerTestCase):
+    def test_missing_length_is_rejected(self):
+        response = self.raw_request(b'POST /detect HTTP/1.1\r\nHost: test\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 411 '))
+
+    def test_negative_length_is_rejected_and_closed(self):
+        # the server must neither read the body until EOF nor keep the connection open
+        response = self.raw_request(b'POST /detect HTTP/1.1\r\nHost: test\r\nContent-Length: -1\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 '))
+        response = self.raw_request(b'POST /detect HTTP/1.1\r\nHost: test\r\nContent-Length: ten\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 '))
+
+    def test_too_long_body_is_rejected(self):
+        request = f'POST /detect HTTP/1.1\r\nHost: test\r\nContent-Length: {DETECT_MAX_IMAGE_BYTES + 1}\r\n\r\n'
+        response = self.raw_request(request.encode())
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 '))
+
+    def test_too_large_image_is_rejected_before_decoding(self):
+        height = DETECT_MAX_PIXELS // 4096 + 1
+        _, data = cv2.imencode('.png', np.zeros((height, 4096), dtype=np.uint8))
+        self.assertLess(len(data), DETECT_MAX_IMAGE_BYTES)
+        status, _, body = self.request('POST', '/detect', data.tobytes(), {'content-type': 'image/png'})
+        self.assertEqual(status, 400)
+        self.assertIn('larger than', json.loads(body)['error'])
+
+        status, _, body = self.request('POST', '/detect', b'\x89PNG not an image', {'content-type': 'image/png'})
+        self.assertEqual(status, 400)
+
+class ErrorResponseTest(ServerTestCase):
+    def test_missing_record_is_not_found(self):
+        status, _, _ = self.request('GET', '/missing.png')
+        self.assertEqual(status, 404)
+
+    def test_error_in_a_started_response_closes_the_connection(self):
+        def iter_export_csv(records):
+            yield 'time,resistance\r\n'
+            raise FileNotFoundError('the record was deleted during the export')
+
+        with mock.patch.object(web_server, 'iter_export_csv', iter_export_csv):
+            response = self.raw_request(b'GET /export.csv HTTP/1.1\r\nHost: test\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 '))
+        self.assertEqual(response.count(b'HTTP/1.1 '), 1)
+        self.assertNotIn(b'0\r\n\r\n', response.partition(b'\r\n\r\n')[2])
+
+class RecordApiTest(ServerTestCase):
+    record_count = 250
+
+    @classmethod
+    def write_records(cls, path: str):
+        synthesize_records(path, cls.record_count, size=(16, 16), days=10)
+
+    def get_json(self, path: str):
+        status, headers, body = self.request('GET', path)
+        self.assertEqual(headers['content-type'], 'application/json')
+        return status, json.loads(body)
+
+    def test_cursor_paging(self):
+        ids, times, cursor, pages = [], [], None, 0
+        while True:
+            status, obj = self.get_json('/api/records?limit=100' + (f'&cursor={cursor}' if cursor else ''))
+            self.assertEqual(status, 200)
+            pages += 1
+            ids += [r['id'] for r in obj['records']]
+            times += [r['time'] for r in obj['records']]
+            cursor = obj['next_cursor']
+            if cursor is None:
+                break
+            # the cursor points at the last record of the page
+            self.assertEqual(parse_cursor(cursor)[1], obj['records'][-1]['id'])
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(set(ids)), self.record_count)
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_limit_bounds(self):
+        status, obj = self.get_json('/api/records')
+        self.assertEqual(len(obj['records']), web_server.MyRequestHandler.num_result)
+        status, obj = self.get_json('/api/records?limit=0')
+        self.assertEqual(len(obj['records']), 1)
+        status, obj = self.get_json('/api/records?limit=1000')
+        self.assertEqual(len(obj['records']), web_server.MyRequestHandler.max_num_result)
+        self.assertIsNotNone(obj['next_cursor'])
+
+    def test_bad_parameters(self):
+        for query in ('cursor=garbage', 'cursor=yesterday~x', 'limit=ten', 'from=2022-13'):
+            status, obj = self.get_json('/api/records?' + query)
+            self.assertEqual(status, 400, query)
+            self.assertIn('error', obj)
+
+    def test_record_endpoints(self):
+        _, obj = self.get_json('/api/records?limit=1')
+        record = obj['records'][0]
+        status, obj = self.get_json(f'/api/records/{record["id"]}')
+        self.assertEqual((status, obj), (200, record))
+        status, obj = self.get_json(f'/api/records/{record["id"]}/bands')
+        self.assertEqual((status, obj), (200, record['bands']))
+        status, obj = self.get_json('/api/records/missing')
+        self.assertEqual(status, 404)
+
+    def test_ndjson_dump(self):
+        status, headers, body = self.request('GET', '/api/records.ndjson')
+        self.assertEqual((status, headers['content-type']), (200, 'application/x-ndjson'))
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len({r['id'] for r in records}), self.record_count)
+
+        # the dump fetches the records from the index a page of NDJSON_PAGE_SIZE at a time
+        index = web_server.MyRequestHandler._record_index
+        with mock.patch.object(index, 'query', wraps=index.query) as query:
+            lines = list(web_api.iter_record_dump(index))
+        self.assertEqual([json.loads(line) for line in lines], records)
+        self.assertEqual([c.kwargs['limit'] for c in query.call_args_list], [web_api.NDJSON_PAGE_SIZE] * 3)
+        self.assertEqual(query.call_args_list[1].kwargs['cursor'], make_cursor(index.get(records[99]['id'])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+from yuv_frame import SceneChangeDetector, SCENE_CHANGE_THRESHOLD
+
+import numpy as np
+import unittest
+
+class SceneChangeDetectorTest(unittest.TestCase):
+    def test_changes_are_measured_against_the_accepted_reference(self):
+        detector = SceneChangeDetector()
+        luma = np.full((64, 64), 100, dtype=np.uint8)
+        self.assertTrue(detector.is_changed(luma))
+        detector.accept()
+        self.assertFalse(detector.is_changed(luma))
+
+        # a scene drifting slowly is detected once it differs enough from the reference
+        step = int(SCENE_CHANGE_THRESHOLD / 2)
+        changed = []
+        for n in range(1, 5):
+            changed.append(detector.is_changed(luma + n * step))
+        self.assertEqual(changed, [False, False, True, True])
+
+        detector.accept()
+        self.assertFalse(detector.is_changed(luma + 4 * step))
+        self.assertTrue(detector.is_changed(np.full((32, 32), 100, dtype=np.uint8)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+from typing import List
+
 import cv2
 import numpy as np
 import time
@@ -60,3 +62,21 @@ class FPSCounter:
         """
         self.update()
         self.draw_on_img(image)
+
+def draw_overlay_text(image: np.ndarray, lines: List[str], first_row: int = 1):
+    """
+    Draws lines of text onto an image in the style of the FPSCounter.
+    Args:
+        image: Target image to draw on.
+        lines: The lines of text.
+        first_row: The row of the first line, where row 0 is the one of the FPS value.
+    """
+    for i, line in enumerate(lines):
+        text_location = (FPSCounter._MARGIN, FPSCounter._MARGIN + (first_row + i + 1) * FPSCounter._ROW_SIZE)
+        cv2.putText(
+            image, line, text_location,
+            cv2.FONT_HERSHEY_PLAIN,
+            FPSCounter._FONT_SIZE,
+            FPSCounter._TEXT_COLOR,
+            FPSCounter._FONT_THICKNESS,
+        )
@@ -0,0 +1,70 @@
+from typing import Iterator, Optional
+
+from record import RecordHeader
+from record_index import RecordIndex
+
+from urllib.parse import quote
+import json
+
+API_PREFIX          = '/api/'
+NDJSON_PAGE_SIZE    = 100       # records fetched from the index at a time while streaming a full dump
+
+def header_to_json(header: RecordHeader) -> dict:
+    """
+    Converts a record header into its JSON representation in the API.
+    """
+    return {
+        'id': header.record_id,
+        'time': header.time.isoformat(),
+        'value': value_to_json(header),
+        'bands': bands_to_json(header),
+        'image': '/' + quote(header.record_id) + '.png',
+    }
+
+def value_to_json(header: RecordHeader) -> dict:
+    """
+    Converts the decoded resistor value of a record into its JSON representation in the API.
+    """
+    return {
+        'resistance': header.resistance,
+        'tolerance': header.tolerance,
+        'error': header.error,
+    }
+
+def bands_to_json(header: RecordHeader) -> list:
+    """
+    Converts the detected bands of a record into their JSON representation in the API.
+    """
+    return [
+        {'id': band.id, 'label': band.label, 'score': band.score, 'box': list(band.box)}
+        for band in header.bands
+    ]
+
+def iter_record_list(index: RecordIndex, **params) -> Iterator[str]:
+    """
+    Generates the JSON document of one page of records piece by piece.
+    Args:
+        index: The record index to query.
+        params: The keyword arguments for RecordIndex.query().
+    """
+    records, next_cursor = index.query(**params)
+    yield '{"records":['
+    for i, header in enumerate(records):
+        yield (',' if i else '') + json.dumps(header_to_json(header))
+    yield '],"next_cursor":' + json.dumps(next_cursor) + '}'
+
+def iter_record_dump(index: RecordIndex, page_size: int = NDJSON_PAGE_SIZE, **params) -> Iterator[str]:
+    """
+    Generates all records matching a query as newline-delimited JSON, one line per record.
+    Args:
+        index: The record index to query.
+        page_size: The number of records fetched from the index at a time.
+        params: The keyword arguments for RecordIndex.query(), except limit.
+    """
+    cursor: Optional[str] = params.pop('cursor', None)
+    while True:
+        records, cursor = index.query(cursor=cursor, limit=page_size, **params)
+        for header in records:
+            yield json.dumps(header_to_json(header)) + '\n'
+        if cursor is None:
+            break
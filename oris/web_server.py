@@ -1,144 +1,923 @@
 from http import server
-from typing import Type, List
+from typing import Type, List, Iterator
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from PIL import Image
-import cgi, os, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import urlsplit, parse_qs, urlencode, quote, unquote
+from html import escape
+from email.utils import parsedate_to_datetime
+import cgi, datetime, json, os, socket, time
 
-from band_detection import BandDetectionResult
 from record import *
+from record_index import RecordIndex, RecordIndexThread, parse_time_prefix, parse_cursor
+from record_search import parse_resistance, parse_duration, parse_band_filter
+from render_cache import RenderCache, RenderBusyError
+from http_utils import ChunkedWriter, GZIP_MIN_SIZE, accepts_gzip, gzip_compress, make_etag, format_http_date, is_not_modified, parse_range, safe_join
+from event_stream import EventStream
+from record_export import get_export_records, get_export_filename, iter_export_zip, iter_export_csv
+from scan_stats import STATS_SCORE_BINS, STATS_CYCLE_BUCKETS, stats as scan_stats
+from camera_stream import get_capture_stats
+from remote_detection import DETECT_ENDPOINT_ENABLED, DETECT_MAX_IMAGE_BYTES, DetectionBatcher, DetectionBusyError, decode_image, result_to_json
+import metrics
+from preview_stream import PREVIEW_STREAM_ENABLED, preview_broadcaster
+from web_api import API_PREFIX, header_to_json, value_to_json, bands_to_json, iter_record_list, iter_record_dump
 from resistor import *
 
-from threading import Thread
+from threading import Thread, BoundedSemaphore, Lock, Event
 
 IMG_SIZE = (200,200)
 
+SERVER_MAX_WORKERS      = 8     # the number of requests served concurrently
+SERVER_MAX_PENDING      = 32    # the number of accepted connections allowed to wait for a worker
+SERVER_REQUEST_TIMEOUT  = 30    # seconds a connection may stay idle before it is closed
+SERVER_MAX_HEAVY_RENDERS = 2    # the number of page builds and thumbnail renders running concurrently
+SERVER_MAX_STREAMS      = 4     # the number of long-lived streaming responses served concurrently
+
+STATS_DEFAULT_SHIFTS = 21      # the number of most recent shifts shown on the dashboard
+
+# the version counters of the record index and the statistics restart at every start, so the
+# entity tags built from them also include this value, which is unique to the server process
+BOOT_NONCE = os.urandom(8).hex()
+
+SEARCH_PARAMS = ('value', 'min_value', 'max_value', 'tolerance', 'band_count', 'band', 'last')
+
+LIVE_UPDATE_SCRIPT = '''<script>
+var recordSource = new EventSource('/events');
+recordSource.addEventListener('record', function (e) {
+    var r = JSON.parse(e.data);
+    var row = document.getElementById('records').insertRow(1);
+
+    var img = document.createElement('img');
+    img.src = r.image; img.width = %d; img.height = %d;
+    row.insertCell().appendChild(img);
+
+    var bands = document.createElement('table');
+    r.bands.forEach(function (b) {
+        var bandRow = bands.insertRow();
+        bandRow.insertCell().textContent = b.label;
+        bandRow.insertCell().textContent = Math.round(b.score * 100) + '%%';
+    });
+    row.insertCell().appendChild(bands);
+
+    var value = row.insertCell();
+    if (r.value.error === null) {
+        value.innerHTML = '<table><tr><td>Resistance: </td></tr><tr><td>' + r.value.resistance.toLocaleString('en-US') +
+            ' Ohm</td></tr><tr><td>Tolenrance: </td></tr><tr><td>' + r.value.tolerance + '%% </td></tr></table>';
+    } else {
+        value.textContent = r.value.error;
+    }
+    row.insertCell().textContent = r.time.slice(0, 19).replace('T', '_').replace(/:/g, '-');
+});
+</script>''' % IMG_SIZE
+
+class ServerBusyError(Exception):
+    '''
+        (Class) Raised when a request cannot be served in time because the server is overloaded
+    '''
+
 class MyRequestHandler(BaseHTTPRequestHandler):
     '''
         (Class) Http Server Reuqest Handler
     '''
+    protocol_version = 'HTTP/1.1'
+
     num_result = 10
+    max_num_result = 200
     _abs_direct = os.path.join(os.getcwd(), RECORD_SAVE_PATH[2:-1])
     _img_path = os.path.join(_abs_direct,'temp')
-    _search_date = ''
-    _pickle_list = []
-
-    def pickle_handler(self,path: str) -> List[BandDetectionResult]:
-        '''
-        unpack the pickle and store the object in the pickle list
-
-        parameter:
-            path(directory for scan result)
-        '''
-        os.makedirs(path, exist_ok=True)
-        files = os.listdir(path)
-        
-        self._pickle_list = []
-        for file in files:
-            if os.path.isfile(os.path.join(path, file)):
-                img_path = os.path.join(path, file)
-                temp = read_from_file(img_path)
-                
-                temp_path = os.path.join(path, 'temp')
-                os.makedirs(temp_path, exist_ok=True)
-                
-                image = temp.image.copy()
-                temp.detection_result.draw_on_img(image)
-                
-                Image.fromarray(image).save(os.path.join(temp_path, file[:-7] + '.png'), 'PNG')
-                self._pickle_list.append(temp)
-
-    def table_gen(self, path: str, date_limit: str) -> str:
-        '''
-        generate the html table for the result display
-
-        parameter:
-            (str)path(directory for image of scan result)
-            (str)date_limit(the date delimitor for the result display)
-        '''
-        my_table = '<table border="1"><tr><th>Picture</th><th>Scan Result</th><th>Detection Result</th><th>Date</th></tr>'
-
-        for element in self._pickle_list:
-            if element is None:
-                continue
-            my_resistor = Resistor(element.detection_result)
-            my_time = element.time
-            if my_time.strftime('%Y-%m-%d_%H-%M-%S').find(date_limit) != -1:
-                    my_table += '<tr><td><img src="' + element.time.strftime('%Y-%m-%d_%H-%M-%S')+ '.png' + '" width="' + str(IMG_SIZE[0]) + '" height ="' + str(IMG_SIZE[1]) + '"></td>'
-                    my_table += '<td><table>'
-                    #################################
-                    # display scan result here
-                    for b in element.detection_result.detected_bands:
-                        if b is not None:
-                            my_table += '<tr><td>'
-                            my_table += b.label
-                            my_table += '</td><td>'
-                            myscore = '{:d}'.format(round(b.score*100))
-                            my_table += myscore
-                            my_table += '%</td></tr>'
-                    my_table += '</table></td>'
-                    # display detection result here
-                    my_table += '<td>'
-                    my_table += '<table><tr><td>Resistance: </td></tr>'
-                    my_table += '<tr><td>' + f'{my_resistor.get_resistance():,}' + ' Ohm</td></tr>'
-                    my_table += '<tr><td>Tolenrance: </td></tr>'
-                    my_table += '<tr><td>' + f'{my_resistor.get_tolerance()}' + '% </td></tr>'
-                    my_table += '</table></td>'
-                    ##################################
-                    my_table += '<td>' + my_time.strftime('%Y-%m-%d_%H-%M-%S') + '</td></tr>'
-        my_table += '</table>'
-        return my_table
+    _heavy_slots = BoundedSemaphore(SERVER_MAX_HEAVY_RENDERS)
+    _render_cache: RenderCache = None   # created by start_http_server(), as it creates its directory
+    _record_index = RecordIndex(_abs_direct)
+    _stream_slots = BoundedSemaphore(SERVER_MAX_STREAMS)
+    _metrics_lock = Lock()
+    _stats_follow_file = False      # reload the scan statistics from their file, when the GUI runs in another process
 
-    def do_GET(self):
+    timeout = SERVER_REQUEST_TIMEOUT
+    disable_nagle_algorithm = True
+
+    def end_headers(self):
         '''
-        Handle the 'GET' request to the server
+        Overrides end_headers() in BaseHTTPRequestHandler to give up keep-alive while other connections wait for a worker
+        '''
+        has_waiting = getattr(self.server, 'has_waiting', None)
+        if not self.close_connection and has_waiting is not None and has_waiting():
+            self.send_header('connection', 'close')
+        super().end_headers()
+
+    def send_response_only(self, code, message=None):
+        '''
+        Overrides send_response_only() in BaseHTTPRequestHandler to remember that the response has started
+        '''
+        self.response_started = True
+        super().send_response_only(code, message)
+
+    def acquire_heavy_slot(self):
+        '''
+        wait for a free slot to run an expensive page build or render
+
+        raise:
+            ServerBusyError(no slot became free within the request timeout)
+        '''
+        if not self._heavy_slots.acquire(timeout=self.timeout):
+            raise ServerBusyError()
+
+    def release_heavy_slot(self):
+        '''
+        release the slot acquired by acquire_heavy_slot
+        '''
+        self._heavy_slots.release()
+
+    def record_handler(self):
+        '''
+        wait until the record index has been loaded, so listings never touch the file system
+
+        raise:
+            ServerBusyError(the index is not loaded within the request timeout)
+        '''
+        if not self._record_index.ready.wait(self.timeout):
+            raise ServerBusyError()
+
+    def send_body(self, code: int, content_type: str, body: bytes, headers: dict = None, compressible: bool = False):
+        '''
+        send a complete response with a body of known length
+
+        parameter:
+            (int)code(the status code)
+            (str)content_type(the content type of body)
+            (bytes)body(the response body)
+            (dict)headers(extra response headers)
+            (bool)compressible(whether body may be sent gzip-compressed)
+        '''
+        self.send_response(code)
+        self.send_header('content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if compressible:
+            self.send_header('vary', 'accept-encoding')
+            if len(body) >= GZIP_MIN_SIZE and accepts_gzip(self.headers):
+                body = gzip_compress(body)
+                self.send_header('content-encoding', 'gzip')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def check_not_modified(self, headers: dict) -> bool:
+        '''
+        answer a conditional request with 304 if the client's cached copy is still valid
+
+        parameter:
+            (dict)headers(the validator and caching headers of the current response)
+        return:
+            whether a 304 response has been sent
+        '''
+        last_modified = headers.get('last-modified')
+        if last_modified is not None:
+            last_modified = parsedate_to_datetime(last_modified).timestamp()
+        if not is_not_modified(self.headers, headers.get('etag'), last_modified):
+            return False
+
+        self.send_response(304)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        return True
+
+    def index_validators(self, *parts) -> dict:
+        '''
+        make the validator and caching headers of a response generated from the record index
+
+        parameter:
+            (tuple)parts(the values which, besides the index, determine the response)
+        '''
+        return {
+            'etag': make_etag(BOOT_NONCE, self._record_index.version, *parts, weak=True),
+            'last-modified': format_http_date(self._record_index.last_modified),
+            'cache-control': 'no-cache',
+        }
+
+    def parse_listing_query(self, query: dict) -> dict:
+        '''
+        parse the listing parameters in the url query
+
+        parameter:
+            (dict)query(the parsed url query)
+        return:
+            keyword arguments for RecordIndex.query
+        raise:
+            ValueError(a parameter is malformed)
+        '''
+        params = {'limit': self.num_result}
+        if query.get('from'):
+            params['start'] = parse_time_prefix(query['from'][0])[0]
+        if query.get('to'):
+            params['end'] = parse_time_prefix(query['to'][0])[1]
+        if query.get('cursor'):
+            parse_cursor(query['cursor'][0])
+            params['cursor'] = query['cursor'][0]
+        if query.get('limit'):
+            params['limit'] = min(max(int(query['limit'][0]), 1), self.max_num_result)
+
+        if query.get('last'):
+            duration = parse_duration(query['last'][0])
+            try:
+                start = datetime.datetime.now() - duration
+            except OverflowError:
+                start = datetime.datetime.min
+            params['start'] = max(params.get('start', start), start)
+        if query.get('value'):
+            params['resistance'] = parse_resistance(query['value'][0])
+        if query.get('min_value'):
+            params['min_resistance'] = parse_resistance(query['min_value'][0])
+        if query.get('max_value'):
+            params['max_resistance'] = parse_resistance(query['max_value'][0])
+        if query.get('tolerance'):
+            params['tolerance'] = float(query['tolerance'][0].rstrip('% '))
+        if query.get('band_count'):
+            params['band_count'] = int(query['band_count'][0])
+        if query.get('band'):
+            params['bands'] = [parse_band_filter(x) for x in query['band'] if x]
+        return params
+
+    def row_gen(self, element: RecordHeader) -> str:
+        '''
+        generate the html table row for one record
+
+        parameter:
+            (RecordHeader)element(the record to display)
+        '''
+        my_time = element.time.strftime(RECORD_TIME_FORMAT)
+
+        my_row = '<tr><td><img src="' + quote(element.record_id) + '.png' + '" width="' + str(IMG_SIZE[0]) + '" height ="' + str(IMG_SIZE[1]) + '"></td>'
+        my_row += '<td><table>'
+        #################################
+        # display scan result here
+        for b in element.bands:
+            my_row += '<tr><td>'
+            my_row += escape(b.label)
+            my_row += '</td><td>'
+            myscore = '{:d}'.format(round(b.score*100))
+            my_row += myscore
+            my_row += '%</td></tr>'
+        my_row += '</table></td>'
+        # display detection result here
+        my_row += '<td>'
+        if element.is_decoded():
+            my_row += '<table><tr><td>Resistance: </td></tr>'
+            my_row += '<tr><td>' + f'{element.resistance:,}' + ' Ohm</td></tr>'
+            my_row += '<tr><td>Tolenrance: </td></tr>'
+            my_row += '<tr><td>' + f'{element.tolerance}' + '% </td></tr>'
+            my_row += '</table>'
+        else:
+            my_row += escape(element.error)
+        my_row += '</td>'
+        ##################################
+        my_row += '<td>' + my_time + '</td></tr>'
+        return my_row
+
+    def table_gen(self, records: List[RecordHeader]) -> Iterator[str]:
+        '''
+        generate the html table for the result display, one row at a time
+
+        parameter:
+            (list)records(the records to display)
+        '''
+        yield '<table id="records" border="1"><tr><th>Picture</th><th>Scan Result</th><th>Detection Result</th><th>Date</th></tr>'
+        for element in records:
+            yield self.row_gen(element)
+        yield '</table>'
+
+    def index_page(self, query: dict):
+        '''
+        stream the page listing one page of scan results
+
+        parameter:
+            (dict)query(the parsed url query)
         '''
         try:
-            if self.path.endswith('/'):
-                self.pickle_handler(self._abs_direct)
+            params = self.parse_listing_query(query)
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
 
-                self.send_response(200)
-                self.send_header('content-type', 'text/html')
-                self.end_headers()
+        self.record_handler()
+        validators = self.index_validators('index', self.path, params.get('start'))
+        if self.check_not_modified(validators):
+            return
+        records, next_cursor = self._record_index.query(**params)
 
-                output = ''
-                output += '<html><body>'
-                output += '<h1>Previous Scan Result </h1>'
-                output += '<h3><a href = "/search">Search</a></h3>'
-                output += self.table_gen(self._abs_direct,self._search_date)
-                output += '</body></html>'
-                self.wfile.write(output.encode())
+        output = self.start_stream('text/html', validators)
+        output.write('<html><body>')
+        output.write('<h1>Previous Scan Result </h1>')
+        output.write('<h3><a href = "/search">Search</a> <a href = "/stats">Statistics</a></h3>')
+        if PREVIEW_STREAM_ENABLED:
+            output.write('<h3><a href = "/stream.mjpg">Live Preview</a></h3>')
+        export_query = escape(urlencode({k: v[0] for k, v in query.items() if k in ('from', 'to')}))
+        output.write('<h3>Export: <a href = "/export.zip?' + export_query + '">ZIP</a> <a href = "/export.csv?' + export_query + '">CSV</a></h3>')
+        for part in self.table_gen(records):
+            output.write(part)
 
-            elif self.path.endswith('.png'):
-                self.send_response(200)
-                self.send_header('content-type', 'image/jpeg')
+        if 'cursor' not in query and 'to' not in query and not any(k in query for k in SEARCH_PARAMS):
+            output.write(LIVE_UPDATE_SCRIPT)
+
+        page_query = {k: v for k, v in query.items() if k in ('from', 'to', 'limit') + SEARCH_PARAMS}
+        if 'cursor' in query:
+            output.write('<a href="/?' + escape(urlencode(page_query, doseq=True)) + '">Newest</a> ')
+        if next_cursor is not None:
+            page_query['cursor'] = [next_cursor]
+            output.write('<a href="/?' + escape(urlencode(page_query, doseq=True)) + '">Next page</a>')
+        output.write('</body></html>')
+        output.close()
+
+    def find_header(self, record_id: str) -> RecordHeader:
+        '''
+        find the header of a record from its untrusted id
+
+        parameter:
+            (str)record_id(the record id taken from the url)
+        raise:
+            FileNotFoundError(the record does not exist or the id is not a valid record id)
+        '''
+        header = self._record_index.get(record_id)
+        if header is not None:
+            return header
+
+        try:
+            safe_join(self._abs_direct, record_id)
+        except ValueError:
+            raise FileNotFoundError(record_id)
+        filepath = None
+        if os.path.basename(record_id) == record_id:
+            filepath = find_record_file(record_id, self._abs_direct)
+        if filepath is None:
+            raise FileNotFoundError(record_id)
+        return read_header(filepath)
+
+    def send_file(self, filepath: str, content_type: str, headers: dict = None):
+        '''
+        send a file with zero-copy sendfile, honoring a single byte range request
+
+        parameter:
+            (str)filepath(the file to send)
+            (str)content_type(the content type of the file)
+            (dict)headers(extra response headers)
+        raise:
+            FileNotFoundError(the file does not exist)
+        '''
+        with open(filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+
+            try:
+                byte_range = parse_range(self.headers.get('range'), size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('content-range', f'bytes */{size}')
+                self.send_header('content-length', '0')
                 self.end_headers()
-                content = open(os.path.join(self._img_path, self.path[1:]), 'rb')
-                self.wfile.write(content.read())
-                content.close()
-        
-            elif self.path.endswith('/search'):
+                return
+
+            if byte_range is not None and headers and 'etag' in headers:
+                if_range = self.headers.get('if-range')
+                if if_range is not None and if_range.strip() != headers['etag']:
+                    byte_range = None
+
+            if byte_range is None:
+                offset, count = 0, size
                 self.send_response(200)
-                self.send_header('content-type', 'text/html')
-                self.end_headers()
+            else:
+                offset, count = byte_range[0], byte_range[1] - byte_range[0] + 1
+                self.send_response(206)
+                self.send_header('content-range', f'bytes {byte_range[0]}-{byte_range[1]}/{size}')
+
+            self.send_header('content-type', content_type)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('accept-ranges', 'bytes')
+            self.send_header('content-length', str(count))
+            self.end_headers()
+            self.wfile.flush()
+
+            if count > 0:
+                self.connection.sendfile(f, offset, count)
+
+    def image_page(self, path: str):
+        '''
+        send the rendered thumbnail of a record
 
-                output = ''
-                output += '<html><body>'
-                output += '<h1>Enter the date</h1>'
-                output += '<form method = "POST" enctype="multipart/form-data" action="/search">'
-                output += '<input name="search_date" type ="text" placeholder ="YYYY-MM-DD_hh-mm-ss">'
-                output += '<input type="submit" value = "Search">'
-                output += '</form>'
-                output += '</body></html>'
-                self.wfile.write(output.encode())
-        except IOError:
+        parameter:
+            (str)path(the url path of the thumbnail)
+        '''
+        header = self.find_header(unquote(path[1:-4]))
+
+        validators = {
+            'etag': '"' + self._render_cache.make_key(header) + '"',
+            'last-modified': format_http_date(os.stat(header.filepath).st_mtime),
+            'cache-control': 'public, max-age=31536000, immutable',
+        }
+        if self.check_not_modified(validators):
+            return
+
+        filepath, content = self._render_cache.get_file(header)
+        if content is None:
+            try:
+                self.send_file(filepath, 'image/png', validators)
+                return
+            except FileNotFoundError:
+                content = self._render_cache.get(header)
+        self.send_body(200, 'image/png', content, validators)
+
+    def server_closing(self) -> bool:
+        '''
+        return whether the server is shutting down, so long-lived streams should end
+        '''
+        closing = getattr(self.server, 'closing', None)
+        return closing is not None and closing.is_set()
+
+    def preview_page(self):
+        '''
+        stream the live preview as MJPEG until the client disconnects or the server shuts down
+        '''
+        if not PREVIEW_STREAM_ENABLED:
+            self.send_error(404)
+            return
+        if not self._stream_slots.acquire(blocking=False):
+            raise ServerBusyError()
+
+        preview_broadcaster.add_viewer()
+        try:
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header('content-type', 'multipart/x-mixed-replace; boundary=frame')
+            self.send_header('cache-control', 'no-store')
+            self.send_header('connection', 'close')
+            self.end_headers()
+
+            seq = 0
+            while not self.server_closing():
+                seq, jpeg = preview_broadcaster.wait_jpeg(seq, timeout=1)
+                if jpeg is None:
+                    continue
+                self.wfile.write(
+                    b'--frame\r\ncontent-type: image/jpeg\r\ncontent-length: %d\r\n\r\n' % len(jpeg)
+                    + jpeg + b'\r\n'
+                )
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            pass
+        finally:
+            preview_broadcaster.remove_viewer()
+            self._stream_slots.release()
+
+    def events_page(self, query: dict):
+        '''
+        start a server-sent event stream of newly saved records and hand the connection over to the event stream
+
+        parameter:
+            (dict)query(the parsed url query)
+        '''
+        event_stream = getattr(self.server, 'event_stream', None)
+        if event_stream is None:
             self.send_error(404)
-    
+            return
+
+        last_event_id = self.headers.get('last-event-id') or query.get('lastEventId', [None])[0]
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('cache-control', 'no-store')
+        self.send_header('connection', 'close')
+        self.end_headers()
+        self.wfile.write(b'retry: 3000\n\n')
+        self.wfile.flush()
+
+        if event_stream.attach(self.connection, last_event_id):
+            self.server.detach(self.connection)
+
+    def send_json(self, code: int, obj, headers: dict = None):
+        '''
+        send a complete JSON response
+
+        parameter:
+            (int)code(the status code)
+            (object)obj(the JSON-serializable response)
+            (dict)headers(extra response headers)
+        '''
+        self.send_body(code, 'application/json', json.dumps(obj).encode(), headers, compressible=True)
+
+    def start_stream(self, content_type: str, headers: dict = None, compressible: bool = True) -> ChunkedWriter:
+        '''
+        start a response body of unknown length with chunked transfer encoding, gzip-compressed if accepted
+
+        parameter:
+            (str)content_type(the content type of the body)
+            (dict)headers(extra response headers)
+            (bool)compressible(whether the body is worth compressing)
+        return:
+            the writer for the body, which must be closed to end the response
+        '''
+        compress = compressible and accepts_gzip(self.headers)
+
+        self.send_response(200)
+        self.send_header('content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('vary', 'accept-encoding')
+        if compress:
+            self.send_header('content-encoding', 'gzip')
+        self.send_header('transfer-encoding', 'chunked')
+        self.end_headers()
+        return ChunkedWriter(self.wfile, compress=compress)
+
+    def send_stream(self, content_type: str, parts: Iterator[str], headers: dict = None, compressible: bool = True):
+        '''
+        stream a response body of unknown length with chunked transfer encoding
+
+        parameter:
+            (str)content_type(the content type of the body)
+            (iterator)parts(the pieces of the body)
+            (dict)headers(extra response headers)
+            (bool)compressible(whether the body is worth compressing)
+        '''
+        output = self.start_stream(content_type, headers, compressible)
+        for part in parts:
+            output.write(part)
+        output.close()
+
+    def export_page(self, path: str, query: dict):
+        '''
+        stream an export of the records in the requested time range, generated on the fly
+
+        parameter:
+            (str)path(the url path, /export.zip or /export.csv)
+            (dict)query(the parsed url query)
+        '''
+        try:
+            params = self.parse_listing_query(query)
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
+        if not self._stream_slots.acquire(blocking=False):
+            raise ServerBusyError()
+
+        try:
+            self.record_handler()
+            start, end = params.get('start'), params.get('end')
+            records = get_export_records(self._record_index, start, end)
+            extension = os.path.splitext(path)[1]
+            headers = {
+                'content-disposition': 'attachment; filename="' + get_export_filename(start, end, extension) + '"',
+                'cache-control': 'no-store',
+            }
+            if extension == '.zip':
+                self.send_stream('application/zip', iter_export_zip(records), headers, compressible=False)
+            else:
+                self.send_stream('text/csv', iter_export_csv(records), headers)
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            self.close_connection = True
+        finally:
+            self._stream_slots.release()
+
+    def api_page(self, path: str, query: dict):
+        '''
+        serve the JSON API for the scan records
+
+        parameter:
+            (str)path(the url path below API_PREFIX)
+            (dict)query(the parsed url query)
+        '''
+        try:
+            params = self.parse_listing_query(query)
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+
+        if path == 'capture':
+            self.send_json(200, get_capture_stats(), {'cache-control': 'no-store'})
+            return
+        if path == 'stats':
+            try:
+                obj = self.get_scan_stats(query)
+            except ValueError as error:
+                self.send_json(400, {'error': str(error)})
+                return
+            validators = {'etag': make_etag(BOOT_NONCE, scan_stats.version, self.path, weak=True), 'cache-control': 'no-cache'}
+            if not self.check_not_modified(validators):
+                self.send_json(200, obj, validators)
+            return
+        if path == 'records':
+            self.record_handler()
+            validators = self.index_validators('api', self.path, params.get('start'))
+            if not self.check_not_modified(validators):
+                self.send_stream('application/json', iter_record_list(self._record_index, **params), validators)
+            return
+        if path == 'records.ndjson':
+            self.record_handler()
+            params.pop('limit')
+            validators = self.index_validators('api', self.path, params.get('start'))
+            if not self.check_not_modified(validators):
+                self.send_stream('application/x-ndjson', iter_record_dump(self._record_index, **params), validators)
+            return
+
+        parts = path.split('/')
+        if len(parts) < 2 or len(parts) > 3 or parts[0] != 'records':
+            self.send_json(404, {'error': 'Unknown API endpoint'})
+            return
+
+        try:
+            header = self.find_header(unquote(parts[1]))
+        except FileNotFoundError:
+            self.send_json(404, {'error': 'Unknown record'})
+            return
+
+        if len(parts) == 3 and parts[2] == 'file':
+            validators = {
+                'etag': '"' + self._render_cache.make_key(header) + '"',
+                'last-modified': format_http_date(os.stat(header.filepath).st_mtime),
+                'cache-control': 'no-cache',
+            }
+            if not self.check_not_modified(validators):
+                validators['content-disposition'] = f'attachment; filename="{os.path.basename(header.filepath)}"'
+                self.send_file(header.filepath, 'application/octet-stream', validators)
+            return
+
+        if len(parts) == 2:
+            obj = header_to_json(header)
+        elif parts[2] == 'value':
+            obj = value_to_json(header)
+        elif parts[2] == 'bands':
+            obj = bands_to_json(header)
+        else:
+            self.send_json(404, {'error': 'Unknown API endpoint'})
+            return
+
+        validators = {
+            'etag': make_etag(self._render_cache.make_key(header), self.path, weak=True),
+            'last-modified': format_http_date(os.stat(header.filepath).st_mtime),
+            'cache-control': 'no-cache',
+        }
+        if not self.check_not_modified(validators):
+            self.send_json(200, obj, validators)
+
+    def search_page(self):
+        '''
+        send the page with the search form
+        '''
+        output = ''
+        output += '<html><body>'
+        output += '<h1>Enter the date</h1>'
+        output += '<form method = "GET" action="/">'
+        output += '<input name="from" type ="text" placeholder ="From YYYY-MM-DD_hh-mm-ss">'
+        output += '<input name="to" type ="text" placeholder ="To YYYY-MM-DD_hh-mm-ss">'
+        output += '<input name="last" type ="text" placeholder ="Or last 7d / 24h">'
+        output += '<h1>Filter the results</h1>'
+        output += '<input name="value" type ="text" placeholder ="Resistance, e.g. 4.7k">'
+        output += '<input name="min_value" type ="text" placeholder ="Min resistance">'
+        output += '<input name="max_value" type ="text" placeholder ="Max resistance">'
+        output += '<input name="tolerance" type ="text" placeholder ="Tolerance, e.g. 5">'
+        output += '<input name="band_count" type ="text" placeholder ="Number of bands">'
+        output += '<input name="band" type ="text" placeholder ="Band, e.g. violet&lt;0.6">'
+        output += '<input type="submit" value = "Search">'
+        output += '</form>'
+        output += '</body></html>'
+
+        validators = {'etag': make_etag(output), 'cache-control': 'max-age=3600'}
+        if not self.check_not_modified(validators):
+            self.send_body(200, 'text/html', output.encode(), validators, compressible=True)
+
+    def do_GET(self):
+        '''
+        Handle the 'GET' request to the server
+        '''
+        t_start = time.perf_counter()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        self.response_started = False
+        try:
+            if url.path == '/':
+                self.index_page(query)
+            elif url.path.startswith(API_PREFIX):
+                self.api_page(url.path[len(API_PREFIX):], query)
+            elif url.path.endswith('.png'):
+                self.image_page(url.path)
+            elif url.path == '/search':
+                self.search_page()
+            elif url.path == '/stream.mjpg':
+                self.preview_page()
+            elif url.path == '/events':
+                self.events_page(query)
+            elif url.path in ('/export.zip', '/export.csv'):
+                self.export_page(url.path, query)
+            elif url.path == '/metrics':
+                self.metrics_page()
+            elif url.path == '/stats':
+                self.stats_page(query)
+            else:
+                self.send_error(404)
+        except (ServerBusyError, RenderBusyError):
+            self.send_response(503)
+            self.send_header('Retry-After', '1')
+            self.send_header('content-length', '0')
+            self.end_headers()
+        except OSError as error:
+            # a status line cannot follow a response which has started already, e.g. a streamed
+            # body cut off by a broken pipe, a timeout or a record deleted while it was exported
+            if self.response_started or isinstance(error, (ConnectionError, socket.timeout)):
+                self.close_connection = True
+            elif isinstance(error, FileNotFoundError):
+                self.send_error(404)
+            else:
+                self.close_connection = True
+                self.send_error(500)
+        finally:
+            self.observe_request(url.path, t_start)
+
+    def observe_request(self, path: str, t_start: float):
+        '''
+        record the duration of a request in the request metrics, except for long-lived streams
+
+        parameter:
+            (str)path(the url path of the request)
+            (float)t_start(the perf_counter() value at the start of the request)
+        '''
+        if path in ('/stream.mjpg', '/events'):
+            return
+        if path == '/':
+            route = 'index'
+        elif path.startswith(API_PREFIX):
+            route = 'api'
+        elif path.endswith('.png'):
+            route = 'image'
+        elif path.startswith('/export.'):
+            route = 'export'
+        elif path in ('/search', '/detect', '/metrics', '/stats'):
+            route = path[1:]
+        else:
+            route = 'other'
+        with self._metrics_lock:
+            metrics.http_request_seconds[route].observe(time.perf_counter() - t_start)
+
+    def get_scan_stats(self, query: dict) -> dict:
+        '''
+        get the scan statistics of the most recent shifts
+
+        parameter:
+            (dict)query(the parsed url query)
+        raise:
+            ValueError(the number of shifts is malformed)
+        '''
+        max_shifts = STATS_DEFAULT_SHIFTS
+        if query.get('shifts'):
+            max_shifts = max(int(query['shifts'][0]), 0)
+        if self._stats_follow_file:
+            try:
+                scan_stats.load()
+            except (OSError, ValueError) as error:
+                self.log_error('%s', str(error))
+        return scan_stats.to_json(max_shifts)
+
+    def stats_page(self, query: dict):
+        '''
+        send the dashboard of the scan statistics
+
+        parameter:
+            (dict)query(the parsed url query)
+        '''
+        try:
+            obj = self.get_scan_stats(query)
+        except ValueError as error:
+            self.send_error(400, str(error))
+            return
+        validators = {'etag': make_etag(BOOT_NONCE, scan_stats.version, self.path, weak=True), 'cache-control': 'no-cache'}
+        if self.check_not_modified(validators):
+            return
+
+        def percent(value):
+            return '-' if value is None else '{:.1f}%'.format(value * 100)
+
+        def mean(value):
+            return '-' if value is None else '{:.2f}'.format(value)
+
+        total = obj['total']
+        output = '<html><body>'
+        output += '<h1>Scan Statistics</h1>'
+        output += '<h3><a href = "/">Records</a> <a href = "/api/stats">JSON</a></h3>'
+        output += '<table border="1"><tr><th>Scans</th><th>Saved</th><th>Rejected</th><th>Undecoded</th><th>Mean Confidence</th><th>Mean Cycles</th></tr>'
+        output += f'<tr><td>{total["scans"]}</td><td>{total["saved"]}</td><td>{percent(total["rejection_rate"])}</td>'
+        output += f'<td>{total["undecoded"]}</td><td>{percent(total["mean_confidence"])}</td><td>{mean(total["mean_cycles"])}</td></tr></table>'
+
+        output += '<h2>Shifts</h2>'
+        output += '<table border="1"><tr><th>Shift</th><th>Scans</th><th>Saved</th><th>Rejected</th><th>Mean Confidence</th><th>Mean Cycles</th><th>Saved Values</th></tr>'
+        for shift in obj['shifts']:
+            values = ', '.join(f'{escape(value)} &times;{count}' for value, count in list(shift['values'].items())[:5])
+            output += f'<tr><td>{escape(shift["shift"])}</td><td>{shift["scans"]}</td><td>{shift["saved"]}</td>'
+            output += f'<td>{percent(shift["rejection_rate"])}</td><td>{percent(shift["mean_confidence"])}</td>'
+            output += f'<td>{mean(shift["mean_cycles"])}</td><td>{values}</td></tr>'
+        output += '</table>'
+
+        output += '<h2>Band Scores</h2><table border="1">'
+        for i, count in enumerate(total['score_histogram']):
+            output += f'<tr><td>{i / STATS_SCORE_BINS:.1f} - {(i + 1) / STATS_SCORE_BINS:.1f}</td><td>{count}</td></tr>'
+        output += '</table>'
+        output += '<h2>Stabilization Cycles</h2><table border="1">'
+        labels = [f'&le; {bound}' for bound in STATS_CYCLE_BUCKETS] + ['more']
+        for label, count in zip(labels, total['cycle_histogram']):
+            output += f'<tr><td>{label}</td><td>{count}</td></tr>'
+        output += '</table>'
+        output += '</body></html>'
+        self.send_body(200, 'text/html', output.encode(), validators, compressible=True)
+
+    def metrics_page(self):
+        '''
+        send the metrics of the pipeline and the server in the Prometheus text format
+        '''
+        output = metrics.registry.render()
+        output += metrics.render_gauge('oris_records', 'Scan records in the record index.', len(self._record_index))
+        event_stream = getattr(self.server, 'event_stream', None)
+        if event_stream is not None:
+            output += metrics.render_gauge('oris_event_clients', 'Browsers attached to the record event stream.',
+                                           event_stream.get_client_count())
+        batcher = getattr(self.server, 'detection_batcher', None)
+        if batcher is not None:
+            output += metrics.render_gauge('oris_remote_detection_queue_depth', 'Remote detection requests waiting for the detector.',
+                                           batcher.get_queue_depth())
+        self.send_body(200, metrics.PROMETHEUS_CONTENT_TYPE, output.encode(), {'cache-control': 'no-store'}, compressible=True)
+
+    def detect_page(self):
+        '''
+        run the band detection on an uploaded JPEG or PNG image and send the result as JSON
+        '''
+        batcher = getattr(self.server, 'detection_batcher', None)
+        if batcher is None:
+            self.send_error(404)
+            return
+
+        # the body is not read when the request is rejected, so the connection cannot be reused
+        content_len = self.headers.get('content-length')
+        if content_len is None:
+            self.close_connection = True
+            self.send_error(411)
+            return
+        try:
+            content_len = int(content_len)
+        except ValueError:
+            content_len = -1
+        if content_len < 0:
+            self.close_connection = True
+            self.send_json(400, {'error': 'The content length is not valid'})
+            return
+        if content_len > DETECT_MAX_IMAGE_BYTES:
+            self.close_connection = True
+            self.send_json(413, {'error': f'The image is larger than {DETECT_MAX_IMAGE_BYTES} bytes'})
+            return
+
+        try:
+            image = decode_image(self.rfile.read(content_len))
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+
+        t_start = time.monotonic()
+        try:
+            future = batcher.submit(image)
+        except DetectionBusyError:
+            raise ServerBusyError()
+        try:
+            result = future.result(timeout=self.timeout)
+        except (DetectionBusyError, FutureTimeoutError):
+            # the batcher skips a cancelled request, unless its batch is already running
+            future.cancel()
+            raise ServerBusyError()
+        obj = result_to_json(result)
+        obj['time_ms'] = round((time.monotonic() - t_start) * 1000, 1)
+        self.send_json(200, obj, {'cache-control': 'no-store'})
+
     def do_POST(self):
         '''
         Handle the 'POST' request to the server
         '''
-        if self.path.endswith('/search'):
+        t_start = time.perf_counter()
+        try:
+            self.handle_post()
+        finally:
+            self.observe_request(urlsplit(self.path).path, t_start)
+
+    def handle_post(self):
+        '''
+        route a 'POST' request to its page
+        '''
+        if urlsplit(self.path).path == '/detect':
+            try:
+                self.detect_page()
+            except ServerBusyError:
+                self.send_response(503)
+                self.send_header('Retry-After', '1')
+                self.send_header('content-length', '0')
+                self.end_headers()
+        elif self.path.endswith('/search'):
+            location = '/'
             ctype, pdict = cgi.parse_header(self.headers.get('content-type'))
             if 'boundary' in pdict:
                 pdict['boundary'] = bytes(pdict['boundary'], "utf-8")
@@ -147,15 +926,122 @@ class MyRequestHandler(BaseHTTPRequestHandler):
             if ctype == 'multipart/form-data':
                 fields = cgi.parse_multipart(self.rfile, pdict)
                 key = fields.get('search_date')
-                self.__class__._search_date = key[0]
+                if key and key[0]:
+                    location += '?' + urlencode({'from': key[0], 'to': key[0]})
+            else:
+                self.rfile.read(content_len)
 
-            self.send_response(301)
-            self.send_header('content-type', 'text/html')
-            self.send_header('Location',  '/')
+            self.send_response(303)
+            self.send_header('Location', location)
+            self.send_header('content-length', '0')
             self.end_headers()
+        else:
+            self.send_error(404)
+
+class PooledHTTPServer(HTTPServer):
+    '''
+        (Class) Http Server serving requests concurrently on a bounded pool of worker threads
+    '''
+    request_queue_size = SERVER_MAX_PENDING
+    def __init__(self, server_address, RequestHandlerClass, max_workers: int = SERVER_MAX_WORKERS,
+                       max_pending: int = SERVER_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http-worker')
+        self.slots = BoundedSemaphore(max_workers + max_pending)
+
+        self.connections_lock = Lock()
+        self.connections = set()
+        self.waiting = 0
+        self.closing = Event()
+        self.detached = set()
+        super().__init__(server_address, RequestHandlerClass)
+
+        self.event_stream = EventStream()
+        self.event_stream.start()
+        self.detection_batcher = None
+        if DETECT_ENDPOINT_ENABLED:
+            self.detection_batcher = DetectionBatcher()
+            self.detection_batcher.start()
+
+    def process_request(self, request, client_address):
+        '''
+        hand the request over to a worker, or reject it if too many requests are waiting already
+        '''
+        if not self.slots.acquire(blocking=False):
+            try:
+                request.sendall(b'HTTP/1.0 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self.connections_lock:
+            self.waiting += 1
+        future = self.executor.submit(self.process_request_worker, request, client_address)
+        future.add_done_callback(lambda future: self.release_cancelled_request(future, request))
+
+    def release_cancelled_request(self, future, request):
+        '''
+        close a request and free its slot if its worker was cancelled by server_close() before it started
+        '''
+        if not future.cancelled():
+            return
+        with self.connections_lock:
+            self.waiting -= 1
+        self.shutdown_request(request)
+        self.slots.release()
+
+    def process_request_worker(self, request, client_address):
+        with self.connections_lock:
+            self.waiting -= 1
+            self.connections.add(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.discard(request)
+                detached = request in self.detached
+                self.detached.discard(request)
+            if not detached:
+                self.shutdown_request(request)
+            self.slots.release()
+
+    def has_waiting(self) -> bool:
+        '''
+        return whether accepted connections are waiting for a free worker
+        '''
+        return self.waiting > 0
+
+    def detach(self, request):
+        '''
+        keep a connection open after its handler returns, because another thread has taken it over
+        '''
+        with self.connections_lock:
+            self.detached.add(request)
+
+    def server_close(self):
+        '''
+        close the listening socket, cut off all open connections and wait for the workers to finish
+        '''
+        self.closing.set()
+        super().server_close()
+        if getattr(self, 'event_stream', None) is not None:
+            self.event_stream.signal_stop()
+            self.event_stream.join()
+        if getattr(self, 'detection_batcher', None) is not None:
+            self.detection_batcher.signal_stop()
+            self.detection_batcher.join()
+        with self.connections_lock:
+            for request in self.connections:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.executor.shutdown(wait=True, cancel_futures=True)
 
 server_instance = None
 server_thread = None
+index_thread = None
 
 def my_serve_forever(http_server: HTTPServer):
     try:
@@ -163,23 +1049,84 @@ def my_serve_forever(http_server: HTTPServer):
     except Exception as error:
         print(error)
 
+def prune_render_cache(added: List[str], removed: List[str]):
+    '''
+    evict the thumbnails of deleted records after a change of the record index
+
+    parameter:
+        (list)added(the ids of the added or modified records)
+        (list)removed(the ids of the removed records)
+    '''
+    if removed:
+        MyRequestHandler._render_cache.prune(MyRequestHandler._record_index.get_ids())
+
+def publish_record_event(header: RecordHeader):
+    '''
+    push a newly saved record to the browsers watching the running server
+
+    parameter:
+        (RecordHeader)header(the header of the saved record)
+    '''
+    server = server_instance
+    if server is not None:
+        server.event_stream.publish('record', header_to_json(header))
+
+add_save_listener(publish_record_event)
+
 def start_http_server(port: int = 8080):
-    global server_instance, server_thread
+    global server_instance, server_thread, index_thread
     if server_instance is None and server_thread is None:
-        server_instance = HTTPServer(('0.0.0.0', port), MyRequestHandler)
+        handler = MyRequestHandler
+        if handler._render_cache is None:
+            handler._render_cache = RenderCache(handler._img_path, render_slots=handler._heavy_slots, render_timeout=SERVER_REQUEST_TIMEOUT)
+        server_instance = PooledHTTPServer(('0.0.0.0', port), MyRequestHandler)
+        index_thread = RecordIndexThread(MyRequestHandler._record_index, on_change=prune_render_cache)
+        index_thread.start()
         server_thread = Thread(target=my_serve_forever, args=(server_instance,))
         server_thread.start()
 
 def close_http_server():
-    global server_instance, server_thread
+    global server_instance, server_thread, index_thread
     if server_instance is not None and server_thread is not None:
         server_instance.shutdown()
         server_instance.server_close()
         server_thread.join()
-        server_instance = server_thread = None
+        index_thread.signal_stop()
+        index_thread.join()
+        server_instance = server_thread = index_thread = None
+
+def set_record_path(path: str):
+    '''
+    serve the records of another directory, which must be called before the server is started
+
+    parameter:
+        (str)path(the record directory)
+    '''
+    handler = MyRequestHandler
+    handler._abs_direct = os.path.abspath(path)
+    handler._img_path = os.path.join(handler._abs_direct, 'temp')
+    handler._render_cache = None
+    handler._record_index = RecordIndex(handler._abs_direct)
 
 if __name__ == '__main__':
+    import argparse, logging, signal
+    parser = argparse.ArgumentParser(description='Serve the scan records without the GUI.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--record-path', default=None, help='the record directory, defaults to RECORD_SAVE_PATH')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.record_path is not None:
+        set_record_path(args.record_path)
+    MyRequestHandler._stats_follow_file = True
+
+    e_stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: e_stop.set())
+    start_http_server(args.port)
     try:
-        start_http_server()
-    except Exception:
+        while not e_stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
         close_http_server()
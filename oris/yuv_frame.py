@@ -0,0 +1,121 @@
+from typing import Tuple
+
+import numpy as np
+import cv2
+
+SCENE_CHANGE_SCALE     = 8      # the factor luma is downscaled by before comparing scenes
+SCENE_CHANGE_THRESHOLD = 6.0    # the mean absolute luma difference above which a scene has changed
+FOCUS_SCORE_STEP       = 2      # the pixel step luma is subsampled with before scoring the focus
+
+def get_yuv_shape(resolution: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    Gets the shape of a YUV420 (I420) frame buffer: the Y plane followed by the U and V planes at
+    half resolution, as (height * 3 / 2, width) bytes.
+    Raises:
+        ValueError: If the resolution is not even.
+    """
+    width, height = resolution
+    if width % 2 or height % 2:
+        raise ValueError(f'YUV420 frames must have an even resolution, not {width}x{height}')
+    return height * 3 // 2, width
+
+def get_luma(yuv: np.ndarray) -> np.ndarray:
+    """
+    Gets the Y plane of a YUV420 frame, which is a grayscale image of it, without copying.
+    """
+    return yuv[:yuv.shape[0] * 2 // 3]
+
+def rgb_to_yuv(rgb: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+    """
+    Converts an RGB image into a YUV420 frame, into dst if given.
+    """
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2YUV_I420, dst=dst)
+
+def yuv_to_rgb(yuv: np.ndarray, rect: Tuple[int, int, int, int] = None, size: Tuple[int, int] = None) -> np.ndarray:
+    """
+    Converts a YUV420 frame, or only a region of it, into an RGB image.
+    Args:
+        yuv: The YUV420 frame.
+        rect: The region [x, y, w, h] to convert, or None for the whole frame.
+        size: The (width, height) to downscale the region to, or None to keep its resolution.
+              The planes are downscaled before the conversion, so only the output pixels are converted.
+    Returns:
+        The RGB image.
+    """
+    height, width = yuv.shape[0] * 2 // 3, yuv.shape[1]
+    if rect is None and size is None:
+        return cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_I420)
+    x, y, w, h = rect if rect is not None else (0, 0, width, height)
+
+    # chroma is subsampled by 2, so convert the region grown to even coordinates and trim it afterwards
+    x0, y0 = x - x % 2, y - y % 2
+    x1, y1 = min(x + w + (x + w) % 2, width), min(y + h + (y + h) % 2, height)
+    luma = yuv[y0:y1, x0:x1]
+    u = yuv[height:height + height // 4].reshape(height // 2, width // 2)[y0 // 2:y1 // 2, x0 // 2:x1 // 2]
+    v = yuv[height + height // 4:].reshape(height // 2, width // 2)[y0 // 2:y1 // 2, x0 // 2:x1 // 2]
+    dx, dy = x - x0, y - y0
+
+    if size is not None:
+        scale_x, scale_y = size[0] / w, size[1] / h
+        out_w, out_h = max(round((x1 - x0) * scale_x / 2) * 2, 2), max(round((y1 - y0) * scale_y / 2) * 2, 2)
+        luma = cv2.resize(luma, (out_w, out_h), interpolation=cv2.INTER_LINEAR)
+        u = cv2.resize(u, (out_w // 2, out_h // 2), interpolation=cv2.INTER_LINEAR)
+        v = cv2.resize(v, (out_w // 2, out_h // 2), interpolation=cv2.INTER_LINEAR)
+        dx, dy, w, h = round(dx * scale_x), round(dy * scale_y), size[0], size[1]
+
+    i420 = np.concatenate((luma.reshape(-1), u.reshape(-1), v.reshape(-1))).reshape(-1, luma.shape[1])
+    rgb = cv2.cvtColor(i420, cv2.COLOR_YUV2RGB_I420)
+    return rgb[dy:dy + h, dx:dx + w]
+
+def focus_score(luma: np.ndarray, step: int = FOCUS_SCORE_STEP) -> float:
+    """
+    Scores the sharpness of a grayscale image by the variance of its Laplacian; higher is sharper.
+    Args:
+        luma: The grayscale image, e.g. a region of get_luma().
+        step: The pixel step the image is subsampled with first, trading accuracy for speed.
+    """
+    laplacian = cv2.Laplacian(luma[::step, ::step], cv2.CV_16S)
+    return float(laplacian.var())
+
+class SceneChangeDetector:
+    def __init__(self, scale: int = SCENE_CHANGE_SCALE, threshold: float = SCENE_CHANGE_THRESHOLD):
+        """
+        Initializes the SceneChangeDetector object, which tells whether a grayscale image shows a
+        different scene than a reference image.
+        Args:
+            scale: The factor images are downscaled by before comparing them.
+            threshold: The mean absolute difference above which the scene has changed.
+        Notes:
+            The reference only changes through accept(), so a scene changing slowly over many
+            images is still detected once it differs enough from the reference.
+        """
+        self.scale = scale
+        self.threshold = threshold
+        self._reference: np.ndarray = None
+        self._last: np.ndarray = None
+
+    def difference(self, luma: np.ndarray) -> float:
+        """
+        Compares an image with the reference.
+        Args:
+            luma: The grayscale image, e.g. a region of get_luma().
+        Returns:
+            The mean absolute difference to the reference, or infinity without a reference.
+        """
+        size = (max(luma.shape[1] // self.scale, 1), max(luma.shape[0] // self.scale, 1))
+        self._last = cv2.resize(luma, size, interpolation=cv2.INTER_AREA)
+        if self._reference is None or self._reference.shape != self._last.shape:
+            return float('inf')
+        return float(cv2.absdiff(self._last, self._reference).mean())
+
+    def is_changed(self, luma: np.ndarray) -> bool:
+        """
+        Returns whether the scene has changed since the reference.
+        """
+        return self.difference(luma) > self.threshold
+
+    def accept(self):
+        """
+        Makes the image last compared the reference.
+        """
+        self._reference = self._last